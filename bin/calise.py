@@ -21,14 +21,16 @@
 #    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import sys
+from calise import startup
+startup.init(sys.argv)
+
 import gettext
 import locale
 import os
-import sys
 import logging
 import signal
 import time
-from subprocess import Popen, PIPE  # NOTE: probably temporary
 
 from calise.infos import __LowerName__
 from calise import optionsd as options
@@ -127,45 +129,41 @@ def cliInterface():
     print ''
 
 
-def isServiceAlive():
-    ''' temporary fix until proper implementation
-    Checks for a running service instance and if so, stops it (at the end of
-    execution, service will be started again, take a look at the end of this
-    page)
+def serviceClient():
+    ''' Connects to a running service instance (if any)
 
-    NOTE: This implementation is extremely experimental and temporary, real
-          implementation needs return codes from dbus objects (can be done
-          with tuple)
+    Returns a calise.client.serviceClient object on a private bus connection
+    (so that a camera lease is released by the service as soon as this
+    process exits, even on crashes), None if there's no service to talk to.
     '''
-    service_wasAlive = False
-    pcs = Popen(['calised', '--check'], stdout=PIPE, stderr=PIPE)
-    dmp = pcs.communicate()
-    # service alive and running
-    if ''.join(dmp[0].split('\n')) == "service is alive and running":
-        return True
-    # service alive and paused
-    elif ''.join(dmp[0].split('\n')) == "service is alive but paused":
-        return False
-    # service is not alive
-    elif ''.join(dmp[0].split('\n')) == "service is not alive":
-        return False
-    # warning: unable to check service execution
-    elif ''.join(dmp[0].split('\n')).startswith("warning: "):
+    try:
+        from calise.client import serviceClient
+    except ImportError:
+        # without dbus bindings there can't be any service either
         return None
+    sc = serviceClient(private=True)
+    if sc.connect() != 0:
+        return None
+    return sc
+
 
-def pauseService(action='pause'):
-    pcs = Popen(['calised', '--%s' % action], stdout=PIPE, stderr=PIPE)
-    dmp = pcs.communicate()
-    if ''.join(dmp[0].split('\n')).startswith("warning: "):
-        logger.warning("Unable to %s a running calised execution" % action)
-        return False
-    else:
-        return True
+def leaseCamera(sc):
+    ''' Borrows the camera from the service sc is connected to
 
+    Returns sc if the service gave the camera up (or wasn't using it), None
+    (sc closed) otherwise.
+    '''
+    if sc.lease() in (0, 2):
+        return sc
+    logger.warning(
+        "Unable to lease the camera from a running calised execution")
+    sc.close()
+    return None
 
 
 def main():
-    parseArguments(sys.argv[1:])
+    with startup.phase('arguments'):
+        parseArguments(sys.argv[1:])
     setNiceness(10)
     
     if (
@@ -181,21 +179,45 @@ def main():
         return 0
     
     keepOnly('profile')
-    logLevel, logFile = tempLoggerInit(sys.argv[0])
-    tempdir = os.path.dirname(logFile)
-    #setSetting('logfile', logFile)            # NOTE: service-only
-    lg = options.wlogger(logLevel, logFile)
+    with startup.phase('logger-init'):
+        logLevel, logFile = tempLoggerInit(sys.argv[0])
+        tempdir = os.path.dirname(logFile)
+        #setSetting('logfile', logFile)            # NOTE: service-only
+        lg = options.wlogger(logLevel, logFile)
     global logger
     logger = logging.getLogger('.'.join([__LowerName__, 'root']))    
     logger.info("Searching valid profiles within search paths")
-    loadProfile()
-    parseArguments(sys.argv[1:])
+    with startup.phase('profile-load'):
+        loadProfile()
+    with startup.phase('arguments'):
+        parseArguments(sys.argv[1:])
     finalLoggerInit(lg, logLevel, logFile)
     checkCalibrationNeed()
     options.settings = getSettings()
-    sa = isServiceAlive()
-    if sa is True:
-        sa = pauseService('pause')
+    # GUI can attach to a running service instead of pausing it
+    attach = bool(
+        options.settings.get('attach') and options.settings['gui'] and
+        os.getenv('DISPLAY') is not None)
+    with startup.phase('service-lease'):
+        sc = serviceClient()
+        running = False
+        if sc is not None:
+            from calise.client import DENIED
+            # a service which refuses to answer is still there, using the
+            # camera
+            running = sc.status() in (0, DENIED)
+        if running and attach:
+            # service keeps running, the camera is leased only if the gui
+            # ends up capturing by itself (see calise.QtGui.newParser)
+            pass
+        elif running:
+            # borrow the camera, the service takes it back on release
+            sc = leaseCamera(sc)
+        else:
+            options.settings['attach'] = False
+            if sc is not None:
+                sc.close()
+                sc = None
     # remove temporary directories
     # NOTE: interactive-only
     try:
@@ -216,23 +238,27 @@ def main():
     # NOTE: interactive-only from now on
     if os.getenv('DISPLAY') is not None and options.settings['gui'] is True:
         try:
-            import calise.QtGui
-            rc = calise.QtGui.gui(options.settings)
-            if sa is True:
-                sa = pauseService('resume')
+            with startup.phase('gui-import'):
+                import calise.QtGui
+            rc = calise.QtGui.gui(options.settings, sc)
+            if sc is not None:
+                sc.release()
             return rc
         except ImportError:
             logger.warning(
                 'Not able to load Pyqt4 module, using cli-interface')
             options.settings['gui'] = False
+            if sc is not None and attach:
+                # no gui to attach, capture from the camera
+                sc = leaseCamera(sc)
     printBriefInfos()
     from calise.ExecThreads import ExecThread
     global trd
     trd = ExecThread(options.settings)
     trd.start()
     cliInterface()
-    if sa is True:
-        sa = pauseService('resume')
+    if sc is not None:
+        sc.release()
     return 0
 
 
@@ -21,15 +21,16 @@
 #    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import os
 import sys
+from calise import startup
+startup.init(sys.argv)
+
+import os
 import logging
 import tempfile
-import dbus
 
 from calise.infos import __LowerName__
 from calise import optionsd as options
-from calise.dbusService import service
 from calise.extServiceFunctions import getDbusSession, tempUtils, clearTempdir
 
 
@@ -109,14 +110,20 @@ def checkExecArguments(args):
 
 
 # service-start function
+# NOTE: service-only modules (gobject, camera, ephem, ...) are imported here,
+#       so that client commands sent to a running service only load what's
+#       needed to query it through DBus
 def mainService(kargs):
+    # Check for arguments inadmissibility (before loading anything, since
+    # there's no service to talk to)
+    checkServiceCommands(kargs.args.keys())
+    with startup.phase('service-import'):
+        from calise.dbusService import service
     retCode = 0
     # Set 'niceness' level to 10 if process has not been 'niced' by the user
     niceness = os.nice(0)
     if niceness == 0:
         niceness = os.nice(10)
-    # Check for arguments inadmissibility
-    checkServiceCommands(kargs.args.keys())
     # Leave only profile setting on settings global so that when
     # options.profiler executes, it has no existing settings (which, due to
     # function behaviour, won't overwrite)
@@ -138,11 +145,13 @@ def mainService(kargs):
     # Obtain valid profile
     pf = options.profiler()
     logger.info("Searching valid profiles within search paths")
-    for cf in options.get_path(options.settings['profile']):
-        pf.check_config(cf)
+    with startup.phase('profile-load'):
+        for cf in options.get_path(options.settings['profile']):
+            pf.check_config(cf)
     # Parse arguments (seriously this time)
-    kargs.init_args()
-    kargs.parse_settings()
+    with startup.phase('arguments'):
+        kargs.init_args()
+        kargs.parse_settings()
     options.checkSettingsArguments()
     if logLevel != options.settings['loglevel']:
         if checkLogLevelSyntax(options.settings['loglevel'], logLevel):
@@ -182,7 +191,8 @@ def mainService(kargs):
         if os.path.isfile(logFile):
             os.chmod(logFile, 0644)
         # Start service
-        ms = service(options.settings, not bool(os.getuid()))
+        with startup.phase('service-init'):
+            ms = service(options.settings, not bool(os.getuid()))
         ms.runLoop()
         # Exit cleanage
         if os.path.isfile(logFile):
@@ -192,6 +202,7 @@ def mainService(kargs):
 
 
 def queryService(cbus, queryArgs, execArgs):
+    import dbus
     bus = cbus()
     busObject = 'org.%s.service' % __LowerName__
     busPath = '/org/%s/service' % __LowerName__
@@ -235,9 +246,10 @@ def queryService(cbus, queryArgs, execArgs):
 
 def main():
     # Arguments parse
-    ap = options.serviceGetArgs(sys.argv[1:])
-    ap.init_args()
-    ap.parse_settings()
+    with startup.phase('arguments'):
+        ap = options.serviceGetArgs(sys.argv[1:])
+        ap.init_args()
+        ap.parse_settings()
     # critical errors checks
     rc = checkExecArguments(ap.execArgs)
     if type(rc) == tuple:
@@ -269,7 +281,9 @@ def main():
             # process terminated without clearing
             clearTempdir(tu.pidfile)
             return 20
-        elif tu.uid == 0:
+        # DBus bindings are loaded only to talk to a running service
+        import dbus
+        if tu.uid == 0:
             # process started by root
             sbus = dbus.SystemBus
         elif tu.uid == os.getuid():
@@ -295,7 +309,9 @@ def main():
                 % sys.argv[0])
             return 22
         # query DBus bus
-        qs = queryService(sbus, ap.queryArgs.keys(), ap.execArgs.keys())
+        with startup.phase('query'):
+            qs = queryService(
+                sbus, ap.queryArgs.keys(), ap.execArgs.keys())
         if qs == 21:
             clearTempdir(tu.pidfile)
         return qs
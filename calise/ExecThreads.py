@@ -23,6 +23,9 @@ import threading
 
 from calise.capture import imaging
 from calise.system import execution
+from calise.backlight import backlightGroup, parseGroup, transition
+from calise.lease import cameraLease, INTERACTIVE
+from calise import startup
 
 
 class ExecThread(threading.Thread):
@@ -35,16 +38,16 @@ class ExecThread(threading.Thread):
         self.func.main()
 
 
-class mainLoop():
+class mainLoop(object):
 
     def __init__(self, settings):
         self.resetComers()
         self.arguments = settings
         self.step0 = None # capture class
         self.step1 = None # execution class
-        self.lock = None
+        self.lease = None # camera lease
         self.ValuesAverage = 0
-        self.sig = '' # signal: can be either quit, pause, resume or export
+        self._sig = '' # signal: can be either quit, pause, resume or export
         self.timeref = None
         self.basetime = None
         self.sct = 5 # seconds between screencaptures:
@@ -52,6 +55,17 @@ class mainLoop():
                      # maybe it can increased
         self.ExpPath = self.arguments['recfile']  # data export path
     
+    def getSig(self):
+        return self._sig
+
+    # quit has to wake up a thread waiting for the camera lease
+    def setSig(self, sig):
+        self._sig = sig
+        if sig == 'quit' and self.lease is not None:
+            self.lease.wake()
+
+    sig = property(getSig, setSig)
+
     def resetComers(self):
         self.newcomers = {
             "amb": None,  # ambient brightness
@@ -80,6 +94,7 @@ class mainLoop():
             # PAUSE / RESUME
             elif self.sig == 'pause':
                 self.step0.stopCapture()
+                self.lease.release()
                 if not self.arguments['gui']:
                     sys.stdout.write('\n  =====  PAUSE  =====  \r')
                     sys.stdout.flush()
@@ -91,6 +106,9 @@ class mainLoop():
                         self.sig='pause'
                     time.sleep(sleeptime)
                 if self.sig is not 'quit':
+                    if self.lease.acquire(
+                        stop=lambda: self.sig == 'quit') != 0:
+                        return True
                     self.step0.startCapture()
             # EXPORT
             elif self.sig == 'export':
@@ -148,17 +166,36 @@ class mainLoop():
             self.arguments['invert'],
             self.arguments['offset'],
             self.arguments['delta'],
+            self.arguments['jump'],
             pos = self.arguments['path'],
+            band = self.arguments['band'],
+            tau = self.arguments['tau'],
+            exp = self.arguments['exponent'],
         )
-        self.lock = _locker()
+        if self.arguments.get('bkgroup'):
+            self.step1.group = backlightGroup(
+                parseGroup(self.arguments['bkgroup']))
+        if self.arguments.get('bktrans'):
+            self.step1.transition = transition(
+                self.arguments['path'], self.arguments['bktrans'],
+                self.arguments.get('bkrate') or 20.0)
+            self.step1.transition.start()
         self.basetime = time.time() - self.sct
-        self.step0.initializeCamera(self.arguments['cam'])
-        self.step0.startCapture()
+        with startup.phase('camera-init'):
+            self.step0.initializeCamera(self.arguments['cam'])
+            # wait for other calise programs using the camera (if any)
+            self.lease = cameraLease(self.step0.camPath, INTERACTIVE)
+            self.lease.acquire()
+            self.step0.startCapture()
         self.step0.getFrameBriSimple()
+        startup.mark('first-frame')
 
     def mainEd(self):
         self.step0.stopCapture()
         self.step0.freeCameraObj()
+        self.lease.release()
+        if self.step1.transition:
+            self.step1.transition.stop()
 
     def exeloop(self):
         self.timeref = time.time() # start time of the loop
@@ -176,15 +213,9 @@ class mainLoop():
             self.step0.scr = 0.0
         self.step1.elaborate(
             self.step0.amb, self.step0.scr, self.arguments['scrmul'])
-        if ((
-            self.arguments['auto']
-            ) and (
-            self.lock.lock is False or
-            len(self.step1.data['percent']) < 15 or
-            abs(self.step1.data['step'][-1] - self.step1.data['bkstp'][-1]) > 1
-        )):
+        if self.arguments['auto']:
             if self.step1.WriteStep() is True:
-                self.lock.put()
+                startup.mark('first-backlight-write')
         self.step1.PopDataValues(self.arguments['avg'])
         if self.arguments['record']:
             for val in self.step1.data:
@@ -210,12 +241,11 @@ class mainLoop():
                     "STP", self.step1.data['step'][-1],
                     "AVG", round(self.ValuesAverage,2), "%",
                     "N", len(self.step1.data['percent']),
-                    "⚷" if self.lock.lock == True else " ",
+                    "»" if self.step1.ctl.settling == True else " ",
                     "⌚" if self.arguments['record'] == True else " ",
                 )
             )
         sys.stdout.flush()
-        self.lock.check()
 
     '''Initializes all iterated classes and starts main loop: gets everything
     needed, computates/executes and print the result according to the verbosity
@@ -229,28 +259,3 @@ class mainLoop():
                 break
         self.mainEd()
 
-
-class _locker():
-
-    lock = None
-    timestamp = None
-    duration = None # lock duration (in sec)
-
-    def __init__(self):
-        self.duration = 45
-
-    def expireTime(self):
-        try: return self.timestamp - time.time() + self.duration
-        except: return None
-
-    def check(self):
-        if self.lock is True:
-            if self.expireTime() <= 0: self.release()
-
-    def put(self):
-        self.lock = True
-        self.timestamp = time.time()
-
-    def release(self):
-        self.lock = False
-        self.timestamp = None
\ No newline at end of file
@@ -24,7 +24,7 @@ from PyQt4 import QtGui, QtCore
 
 from calise.capture import imaging
 from calise.system import execution
-from calise.ExecThreads import mainLoop, _locker
+from calise.ExecThreads import mainLoop
 from calise import infos
 from calise.widgets import AvdancedInfo, BacklightWidget
 
@@ -32,6 +32,7 @@ from calise.widgets import AvdancedInfo, BacklightWidget
 app = None       # QApplication
 palette = None   # palette object corresponding to system palette (from theme)
 arguments = None # dictionary with arguments (first data) returned by thread
+service = None   # running service client (calise.client), if any
 procData = None  # dictionary with current thread data, updated every capture
 
 
@@ -49,7 +50,7 @@ class MainWid(QtGui.QWidget):
         # vars and high level widgets declaration
         self.AddIn = AvdancedInfo()
         self.bbw = BacklightWidget(palette)
-        self.com = LineParser() # QThread executer and parser
+        self.com = newParser() # QThread executer (or service attacher)
 
         # low level widgets
         self.AddInBtn = QtGui.QPushButton(
@@ -125,13 +126,16 @@ class MainWid(QtGui.QWidget):
         self.AddIn.hide()
         self.RecordBtn.hide()
         self.ExportBtn.hide()
+        if isinstance(self.com, ServiceParser):
+            # data is recorded by the service, not there
+            self.RecordBtn.setEnabled(False)
+            self.ExportBtn.setEnabled(False)
         self.setLayout(MainVbox)
 
     def OnPause(self, boolean):
         if boolean:
             self.com.td.sig = 'pause'
             self.bbw.enPause(True)
-            self.bbw.repaint()
         else:
             self.com.td.sig = 'resume'
             self.bbw.enPause(False)
@@ -157,18 +161,17 @@ class MainWid(QtGui.QWidget):
         if self.bbw.isVisible(): self.updateBacklightMeter()
         if self.AddIn.isVisible() and procData != None: self.updateAddData()
 
-    # refreshes backlight bar meter values and repaints
+    # refreshes backlight bar meter values (repaint is up to the widget)
     def updateBacklightMeter(self):
-        if arguments: self.bbw.sps = arguments['steps']
+        steps = arguments['steps'] if arguments else None
         if procData:
-            self.bbw.bar = procData['average']
-            self.bbw.cur = ( procData['bkstp'] + 1 - arguments['bkofs'] )
-            self.bbw.tgt = ( procData['step'] + 1 - arguments['bkofs'] )
+            self.bbw.setValues(
+                procData['average'],
+                procData['bkstp'] + 1 - arguments['bkofs'],
+                procData['step'] + 1 - arguments['bkofs'],
+                steps)
         else:
-            self.bbw.bar = 0
-            self.bbw.cur = 0
-            self.bbw.tgt = 0
-        self.bbw.repaint()
+            self.bbw.setValues(0, 0, 0, steps)
 
     # refreshes every label in additional info panel
     def updateAddData(self):
@@ -180,10 +183,7 @@ class MainWid(QtGui.QWidget):
         self.AddIn.apLabel.setText('%3.2f%%' % procData['average'])
         self.AddIn.avLabel.setText('%d' % procData['valnum'])
         self.AddIn.cbLabel.setText('%2d' % procData['bkstp'])
-        if type(procData['lock']) is not str:
-            self.AddIn.ltLabel.setText('%.1f' % procData['lock'])
-        else:
-            self.AddIn.ltLabel.setText('%s' % procData['lock'])
+        self.AddIn.ltLabel.setText('%3.2f%%' % procData['smooth'])
 
     # bbwBarAction is connected to a signal emitted by backlight meter if the
     # user manually sets the backlight level (clicks on the bar).
@@ -394,6 +394,20 @@ class MainWindow(QtGui.QMainWindow):
             self.closeToTray.toggle()
         self.trayIcon.setVisible(boolean)
 
+    # captures are only needed (at higher rate) while the window is visible
+    def showEvent(self, event):
+        self.mainWidget.com.windowVisible(True)
+        QtGui.QMainWindow.showEvent(self, event)
+
+    def hideEvent(self, event):
+        self.mainWidget.com.windowVisible(False)
+        QtGui.QMainWindow.hideEvent(self, event)
+
+    def changeEvent(self, event):
+        if event.type() == QtCore.QEvent.WindowStateChange:
+            self.mainWidget.com.windowVisible(not self.isMinimized())
+        QtGui.QMainWindow.changeEvent(self, event)
+
     def contextMenuEvent(self, event):
         action = self.CtxMenu.exec_(self.mapToGlobal(event.pos()))
 
@@ -508,10 +522,7 @@ class LineParser(QtCore.QThread):
                 dataDict[idx] = self.td.step1.data[idx][-1]
             dataDict['average'] = self.td.ValuesAverage
             dataDict['valnum'] = len(self.td.step1.data['ambient'])
-            lockTime = self.td.lock.expireTime()
-            if lockTime is None or lockTime < 0:
-                lockTime = _('None')
-            dataDict['lock'] = lockTime
+            dataDict['smooth'] = self.td.step1.ctl.ema
             dataDict['rec'] = self.td.arguments['record']
             global procData
             procData = dataDict
@@ -520,12 +531,163 @@ class LineParser(QtCore.QThread):
                 break
         self.td.mainEd()
 
+    # own capture loop keeps running regardless of window visibility
+    def windowVisible(self, boolean):
+        pass
+
+
+class serviceProxy(object):
+    ''' mainLoop look-alike for ServiceParser
+
+    Translates execution signals (sig) to service DBus commands; recording and
+    export are left to the service (calised --dump-all).
+
+    NOTE: A service paused from the GUI is resumed when the GUI quits, a
+          pause not issued by the GUI (eg. calised --pause) is left alone.
+    '''
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.arguments = {'record': False}
+        self.ExpPath = None
+        self.paused = False  # service paused by this GUI
+        self._sig = ''
+
+    def getSig(self):
+        return self._sig
+
+    def setSig(self, sig):
+        from dbus.exceptions import DBusException
+        self._sig = sig
+        try:
+            if sig == 'pause' and not self.paused:
+                self.parser.iface.pause()
+                self.paused = True
+            elif sig == 'resume' and self.paused:
+                self.parser.iface.resume()
+                self.paused = False
+            elif sig == 'quit':
+                self.parser.windowVisible(False)
+                if self.paused:
+                    self.parser.iface.resume()
+                    self.paused = False
+        except DBusException as err:
+            # eg. pause/resume denied by the bus policy (see org.calise.conf)
+            sys.stderr.write(
+                "Unable to %s the service: %s\n"
+                % (sig, err.get_dbus_message()))
+
+    sig = property(getSig, setSig)
+
+
+class ServiceParser(QtCore.QObject):
+    ''' Running service attacher
+
+    Renders values pushed by calised (CaptureCompleted DBus signal) instead of
+    capturing from the camera. While the window is visible the service is
+    asked to capture at least every boostInterval seconds (boost is renewed
+    every boostRenew msecs since it expires on the service side), when hidden
+    or minimized the service goes back to its own schedule, so the GUI costs
+    no camera time.
+
+    NOTE: Same interface as LineParser (td, start, isRunning, windowVisible
+          and 'valueChanged()' and 'killReq()' signals).
+    '''
+
+    boostInterval = 5.0
+    boostRenew = 30000
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        from dbus.mainloop.qt import DBusQtMainLoop
+        from calise.client import serviceClient
+        self.client = serviceClient(DBusQtMainLoop())
+        if self.client.connect() != 0:
+            raise EnvironmentError("no running service found")
+        self.iface = self.client.iface
+        self.iface.connect_to_signal('CaptureCompleted', self.onCapture)
+        self.td = serviceProxy(self)
+        self.visible = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.boost)
+
+    def start(self):
+        global arguments
+        try:
+            for key, value in self.iface.settings([]).items():
+                if str(key) in ('steps', 'bkofs'):
+                    arguments[str(key)] = int(value)
+            self.onCapture(self.iface.values([]))
+        except Exception:
+            # no captures yet, wait for the first signal
+            pass
+
+    def isRunning(self):
+        return False
+
+    def onCapture(self, values):
+        values = dict([(str(k), v) for k, v in values.items()])
+        pct = float(values.get('pct', 0))
+        dataDict = {
+            'ambient': float(values.get('amb', 0)),
+            'screen': float(values.get('scr', 0)),
+            'correction': 0.0,
+            'percent': pct,
+            'average': pct,
+            'smooth': pct,
+            'step': int(values.get('sbs', arguments['bkofs'])),
+            'bkstp': int(values.get('cbs', arguments['bkofs'])),
+            'valnum': 1,
+            'rec': False,
+        }
+        global procData
+        procData = dataDict
+        QtCore.QObject.emit(self, QtCore.SIGNAL('valueChanged()'))
+
+    def boost(self):
+        try:
+            self.iface.boost(self.boostInterval)
+        except Exception:
+            self.timer.stop()
+
+    def windowVisible(self, boolean):
+        if boolean == self.visible:
+            return
+        self.visible = boolean
+        if boolean:
+            self.boost()
+            self.timer.start(self.boostRenew)
+        else:
+            self.timer.stop()
+            try:
+                self.iface.unboost()
+            except Exception:
+                pass
+
+
+# service attacher if requested (and possible), own capture loop otherwise
+def newParser():
+    if arguments.get('attach'):
+        try:
+            return ServiceParser()
+        except (ImportError, EnvironmentError) as err:
+            sys.stderr.write(
+                "Unable to attach to the service (%s), using the camera\n"
+                % err)
+            # borrow the camera, given back by the caller when the gui exits
+            if service is not None and service.lease() not in (0, 2):
+                sys.stderr.write(
+                    "Unable to lease the camera from the service\n")
+    return LineParser()
+
 
 class gui():
 
-    def __init__(self, settings):
+    def __init__(self, settings, client=None):
         global arguments
         arguments = settings
+        global service
+        service = client
         global app
         app = QtGui.QApplication(sys.argv)
         app.setQuitOnLastWindowClosed(False)
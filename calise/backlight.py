@@ -0,0 +1,265 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import threading
+import logging
+
+from calise.infos import __LowerName__
+
+
+logger = logging.getLogger(".".join([__LowerName__, 'backlight']))
+
+
+def stepFromPercentage(pct, steps, bkofs, invert=False):
+    ''' Brightness percentage to backlight step converter
+
+    Converts a 0 < 100 brightness percentage to a step of the given backlight
+    scale (steps starting from bkofs, eventually inverted), within bounds.
+    '''
+    stp = int(pct / (100.0 / steps) - .5 + bkofs)
+    if invert:
+        stp = steps - 1 + bkofs - stp + bkofs
+    # out-of-bounds control...
+    if stp > steps - 1 + bkofs:
+        stp = steps - 1 + bkofs
+    elif stp < bkofs:
+        stp = bkofs
+    return stp
+
+
+def percentageFromStep(stp, steps, bkofs, invert=False):
+    ''' Backlight step to brightness percentage converter (middle of the
+    percentage range stepFromPercentage maps to given step) '''
+    if invert:
+        stp = steps - 1 + bkofs - stp + bkofs
+    return (stp - bkofs + 1) * (100.0 / steps)
+
+
+class backlightDevice():
+    ''' Single sysfs backlight interface
+
+    path can be either the sysfs backlight directory or the brightness file
+    inside it. If steps are not given, the whole 1 < max_brightness range is
+    used (0 is avoided since on many panels it means backlight off).
+    '''
+
+    def __init__(self, path, steps=None, bkofs=None, invert=False):
+        if os.path.isdir(path):
+            path = os.path.join(path, 'brightness')
+        self.path = path
+        if bkofs is None:
+            bkofs = 1
+        if steps is None:
+            steps = self.read('max_brightness') + 1 - bkofs
+        self.steps = steps
+        self.bkofs = bkofs
+        self.invert = invert
+        self.cur = self.read()  # last known backlight step
+
+    def read(self, name='brightness'):
+        with open(os.path.join(os.path.dirname(self.path), name)) as fp:
+            return int(fp.readline())
+
+    def step(self, pct):
+        return stepFromPercentage(pct, self.steps, self.bkofs, self.invert)
+
+    def write(self, step):
+        with open(self.path, 'w') as fp:
+            fp.write(str(step) + "\n")
+        self.cur = step
+
+
+def parseGroup(string):
+    ''' Backlight group string to backlightDevice list converter
+
+    Group string (as stored in profiles) is a comma separated list of
+    "<path>[:<steps>:<offset>[:<invert>]]" entries.
+    '''
+    devices = []
+    for item in str(string).split(','):
+        fields = item.strip().split(':')
+        if not fields[0]:
+            continue
+        steps = bkofs = None
+        invert = False
+        if len(fields) == 2:
+            logger.warning(
+                "backlight interface '%s': steps given without offset, "
+                "ignored (\"<path>:<steps>:<offset>\" expected)" % fields[0])
+        try:
+            if len(fields) > 2:
+                steps, bkofs = int(fields[1]), int(fields[2])
+            if len(fields) > 3:
+                invert = fields[3].lower() in ['1', 'true', 'yes']
+            devices.append(backlightDevice(fields[0], steps, bkofs, invert))
+        except (IOError, ValueError) as err:
+            logger.warning(
+                "backlight interface '%s' skipped: %s" % (fields[0], err))
+    return devices
+
+
+class backlightGroup():
+    ''' Several backlight interfaces driven together
+
+    Every interface gets the step corresponding to the same brightness
+    percentage on its own scale. Writes are issued in parallel (one thread
+    per interface that actually needs a change), so that slow interfaces
+    (eg. external monitors) don't add up their latencies.
+
+    Usage: start(pct) ... join() or simply write(pct)
+    '''
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.threads = []
+        self.failed = 0     # failed writes on last batch
+
+    def _write(self, dev, stp):
+        try:
+            dev.write(stp)
+        except IOError as err:
+            self.failed += 1
+            logger.error(
+                "Unable to write backlight step %d on '%s': %s"
+                % (stp, dev.path, err))
+
+    def start(self, pct):
+        self.join()
+        self.failed = 0
+        for dev in self.devices:
+            stp = dev.step(pct)
+            if stp == dev.cur:
+                continue
+            th = threading.Thread(target=self._write, args=(dev, stp))
+            th.daemon = True
+            self.threads.append(th)
+            th.start()
+        return len(self.threads)
+
+    def join(self):
+        for th in self.threads:
+            th.join()
+        self.threads = []
+        return self.failed
+
+    def write(self, pct):
+        self.start(pct)
+        return self.join()
+
+
+class transition(threading.Thread):
+    ''' Smooth backlight transition engine
+
+    Ramps a sysfs brightness file towards the last requested target on its
+    own thread, going through every intermediate raw value allowed by the
+    interface (within duration seconds), at most rate writes per second.
+    Targets requested while a ramp is running supersede the previous one, the
+    ramp continues from the current value.
+
+    Usage: tr = transition(path); tr.start(); tr.setTarget(raw); tr.stop()
+
+    NOTE: writes counts all sysfs writes since the thread started.
+    '''
+
+    def __init__(self, path, duration=1.0, rate=20.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.device = backlightDevice(path, bkofs=0)
+        self.duration = float(duration)
+        self.rate = float(rate)
+        self.target = self.device.cur
+        self.pos = float(self.device.cur)  # current (non-rounded) ramp value
+        self.inc = 1.0  # raw values per write, set on each new target
+        self.writes = 0
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    # start a ramp towards target, 1 if there's nothing to do (the running
+    # ramp already goes there or, when idle, the device is already there)
+    def setTarget(self, target):
+        with self.lock:
+            if self.event.is_set():
+                if target == self.target:
+                    return 1
+            else:
+                # idle: start from actual value (may have been changed by
+                # someone else in the meantime)
+                self.device.cur = self.device.read()
+                self.pos = float(self.device.cur)
+                if target == self.device.cur:
+                    self.target = int(target)
+                    return 1
+            self.target = int(target)
+            # the whole (remaining) ramp has to fit within duration
+            ticks = max(self.duration * self.rate, 1.0)
+            self.inc = max(abs(self.target - self.pos) / ticks, 1.0)
+        self.event.set()
+        return 0
+
+    # True while a ramp is running
+    def ramping(self):
+        return self.event.is_set()
+
+    def next(self):
+        ''' Next ramp value to be written, None if target is reached '''
+        with self.lock:
+            if int(round(self.pos)) == self.target:
+                self.event.clear()
+                return None
+            if self.target > self.pos:
+                self.pos = min(self.pos + self.inc, self.target)
+            else:
+                self.pos = max(self.pos - self.inc, self.target)
+            return int(round(self.pos))
+
+    def run(self):
+        last = 0.0
+        while not self.stopped:
+            # untimed: a timed wait polls on python 2 (stop sets the event)
+            self.event.wait()
+            if not self.event.is_set():
+                continue
+            stp = self.next()
+            if stp is None:
+                logger.debug(
+                    "Backlight transition to %d completed (%d writes so far)"
+                    % (self.target, self.writes))
+                continue
+            wait = last + 1.0 / self.rate - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            last = time.time()
+            if stp == self.device.cur:
+                continue
+            try:
+                self.device.write(stp)
+                self.writes += 1
+            except IOError as err:
+                logger.error(
+                    "Unable to write backlight step %d on '%s': %s"
+                    % (stp, self.device.path, err))
+                # give up current ramp
+                with self.lock:
+                    self.pos = self.target
+                self.event.clear()
+
+    def stop(self):
+        self.stopped = True
+        self.event.set()
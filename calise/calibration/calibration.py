@@ -27,9 +27,12 @@ from select import select
 
 from calise.calibration.functions import *
 from calise.calibration.interactiveui import setBrightness
+from calise.calibration.fit import fitModel, residualReport
 from calise import console
 from calise.infos import __LowerName__
-from calise.capture import imaging
+from calise import optionsd
+from calise import udev
+from calise.capture import imaging, formatCaptureMode, formatControls
 from calise.system import computation
 from calise.sun import get_geo
 
@@ -199,6 +202,10 @@ class CliCalibration():
         fprnt(">>> " + _(
             "percentage: %.2f%% and backlight step: %d for current "
             "ambient brightness.") % (pct, cbs))
+        if self.FitPassage():
+            fprnt(">>> " + _(
+                "Fitted offset: %.1f, exponent: %.3f") % (
+                self.offset, self.exponent))
         fprnt(">>> " + _("Conversion scale delta: %.3f") % self.delta)
         fprnt("\n")
         self.WritePassage()
@@ -263,7 +270,7 @@ class CliCalibration():
         if not brPath:
             bfile_list = []
             scb = os.path.join("/", "sys", "class", "backlight")
-            for bd in os.listdir(scb):
+            for bd in udev.index.devices('backlight'):
                 brPath = os.path.join(str(scb), str(bd), 'brightness')
                 if os.path.isfile(brPath):
                     bfile_list.append(brPath)
@@ -326,11 +333,10 @@ class CliCalibration():
         # self.bfile type from list to string
         bkConf = searchExisting(bfile=self.bfile)
         if bkConf:
-            config = ConfigParser.RawConfigParser()
-            config.read(bkConf)
-            self.steps = config.getint('Backlight', 'steps')
-            self.bkofs = config.getint('Backlight', 'offset')
-            self.invert = config.getboolean('Backlight', 'invert')
+            prof = optionsd.load_profile(bkConf)
+            self.steps = prof.steps
+            self.bkofs = prof.bkofs
+            self.invert = prof.invert
         else:
             step0 = computation()
             step0.get_values('all', self.bfile)
@@ -373,14 +379,9 @@ class CliCalibration():
                 return lat, lon
         geoConf = searchExisting(coordinates=True)
         if geoConf:
-            config = ConfigParser.RawConfigParser()
-            config.read(geoConf)
-            if config.has_option('Daemon', 'latitude'):
-                lat = config.getfloat('Daemon', 'latitude')
-                lon = config.getfloat('Daemon', 'longitude')
-            elif config.has_option('Service', 'latitude'):
-                lat = config.getfloat('Service', 'latitude')
-                lon = config.getfloat('Service', 'longitude')
+            prof = optionsd.load_profile(geoConf)
+            lat = prof.latitude
+            lon = prof.longitude
             dummy = query_yes_no(customWrap(_(
                 "The program has found these coordinates (%s, %s) in an "
                 "existing profile, would you like to use these values also "
@@ -491,9 +492,7 @@ class CliCalibration():
     def OffsetPassage(self):
         camConf = searchExisting(camera=self.camera)
         if camConf:
-            config = ConfigParser.RawConfigParser()
-            config.read(camConf)
-            self.offset = config.getfloat('Camera', 'offset')
+            self.offset = optionsd.load_profile(camConf).offset
         else:
             raw_input(customWrap(_(
                 "Cover the webcam and then press [ENTER] or [RETURN]")))
@@ -502,13 +501,15 @@ class CliCalibration():
                 _("do not uncover the webcam") + "...")
             valThread = calCapture(
                 self.camera, self.bfile, self.steps, self.bkofs, self.invert)
-            startTime = time.time()
             valThread.start()
-            while valThread.getValCounter() < 40:
-                time.sleep(.1)
+            if not valThread.waitReady():
+                self.captureFailed()
             valThread.okToStop()
             valThread.join(10)
+            if valThread.average is None:
+                self.captureFailed()
             self.offset = valThread.average
+            self.capmode = valThread.cap.capMode
         return self.offset
 
     # CAN SKIP = NO
@@ -516,15 +517,24 @@ class CliCalibration():
         raw_input(customWrap(_(
             "Remove any obstruction from the camera and press [ENTER] or "
             "[RETURN] when ready to start")))
+        average, percentage, curStep = self.capturePoint()
+        self.delta = (average - self.offset) / (percentage ** 1.372)
+        self.exponent = None
+        # covered camera (offset) is a point too (0%)
+        self.points = [(self.offset, 0.0), (average, percentage)]
+        return percentage, curStep
+
+    # Captures ambient brightness while the user picks the best backlight
+    # step, returns (average ambient brightness, percentage, step)
+    def capturePoint(self):
         sys.stdout.write(_("Now calibrating") + "... ")
         sys.stdout.flush()
         valThread = calCapture(
                 self.camera, self.bfile, self.steps, self.bkofs, self.invert)
-        startTime = time.time()
         valThread.start()
         cap = imaging()
-        while valThread.getValCounter() < 40:
-            time.sleep(.1)
+        if not valThread.waitReady():
+            self.captureFailed()
         fprnt(_("Capture thread started."))
         time.sleep(0.75)
         sys.stdout.write('\n')
@@ -535,8 +545,42 @@ class CliCalibration():
         valThread.adjustValues(cap.scr)
         valThread.okToStop()
         valThread.join(10)
-        self.delta = (valThread.average - self.offset) / (percentage ** 1.372)
-        return percentage, curStep
+        if valThread.average is None:
+            self.captureFailed()
+        self.capmode = valThread.cap.capMode
+        self.ctrls = valThread.cap.ctrls
+        return valThread.average, percentage, curStep
+
+    # the camera stopped delivering frames: no values to go on with
+    def captureFailed(self):
+        sys.stderr.write('\n')
+        sys.stderr.write(_(
+            "Unable to get frames from the camera, calibration aborted. "
+            "Check that no other program is using it and try again") + '\n')
+        sys.exit(1)
+
+    # Optional additional points (different ambient brightness each), offset,
+    # delta and exponent are then fitted on all of them (see fit.fitModel)
+    # CAN SKIP = YES (user choice)
+    def FitPassage(self):
+        while query_yes_no(customWrap(_(
+            "Add a calibration point in a different ambient light (eg. "
+            "lights on/off, curtains open/closed)?")), 'no') == 'yes':
+            average, percentage, curStep = self.capturePoint()
+            self.points.append((average, percentage))
+            fprnt(">>> " + _("%d calibration points") % len(self.points))
+        if len(self.points) < 3:
+            return None
+        fitted = fitModel(self.points)
+        if fitted is None:
+            fprnt(_(
+                "Not enough different points to fit the conversion scale, "
+                "keeping single point calibration."))
+            return None
+        for line in residualReport(self.points, *fitted):
+            fprnt(line)
+        self.offset, self.delta, self.exponent = fitted
+        return fitted
 
     def WritePassage(self):
         fprnt(_("Building a config file with the choosen settings..."))
@@ -545,11 +589,17 @@ class CliCalibration():
         config.set('Camera', 'device', str(self.camera))
         config.set('Camera', 'delta', str(self.delta))
         config.set('Camera', 'offset', str(self.offset))
+        if self.exponent is not None:
+            config.set('Camera', 'exponent', str(self.exponent))
+        if self.ctrls:
+            config.set('Camera', 'controls', formatControls(self.ctrls))
         config.add_section('Backlight')
         config.set('Backlight', 'path', str(self.bfile))
         config.set('Backlight', 'steps', str(self.steps))
         config.set('Backlight', 'offset', str(self.bkofs))
         config.set('Backlight', 'invert', str(self.invert))
+        # (probed now if the interface hasn't been tested interactively)
+        config.set('Backlight', 'minimum', str(getMinimumLevel(self.bfile)))
         config.add_section('Service')
         if self.lat is not None:
             config.set('Service', 'latitude', self.lat)
@@ -563,6 +613,8 @@ class CliCalibration():
         config.set('Udev', 'attr', ';'.join(
                 ['%s=%s' % (x, self.udevice['ATTR'][x])
                 for x in self.udevice['ATTR']]))
+        if self.capmode is not None:
+            config.set('Udev', 'capture-mode', formatCaptureMode(self.capmode))
         try:
             with open(self.configpath, 'wb') as configfile:
                 config.write(configfile)
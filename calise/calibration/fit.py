@@ -0,0 +1,163 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Percentage model fitting
+
+computation.percentage maps ambient brightness to a percentage as
+
+    pct = ((amb - offset) / delta) ** exponent
+
+so that, for a given exponent, amb = offset + delta * pct ** (1 / exponent)
+is linear in offset and delta. Given (amb, pct) points (ambient brightness
+and the percentage of the backlight step chosen by the user), offset and
+delta are solved by linear least squares for each exponent and the exponent
+is the one which minimizes percentage residuals (golden section search).
+'''
+
+import math
+
+
+# exponent search range and precision
+expRange = (0.3, 1.5)
+expTolerance = 1e-4
+golden = (math.sqrt(5) - 1) / 2
+
+
+def fitLinear(points, exponent):
+    ''' Least squares (offset, delta) for given exponent, None if points
+    don't allow a solution (eg. all with the same percentage) '''
+    n = sx = sy = sxx = sxy = 0.0
+    for amb, pct in points:
+        x = max(pct, 0.0) ** (1 / exponent)
+        n += 1
+        sx += x
+        sy += amb
+        sxx += x * x
+        sxy += x * amb
+    den = n * sxx - sx * sx
+    if n < 2 or abs(den) < 1e-12:
+        return None
+    delta = (n * sxy - sx * sy) / den
+    offset = (sy - delta * sx) / n
+    return offset, delta
+
+
+def predict(amb, offset, delta, exponent):
+    if amb <= offset:
+        return 0.0
+    return ((amb - offset) / delta) ** exponent
+
+
+# percentage residuals (fitted - chosen) of given points
+def residuals(points, offset, delta, exponent):
+    return [
+        predict(amb, offset, delta, exponent) - pct for amb, pct in points]
+
+
+def score(points, exponent):
+    fit = fitLinear(points, exponent)
+    if fit is None or fit[1] <= 0:
+        return None, float('inf')
+    return fit, sum(r * r for r in residuals(points, fit[0], fit[1], exponent))
+
+
+def fitModel(points):
+    ''' Fits offset, delta and exponent on (amb, pct) points
+
+    Returns (offset, delta, exponent), None if there are less than three
+    distinct percentages (not enough for three parameters) or no valid fit
+    (positive delta) can be found.
+    '''
+    if len(set(pct for amb, pct in points)) < 3:
+        return None
+    low, high = expRange
+    a = high - golden * (high - low)
+    b = low + golden * (high - low)
+    fa, sa = score(points, a)
+    fb, sb = score(points, b)
+    while high - low > expTolerance:
+        if sa <= sb:
+            high, b, fb, sb = b, a, fa, sa
+            a = high - golden * (high - low)
+            fa, sa = score(points, a)
+        else:
+            low, a, fa, sa = a, b, fb, sb
+            b = low + golden * (high - low)
+            fb, sb = score(points, b)
+    fit, exponent = (fa, a) if sa <= sb else (fb, b)
+    if fit is None:
+        return None
+    return fit[0], fit[1], exponent
+
+
+class onlineFit():
+    ''' Incremental offset and delta fit (fixed exponent)
+
+    Exponentially weighted least squares sums: the current model is seeded
+    as prior points (0% and 50%, prior weight each) and every new point
+    (eg. a backlight step chosen by the user) decays older ones by decay, so
+    the model follows the user over time without ever forgetting the prior
+    completely after a few odd points.
+    '''
+
+    prior = 2.0
+    decay = 0.9
+
+    def __init__(self, offset, delta, exponent):
+        self.exponent = exponent
+        self.points = 0
+        self.sums = [0.0] * 5  # n, sx, sy, sxx, sxy
+        for pct in (0.0, 50.0):
+            x = pct ** (1 / exponent)
+            self.add(offset + delta * x, pct, self.prior)
+        self.offset = offset
+        self.delta = delta
+
+    def add(self, amb, pct, weight=1.0):
+        x = max(pct, 0.0) ** (1 / self.exponent)
+        for idx, val in enumerate((1.0, x, amb, x * x, x * amb)):
+            self.sums[idx] += weight * val
+
+    def update(self, amb, pct):
+        ''' Adds a point, returns new (offset, delta) or None if the fit is
+        not valid (non-positive delta) '''
+        self.sums = [s * self.decay for s in self.sums]
+        self.add(amb, pct)
+        self.points += 1
+        n, sx, sy, sxx, sxy = self.sums
+        den = n * sxx - sx * sx
+        if abs(den) < 1e-12:
+            return None
+        delta = (n * sxy - sx * sy) / den
+        if delta <= 0:
+            return None
+        self.offset = (sy - delta * sx) / n
+        self.delta = delta
+        return self.offset, self.delta
+
+
+def residualReport(points, offset, delta, exponent):
+    ''' Fit quality as printable lines: every point with its residual, then
+    root mean square and maximum residuals (percentage points) '''
+    res = residuals(points, offset, delta, exponent)
+    lines = ['%10s %10s %10s %10s' % ('ambient', 'chosen', 'fitted', 'error')]
+    for (amb, pct), r in zip(points, res):
+        lines.append('%10.1f %9.1f%% %9.1f%% %+9.1f' % (amb, pct, pct + r, r))
+    rms = math.sqrt(sum(r * r for r in res) / len(res))
+    lines.append('rms error: %.2f, max error: %.2f (percentage points)' % (
+        rms, max(abs(r) for r in res)))
+    return lines
@@ -21,58 +21,34 @@ import math
 import threading
 import time
 import ConfigParser
+from collections import deque
 from xdg.BaseDirectory import load_config_paths
 
 from calise import camera
 from calise import optionsd
+from calise import udev
 from calise.system import computation
 from calise.capture import imaging, processList, sDev
+from calise.lease import cameraLease, CALIBRATION
 
 
 def UdevQuery(interface='/dev/video0'):
     ''' Query interface's sysfs infos
 
-    Perform few queries to sysfs info paths to get detailed informations about
-    camera device.
+    Detailed informations about camera device, taken from the sysfs device
+    index (see calise.udev, sysfs is read only once per device).
     Information obtained are then stored in a dictionary: 'UDevice'.
 
     '''
-    UDevice = {
-        'KERNEL': None,
-        'DEVICE': None,
-        'SUBSYSTEM': None,
-        'DRIVER': None,
-        'ATTR': {},
-    }
-    # KERNEL
-    if os.path.islink(interface):
-        link = os.readlink(interface)
-        if link.startswith('/'):
-            interface = link
-        else:
-            interface = '%s%s' % (os.path.dirname(interface), link)
-    UDevice['KERNEL'] = interface.split('/')[-1]
-    #DEVICE
-    devicesPath = os.path.join('/sys', 'class', 'video4linux')
-    devicePath = os.path.join(devicesPath, UDevice['KERNEL'])
-    td = []
-    if os.path.islink(devicePath):
-        for x in os.readlink(devicePath).split('/'):
-            if x != '..':
-                td.append(x)
-    UDevice['DEVICE'] = os.path.join('/', td[0], td[1], td[2])
-    # SUBSYSTEM
-    subsystemPath = os.path.join(devicePath, 'subsystem')
-    if os.path.islink(subsystemPath):
-        UDevice['SUBSYSTEM'] = os.readlink(subsystemPath).split('/')[-1]
-    # DRIVER
-    UDevice['DRIVER'] = ''
-    # ATTR
-    for path in os.listdir(devicePath):
-        tmpPath = os.path.join(devicePath, path)
-        if os.path.isfile(tmpPath) and path != 'dev' and path != 'uevent':
-            with open(tmpPath, 'r') as fp:
-                UDevice['ATTR'][path] = ' '.join(fp.read().split())
+    UDevice = udev.query(interface)
+    if UDevice is None:
+        UDevice = {
+            'KERNEL': udev.resolve(interface),
+            'DEVICE': None,
+            'SUBSYSTEM': None,
+            'DRIVER': None,
+            'ATTR': {},
+        }
     return UDevice
 
 
@@ -86,29 +62,29 @@ def searchExisting(camera=None, bfile=None, coordinates=None):
           of profiles, ordered from higher to lower level.
     '''
     ret = None
-    config = ConfigParser.RawConfigParser()
     if camera:
         camera = UdevQuery(camera)['DEVICE']
     searchPaths = optionsd.get_path()
     # search profiles for given settings, when found, break
     for path in searchPaths:
-        if os.path.isfile(path):
-            config.read(path)
-            if camera and config.has_option('Udev', 'device'):
-                if config.get('Udev', 'device') == camera:
-                    ret = path
-            elif bfile and config.has_option('Backlight', 'path'):
-                if config.get('Backlight', 'path') == bfile:
-                    ret = path
-            elif (
-                coordinates and (
-                config.has_option('Daemon', 'latitude') and
-                config.has_option('Daemon', 'longitude')
-                ) or (
-                config.has_option('Service', 'latitude') and
-                config.has_option('Service', 'longitude')
-                )):
+        try:
+            prof = optionsd.load_profile(path)
+        except ConfigParser.Error:
+            continue
+        if prof is None:
+            continue
+        if camera and prof.get('udevdev') is not None:
+            if udev.sameDevice(camera, prof.udevdev):
+                ret = path
+        elif bfile and prof.get('path') is not None:
+            if prof.path == bfile:
                 ret = path
+        elif (
+            coordinates and
+            prof.get('latitude') is not None and
+            prof.get('longitude') is not None
+        ):
+            ret = path
         if ret:
             break
     return ret
@@ -160,26 +136,51 @@ class calCapture (threading.Thread):
     Especially, capture behaviour is set as follows: function takes values from
     the camera until okToStop() is called.
 
+    Frames are read as soon as the device delivers them (no fixed interval,
+    the measured frame rate is kept in fps) and stored as (timestamp, value)
+    pairs in a ring buffer trimmed to the last window seconds, so memory
+    doesn't grow with session length. The ready event is set once minimum
+    frames have been captured.
+
     '''
+
+    window = 10.0 # seconds of values kept
+    minimum = 40 # frames needed before ready is set
+
     def __init__(self, path, bfile, steps, bkofs, invert):
         self.cap = imaging()
         self.com = computation()
         self.path = path
-        self.data = []
+        self.data = deque()
+        self.dataLock = threading.Lock()
+        self.ready = threading.Event()
+        self.counter = 0
+        self.fps = None # measured device frame rate
+        self.average = None # set when the thread ends, if any value
+        self.dev = None
         self.bfile = bfile
         self.steps = steps
         self.bkofs = bkofs
         self.invert = invert
-        self.partial = 0
+        self.partial = 0 # timestamp of the last corrected value
+        self.stop = False
         threading.Thread.__init__(self)
 
-    # stop capture session through imaging.stop flag
+    # stop capture session
     def okToStop(self):
-        self.cap.stop = True
+        self.stop = True
 
     # return the number of captures done by the capture function
     def getValCounter(self):
-        return self.cap.counter
+        return self.counter
+
+    # waits until minimum frames have been captured, returns False if the
+    # thread terminated before
+    def waitReady(self):
+        while not self.ready.wait(1.0):
+            if not self.isAlive():
+                return False
+        return True
 
     def adjust_scale(self, cur=0):
         # set_flt needs a step value on the scale 0 < 100, so, if there's a
@@ -190,46 +191,73 @@ class calCapture (threading.Thread):
         ''' Screen compensation correction
 
         Screen compensation correction function customized for calibration.
-        Takes a 255based screen brightness value and corrects all data indexes
-        from last correction (from 0 if the first one). Actually replaces a
-        similar code sequence that was processed in "run" function.
+        Takes a 255based screen brightness value and corrects all values
+        captured after last correction (all if the first one). Actually
+        replaces a similar code sequence that was processed in "run" function.
 
         '''
-        idxTot = len(self.data)
-        for idx in range(self.partial, idxTot):
-            if os.getenv('DISPLAY') is None:
-                break
-            if scr > 0:
-                dstep = self.adjust_scale(
-                    self.com.get_values('step', self.bfile))
-                amul = self.cap.getScreenMul()
-                self.com.correction(self.data[idx], scr, amul, dstep)
-                self.data[idx] -= self.com.cor
-        self.partial = idxTot
+        if os.getenv('DISPLAY') is None or scr <= 0:
+            return
+        dstep = self.adjust_scale(self.com.get_values('step', self.bfile))
+        amul = self.cap.getScreenMul()
+        with self.dataLock:
+            data = deque()
+            for ts, val in self.data:
+                if ts > self.partial:
+                    self.com.correction(val, scr, amul, dstep)
+                    val -= self.com.cor
+                data.append((ts, val))
+            self.data = data
+            if data:
+                self.partial = data[-1][0]
 
     def run(self):
         ''' Thread loop function
 
-        After initializing/starting the device, through function getFrameBri
-        get a list of all values processed.
-        Since getFrameBri can have being run for a long time, only values old
-        not more than 10 seconds (more or less, read below) are kept.
+        After initializing/starting the device, reads frames until okToStop()
+        is called, then computes average and standard deviation of values
+        captured within the last window seconds.
 
-        NOTE: since cameras can only take a certain amount of fps, there can
-              be a slight error
+        NOTE: First frame is discarded (C module has 1 frame buffered).
+        NOTE: If the camera stops delivering frames (getFrameBriSimple
+              anti-lock timeout) the session ends there: camera and lease are
+              released anyway and average is computed on values got so far
+              (None if there's none, see waitReady).
         '''
         self.cap.initializeCamera(path=self.path)
-        self.cap.startCapture()
-        defInt = 2/30.0
-        startTime = time.time()
-        self.data = self.cap.getFrameBri(interval=defInt, loop=True, keep=True)
-        fps = sum(self.data) / (time.time() - startTime)
-        del self.data[:-(int(10 * fps))]
-        self.data = processList(self.data)
-        self.average = sum(self.data) / len(self.data)
-        self.dev = sDev(self.data, average=self.average)
-        self.cap.stopCapture()
-        self.cap.freeCameraObj()
+        # calibration takes precedence over any other calise program
+        lease = cameraLease(self.cap.camPath, CALIBRATION)
+        lease.acquire()
+        try:
+            self.cap.startCapture()
+            self.cap.getFrameBriSimple()
+            while not self.stop:
+                val = self.cap.getFrameBriSimple()
+                now = time.time()
+                with self.dataLock:
+                    self.data.append((now, val))
+                    while self.data[0][0] < now - self.window:
+                        self.data.popleft()
+                    if len(self.data) > 1:
+                        self.fps = (
+                            (len(self.data) - 1) / (now - self.data[0][0]))
+                self.counter += 1
+                if self.counter == self.minimum:
+                    self.ready.set()
+        except KeyboardInterrupt:
+            # anti-lock timer expired (capture session already stopped)
+            pass
+        finally:
+            self.cap.stopCapture()
+            self.cap.freeCameraObj()
+            lease.release()
+            with self.dataLock:
+                values = [val for ts, val in self.data]
+            if values:
+                # (few values may be all filtered out)
+                values = processList(values) or values
+                self.average = sum(values) / len(values)
+                self.dev = sDev(values, average=self.average)
 
 
 # tries to write "step number" step in "sys brightness file" bfile. If not able
@@ -259,31 +287,95 @@ def dec_convert(dec):
     return g, p, s
 
 
+# minimum accepted backlight values as {brightness path: value}, probed
+# once per run (then stored in profiles as [Backlight] minimum)
+minimumCache = {}
+
+
+def acceptsLevel(path, value, actual=None, settle=0.05, tries=10):
+    """ Backlight value probe
+
+    Writes value on given interface path, returns False if the interface
+    refuses it (IOError errno22). If actual (the actual_brightness path) is
+    given, value has also to be the one actually applied.
+
+    NOTE: Some drivers apply values asynchronously, so actual_brightness is
+          read again every settle seconds (tries times at most) until it
+          reports value or, once it moved from the previous value, stops
+          changing (the value has been clamped).
+    """
+    if actual is not None:
+        with open(actual) as fp:
+            before = int(fp.readline())
+    try:
+        with open(path, 'w') as fp:
+            fp.write(str(value))
+    except IOError as err:
+        if err.errno == 22:
+            return False
+        raise
+    if actual is None:
+        return True
+    readings = []
+    for x in range(tries):
+        if x:
+            time.sleep(settle)
+        with open(actual) as fp:
+            readings.append(int(fp.readline()))
+        if readings[-1] == value:
+            return True
+        if (
+            len(readings) > 1 and readings[-1] != before and
+            readings[-1] == readings[-2]
+        ):
+            break
+    return False
+
+
+def probeMinimumLevel(path):
+    """ Binary search of the minimum backlight value
+
+    Minimum accepted value is searched within 0 and max_brightness (which
+    has to be accepted), so it takes log2(max_brightness) writes at most.
+    Values are checked against actual_brightness too, unless the interface
+    doesn't report there the written values (max_brightness is checked
+    first). Current value is restored at the end.
+
+    """
+    currentValue = readInterfaceData(path)
+    interface = os.path.dirname(path)
+    maxValue = readInterfaceData(os.path.join(interface, 'max_brightness'))
+    actual = os.path.join(interface, 'actual_brightness')
+    if not (os.path.isfile(actual) and acceptsLevel(path, maxValue, actual)):
+        actual = None
+    low, high = 0, maxValue
+    try:
+        while low < high:
+            mid = (low + high) // 2
+            if acceptsLevel(path, mid, actual):
+                high = mid
+            else:
+                low = mid + 1
+    finally:
+        writeInterfaceData(path, currentValue)
+    return low
+
+
 def getMinimumLevel(path):
     """ Obtain minimum backlight step level
 
-    Write values on given interface path until no IOError errno22 is returned
-    (IOError:errno22 means the value is not acceptable).
+    Taken from previous probes, then from the profile of given interface path
+    ([Backlight] minimum), else probed (see probeMinimumLevel).
 
     """
-    errMsgTimeout = "write() function timed-out"
-    currentValue = readInterfaceData(path)
-    startTime = time.time()
-    minValue = 0
-    while True:
-        try:
-            with open(path, 'w') as fp:
-                fp.write(str(minValue))
-                break
-        except IOError as err:
-            if err.errno == 22:
-                minValue += 1
-        if time.time() - startTime > 1:
-            sys.stderr.write(errMsgTimeout + '\n')
-            sys.exit(1)
-    with open(path, 'w') as fp:
-        fp.write(str(currentValue))
-    return minValue
+    if path in minimumCache:
+        return minimumCache[path]
+    conf = searchExisting(bfile=path)
+    if conf and optionsd.load_profile(conf).get('bkmin') is not None:
+        minimumCache[path] = optionsd.load_profile(conf).bkmin
+    else:
+        minimumCache[path] = probeMinimumLevel(path)
+    return minimumCache[path]
 
 
 def readInterfaceData(path):
@@ -19,16 +19,22 @@ import os
 import errno
 import time
 import logging
+import threading
 
 from subprocess import Popen, PIPE
 
 from calise import camera
 from calise import screenBrightness
+from calise import metrics
 from calise.infos import __LowerName__
 
 
 logger = logging.getLogger(".".join([__LowerName__, 'capture']))
 
+# pixel formats the camera module is able to process, in order of preference
+# (greyscale frames carry luma only, that's all brightness computation needs)
+captureFormats = ['GREY', 'YUYV']
+
 
 def processList(lista):
     ''' processs() wrapper if launched outside capture process
@@ -108,6 +114,86 @@ def sDev(lista, average=None):
     return dev
 
 
+def parseCaptureMode(string):
+    ''' Capture mode string to tuple converter
+
+    Converts a "<fourcc> <width>x<height> [<num>/<den>]" string (as stored in
+    profiles) into a (fourcc, width, height, num, den) tuple, suitable for
+    camera.Device.setFormat(). Returns None if the string is not valid.
+    '''
+    try:
+        fields = str(string).split()
+        fourcc = fields[0]
+        width, height = [int(x) for x in fields[1].split('x')]
+        if len(fields) > 2:
+            num, den = [int(x) for x in fields[2].split('/')]
+        else:
+            num, den = 0, 0
+    except (ValueError, IndexError):
+        return None
+    if len(fourcc) != 4:
+        return None
+    return fourcc, width, height, num, den
+
+
+def formatCaptureMode(mode):
+    ''' Inverse of parseCaptureMode() '''
+    fmtstr = "%s %dx%d" % mode[:3]
+    if mode[3] and mode[4]:
+        fmtstr += " %d/%d" % mode[3:]
+    return fmtstr
+
+
+def cheapestMode(modes):
+    ''' Choose the least expensive capture mode
+
+    Among modes listed by camera.Device.listFormats() (only the ones whose
+    pixel format can be processed by the camera module) choose the one with
+    the smallest frame size, then the longest frame interval (lowest fps),
+    then the most preferred pixel format.
+    Returns None if no mode is usable.
+    '''
+    best = None
+    bestKey = None
+    for mode in modes:
+        fourcc, width, height, num, den = mode
+        if fourcc not in captureFormats:
+            continue
+        if num and den:
+            fps = den / float(num)
+        else:
+            # unknown frame rate, prefer any known one
+            fps = float('inf')
+        key = (width * height, fps, captureFormats.index(fourcc))
+        if bestKey is None or key < bestKey:
+            best = tuple(mode)
+            bestKey = key
+    return best
+
+
+def parseControls(string):
+    ''' Controls string to dictionary converter
+
+    Converts a "<id>:<value>,<id>:<value>,..." string (as stored in profiles)
+    into a {id: value} dictionary. Invalid entries are skipped.
+    '''
+    ctrls = {}
+    for item in str(string).split(','):
+        try:
+            x, value = [int(k) for k in item.split(':')]
+        except ValueError:
+            continue
+        ctrls[x] = value
+    return ctrls
+
+
+def formatControls(ctrls):
+    ''' imaging.ctrls to controls string (see parseControls()) converter '''
+    return ','.join([
+        '%s:%d' % (idx, ctrls[idx]['new']) for idx in sorted(ctrls.keys())
+        if ctrls[idx]['new'] is not None])
+
+
 # default (and pretty simple) Error for camera class
 class CameraError(Exception):
 
@@ -140,15 +226,23 @@ class imaging():
         self.amb = None         # ambient brightness 0 < 255
         self.scr = None         # screen brightness 0 < 255
         self.ctrls = {}         # controls (all queried) dictionary
+        self.ctrlTargets = None # {control id: value} set from calibration
+        self.ctrlSaved = 0      # control ioctls avoided (see adjustCtrls)
         self.stop = None        # readFrame loop control flag
         self.logger = logging.getLogger(".".join([__LowerName__, 'capture']))
         self.deviceStatus = None
+        self.opened = False     # device node open (capture session or not)
         self.authorizer = None
         self.counter = 0
+        self.capMode = None     # (fourcc, width, height, num, den) tuple
+        self.negotiated = False # True if capMode has been negotiated now
 
     # defines the camera to be used, path has to be a valid device path like
-    # '/dev/video', if no path is given, first cam of camera.camPaths is taken
-    def initializeCamera(self, path=None):
+    # '/dev/video', if no path is given, first cam of camera.camPaths is taken.
+    # mode is an optional capture mode string (see parseCaptureMode), if not
+    # given, the cheapest mode is negotiated on first capture start.
+    # ctrls is an optional controls string (see parseControls)
+    def initializeCamera(self, path=None, mode=None, ctrls=None):
         camPaths = camera.listDevices()
         if not camPaths:
             raise CameraError(2, "No available cameras found.")
@@ -157,17 +251,54 @@ class imaging():
         else:
             logger.warning(
                 "given camera ('%s') not among valid v4l2 cameras, using "
-                "first available camera ('%s') instead" % camPaths[0])
+                "first available camera ('%s') instead"
+                % (path, camPaths[0]))
             camPath = camPaths[0]
         self.camPaths = camPaths
         self.camPath = camPath
         self.cameraObj = camera.Device()
         self.cameraObj.setName(self.camPath)
+        if mode is not None and camPath == path:
+            self.capMode = parseCaptureMode(mode)
+            if self.capMode is None:
+                logger.warning("invalid capture mode '%s', ignored" % mode)
+        if ctrls is not None:
+            self.ctrlTargets = parseControls(ctrls)
+
+    def negotiateFormat(self):
+        ''' Capture mode negotiation
+
+        Asks the (opened) device for every supported size, pixel format and
+        frame interval and picks the cheapest one (see cheapestMode()).
+        If the device doesn't enumerate its modes, module defaults are kept.
+
+        NOTE: self.negotiated is set so that callers know that the choice has
+              to be stored (eg. in the profile) to skip negotiation next time.
+        '''
+        try:
+            modes = self.cameraObj.listFormats()
+        except camera.Error as err:
+            logger.debug(
+                "Unable to enumerate capture modes: %s"
+                % err[1].rstrip('\n'))
+            modes = []
+        self.capMode = cheapestMode(modes)
+        if self.capMode is not None:
+            self.negotiated = True
+            logger.info(
+                "Capture mode negotiated: %s"
+                % formatCaptureMode(self.capMode))
+        return self.capMode
 
     def startCapture(self):
         if self.deviceStatus is True:
             return
         self.cameraObj.openPath()
+        self.opened = True
+        if self.capMode is None:
+            self.negotiateFormat()
+        if self.capMode is not None:
+            self.cameraObj.setFormat(*self.capMode)
         self.adjustCtrls()
         try:
             self.cameraObj.initialize()
@@ -176,7 +307,18 @@ class imaging():
                 logger.error(err[1].rstrip('\n'))
                 self.restoreCtrls()
                 self.cameraObj.closePath()
+                self.opened = False
                 raise KeyboardInterrupt
+            elif err[0] == errno.EINVAL and not self.negotiated:
+                # stored capture mode no longer accepted by the device (eg.
+                # camera replaced), negotiate again
+                logger.warning(
+                    "Capture mode %s refused by the device"
+                    % formatCaptureMode(self.capMode))
+                self.negotiateFormat()
+                if self.capMode is not None:
+                    self.cameraObj.setFormat(*self.capMode)
+                self.cameraObj.initialize()
         self.cameraObj.startCapture()
         self.deviceStatus = True
 
@@ -187,8 +329,34 @@ class imaging():
         self.cameraObj.uninitialize()
         self.restoreCtrls()
         self.cameraObj.closePath()
+        self.opened = False
         self.deviceStatus = False
 
+    def detachCamera(self):
+        ''' Forgets a camera which is gone (eg. unplugged)
+
+        Capture session is dropped ignoring device errors and adjusted
+        controls are forgotten (device state is lost together with the
+        device), so that a camera coming back, even on the same path, starts
+        from scratch (see initializeCamera).
+        '''
+        if self.cameraObj is None:
+            return
+        steps = []
+        if self.deviceStatus is True:
+            steps = [self.cameraObj.stopCapture, self.cameraObj.uninitialize]
+        if self.opened:
+            steps.append(self.cameraObj.closePath)
+        for step in steps:
+            try:
+                step()
+            except camera.Error:
+                pass
+        self.opened = False
+        self.deviceStatus = False
+        self.ctrls = {}
+        self.freeCameraObj()
+
     def freeCameraObj(self):
         ''' Frees cameraObj (to re-inizialize or on TERMINATE)
 
@@ -215,6 +383,8 @@ class imaging():
             try:
                 val = self.cameraObj.readFrame()
             except camera.Error as err:
+                if errno.EAGAIN == err[0]:
+                    metrics.inc('frame_eagain_total')
                 if time.time() - expiryTimer > 5:
                     self.stopCapture()
                     logger.error(
@@ -227,6 +397,8 @@ class imaging():
                     time.sleep(1.0 / 30.0)  # 1/30 is arbitrary
                 else:
                     raise
+        metrics.inc('frames_total')
+        metrics.observe('frame_seconds', time.time() - expiryTimer)
         self.amb = val
         #logger.debug("Ambient brightness value got %s" % val)
         return val
@@ -234,9 +406,9 @@ class imaging():
     def getFrameBri(self, interval=None, captures=1, loop=False, keep=True):
         ''' Get brightness from a camera frame
 
-        Inside the C module camera takes a 160x120 picture and computes its
-        brightness. If camera is not ready yet, a CameraError.EAGAIN is
-        raised.
+        Inside the C module camera takes a picture (160x120 unless a cheaper
+        mode has been negotiated) and computes its brightness. If camera is
+        not ready yet, a CameraError.EAGAIN is raised.
 
         NOTE: C module has 1 frame buffered (should change this behavior) so
               it's needed to have 2 captures to get *real* frame.
@@ -324,10 +496,16 @@ class imaging():
 
         A dictionary containing all controls above data is created so that
         then it's possible to restore values to old ones.
-
-        TODO: Remember controls setting from calibration (through profile) and
-              set them to now to calibration ones
+        Controls are set to calibration values (self.ctrlTargets, taken from
+        the profile) if available, to their *disable* value otherwise.
+
+        Controls are queried at every session, so that the values restored
+        by restoreCtrls are the ones found on the device right before it
+        (other programs may have changed them meanwhile). Controls already
+        at their target value are neither set nor restored, every ioctl
+        avoided that way is counted in self.ctrlSaved.
         '''
+        self.ctrls = {}
         for x in (12, 18, 28):
             idx = str(x)
             try:
@@ -345,12 +523,17 @@ class imaging():
                 # for controls 12, 18 and 28 *min* means disable control
                 if x in (12, 18, 28):
                     cw = self.ctrls[idx]['min']
+                    if self.ctrlTargets and x in self.ctrlTargets:
+                        cw = self.ctrlTargets[x]
                     if self.ctrls[idx]['old'] != cw:
                         self.cameraObj.setCtrl(x, cw)
                         logger.debug(
                             "\'v4l2-%s\' set from %s to %s" % (
                                 self.ctrls[idx]['name'],
                                 self.ctrls[idx]['old'], cw))
+                    else:
+                        # VIDIOC_S_CTRL skipped, here and in restoreCtrls
+                        self.ctrlSaved += 2
                     self.ctrls[idx]['new'] = cw
             except camera.Error as err:
                 # EINVAL means control is not available (errorcode 22)
@@ -421,6 +604,88 @@ class imaging():
         
 
 
+class fusionCapture():
+    ''' Secondary cameras capture pool
+
+    Runs a capture session on every secondary camera (one thread each) while
+    the primary camera captures in the calling thread, then converts each
+    secondary brightness to primary camera's scale through per-camera offset
+    and delta (from calibration), so that all values can be averaged:
+
+        (amb - offset) / delta == (amb_i - offset_i) / delta_i
+
+    Sessions not finished within collect() timeout are discarded, so that a
+    slow camera never delays the primary one.
+    '''
+
+    def __init__(self, devices, offset, delta):
+        self.logger = logging.getLogger(".".join([__LowerName__, 'fusion']))
+        self.offset = offset    # primary camera offset
+        self.delta = delta      # primary camera delta
+        self.cams = []          # [(imaging object, offset, delta), ...]
+        self.workers = {}       # {cams index: capture thread}
+        self.results = {}       # {cams index: (session number, values)}
+        self.session = 0
+        camPaths = camera.listDevices()
+        for path, ofs, dlt in devices:
+            if not camPaths.count(path):
+                self.logger.warning(
+                    "secondary camera '%s' not available, skipped" % path)
+                continue
+            cap = imaging()
+            cap.initializeCamera(path)
+            self.cams.append((cap, ofs, dlt))
+
+    def _capture(self, idx, session, interval, captures):
+        cap = self.cams[idx][0]
+        try:
+            cap.startCapture()
+            try:
+                values = cap.getFrameBri(interval, captures)
+            finally:
+                cap.stopCapture()
+        except (KeyboardInterrupt, camera.Error, CameraError) as err:
+            self.logger.warning(
+                "capture from secondary camera '%s' failed: %s"
+                % (cap.camPath, err))
+            return
+        self.results[idx] = (session, values)
+
+    def start(self, interval, captures):
+        self.session += 1
+        for idx in range(len(self.cams)):
+            worker = self.workers.get(idx)
+            if worker is not None and worker.isAlive():
+                # previous session still running (camera too slow)
+                continue
+            worker = threading.Thread(
+                target=self._capture,
+                args=(idx, self.session, interval, captures))
+            worker.daemon = True
+            self.workers[idx] = worker
+            worker.start()
+
+    def collect(self, timeout=0):
+        ''' Wait (at most timeout seconds) for capture threads and return the
+        list of secondary brightness values, converted to primary's scale '''
+        deadline = time.time() + timeout
+        for worker in self.workers.values():
+            worker.join(max(0, deadline - time.time()))
+        values = []
+        for idx in self.results.keys():
+            session, camValues = self.results.pop(idx)
+            if session != self.session or not camValues:
+                continue
+            camValues = processList(camValues)
+            amb = sum(camValues) / float(len(camValues))
+            cap, ofs, dlt = self.cams[idx]
+            values.append(self.offset + (amb - ofs) * self.delta / dlt)
+            self.logger.debug(
+                "Secondary camera '%s': %.1f (%.1f converted)"
+                % (cap.camPath, amb, values[-1]))
+        return values
+
+
 class secessionist():
     ''' ConsoleKit DBus query to get (eventual) Active X11 session
 
@@ -0,0 +1,125 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import dbus
+
+from calise.infos import __LowerName__
+
+
+logger = logging.getLogger('.'.join([__LowerName__, 'client']))
+
+busObject = 'org.%s.service' % __LowerName__
+busPath = '/org/%s/service' % __LowerName__
+
+# service thread status codes (see dbusService.methodHandler.checkTh)
+RUNNING = 0
+NOTHREAD = 1
+PAUSED = 2
+DEAD = 3
+# client side error codes (same as calised queryService ones)
+UNREACHABLE = 21
+DENIED = 22
+
+
+class serviceClient():
+    ''' Running service client
+
+    Talks to calised directly on the bus (session bus first, then system
+    bus) instead of spawning "calised --check"-like processes and parsing
+    their output. Every method returns an integer code: thread status codes
+    above for status, 0 on success, 1 on service side failure and
+    UNREACHABLE/DENIED on bus errors.
+
+    NOTE: private connections are meant for leases: the service releases a
+          lease as soon as the connection which requested it goes away, so
+          the lease lives exactly as long as this object (or the process).
+    '''
+
+    def __init__(self, mainloop=None, private=False):
+        self.mainloop = mainloop
+        self.private = private
+        self.bus = None
+        self.iface = None
+
+    def connect(self):
+        for bus in (dbus.SessionBus, dbus.SystemBus):
+            kwargs = {'private': self.private}
+            if self.mainloop is not None:
+                kwargs['mainloop'] = self.mainloop
+            try:
+                conn = bus(**kwargs)
+                obj = conn.get_object(busObject, busPath)
+            except dbus.exceptions.DBusException as err:
+                logger.debug("Service not found on %s: %s" % (
+                    bus.__name__, err.get_dbus_name()))
+                continue
+            self.bus = conn
+            self.iface = dbus.Interface(obj, busObject)
+            return 0
+        return UNREACHABLE
+
+    def close(self):
+        if self.bus is not None and self.private:
+            self.bus.close()
+        self.bus = None
+        self.iface = None
+
+    # calls a service method, returns (code, answer)
+    def call(self, method, *args):
+        if self.iface is None:
+            return UNREACHABLE, None
+        try:
+            return 0, getattr(self.iface, method)(*args)
+        except dbus.exceptions.DBusException as err:
+            name = err.get_dbus_name()
+            logger.warning("Service call \"%s\" failed: %s" % (method, name))
+            if name == 'org.freedesktop.DBus.Error.AccessDenied':
+                return DENIED, None
+            return UNREACHABLE, None
+
+    def status(self):
+        rc, ans = self.call('status')
+        if rc != 0:
+            return rc
+        return int(ans)
+
+    # pause/resume answers are messages, errors start with warning/error
+    def pause(self, action='pause'):
+        rc, ans = self.call(action)
+        if rc != 0:
+            return rc
+        if str(ans).startswith(('warning', 'error')):
+            return 1
+        return 0
+
+    def resume(self):
+        return self.pause('resume')
+
+    # borrow the camera: 0 if the service gave it up for this client, 2 if
+    # it wasn't using it
+    def lease(self):
+        rc, ans = self.call('lease')
+        if rc != 0:
+            return rc
+        return int(ans)
+
+    def release(self):
+        rc, ans = self.call('release')
+        if rc != 0:
+            return rc
+        return int(ans)
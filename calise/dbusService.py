@@ -17,6 +17,7 @@
 
 import os
 import time
+import errno
 import threading
 import logging
 import gobject
@@ -26,6 +27,14 @@ import signal
 from dbus.mainloop.glib import DBusGMainLoop
 
 from calise import objects
+from calise import optionsd
+from calise import metrics
+from calise import hotplug
+from calise import udev
+from calise import power
+from calise.policy import policyEngine
+from calise.capture import CameraError
+from calise.watcher import fileWatcher
 from calise.infos import __LowerName__
 
 
@@ -68,13 +77,21 @@ def strToBool(string):
 # Main execution Thread
 class whatsmyname(threading.Thread):
 
-    def __init__(self, settings):
+    # seconds between display checks while displays are off (see run)
+    blankSleep = 30.0
+
+    def __init__(self, settings, notify=None):
         self.logger = logging.getLogger('.'.join([__LowerName__, 'thread']))
         self.logger.info("Starting main Thread...")
         self.objectClass = objects.objects(settings)
+        self.notify = notify  # DBus signals emitter (see methodHandler)
         # control "flags"
         self.stop = False
         self.pause = False
+        self.resumed = threading.Event()  # set on resume or stop requests
+        # {client: (maximum secs between captures, expiry)} (see boostTh)
+        self.boosts = {}
+        self.blank = False  # last cycle skipped because displays were off
         # threading.Thread module initialization
         threading.Thread.__init__(self)
 
@@ -94,34 +111,133 @@ class whatsmyname(threading.Thread):
         # log also first (eventual) backlight change
         self.cbs = self.objectClass.getCbs()
         while self.stop is False:
+            # camera unplugged: no captures (nor wakeups) until it's back
+            if (
+                self.objectClass.bindCamera(self.interrupted) != 0 or
+                self.pause is None
+            ):
+                if self.pause is None:
+                    self.suspend()
+                continue
+            cycleStart = time.time()
             self.objectClass.resetComers()
-            self.cycle_sleeptime = self.objectClass.executer()
-            self.objectClass.append_data()
-            self.event_logger()
+            if self.displayOff():
+                # nobody is looking at the display: camera stays off, the
+                # display is checked again after blankSleep seconds (or the
+                # usual sleeptime, if shorter)
+                if not self.blank:
+                    self.logger.info("Displays are off, skipping captures")
+                self.blank = True
+                metrics.inc('display_off_cycles_total')
+                self.cycle_sleeptime = cycleStart + min(
+                    self.objectClass.arguments['dayst'], self.blankSleep)
+            else:
+                self.blank = False
+                try:
+                    self.cycle_sleeptime = self.objectClass.executer()
+                except CameraError as err:
+                    if err.errno != errno.ENODEV:
+                        raise
+                    self.logger.warning(str(err))
+                    if self.objectClass.cameras.present:
+                        # still listed (eg. device node not there yet),
+                        # wait a bit before trying again
+                        for x in range(hotplug.rescan):
+                            if self.interrupted():
+                                break
+                            time.sleep(1)
+                    continue
+                self.objectClass.append_data()
+                self.event_logger()
+            self.dumpMetrics()
             # the cycle below sleeps Nth time for 1 sec and meanwhile checks
             # if the stop flag has been set, in that case breaks (and so
             # terminates the thread)
             while self.cycle_sleeptime > time.time():
                 # if $pause then sleep indefinitely (until NOT $pause)
                 if self.pause is None:
-                    self.pause = True
-                    while self.pause and not self.stop:
-                        time.sleep(1)
-                    self.pause = False
+                    self.suspend()
                 else:
                     time.sleep(1)
+                metrics.inc('thread_wakeups_total')
                 # if $stop then close thread
                 if self.stop is True:
                     break
+                # boosted capture rate (eg. a GUI is showing live values)
+                if self.boosted(cycleStart):
+                    break
+        self.objectClass.releaseBacklight()
+
+    # blocks (no wakeups) until resumeTh or setStop
+    def suspend(self):
+        self.resumed.clear()
+        self.pause = True
+        while self.pause and not self.stop:
+            self.resumed.wait()
+            self.resumed.clear()
+        # backlight may have been driven by other programs (eg. calise)
+        # meanwhile: not user overrides
+        self.objectClass.resetOverride()
+        self.pause = False
+
+    # True if displays are off and captures have to be skipped
+    def displayOff(self):
+        if not self.objectClass.arguments.get('powergate'):
+            return False
+        return power.displayOff()
+
+    # stop or pause requested (see bindCamera)
+    def interrupted(self):
+        return self.stop is True or self.pause is None
+
+    # wake the thread up if it's waiting for the camera (or its lease)
+    def wake(self):
+        self.objectClass.cameras.wake()
+        if self.objectClass.lease is not None:
+            self.objectClass.lease.wake()
+
+    # True if any boost is active and the shortest boost interval elapsed
+    # since given time (expired boosts are dropped)
+    def boosted(self, since):
+        now = time.time()
+        intervals = []
+        for client, (interval, expiry) in self.boosts.items():
+            if now > expiry:
+                self.logger.info("Capture rate boost of %s expired" % client)
+                self.boosts.pop(client, None)
+            else:
+                intervals.append(interval)
+        if not intervals:
+            return False
+        return now - since >= min(intervals)
+
+    # write metrics to the Prometheus text file, if any
+    def dumpMetrics(self):
+        path = self.objectClass.arguments.get('metricsfile')
+        if not metrics.enabled or not path:
+            return 1
+        try:
+            metrics.dump(path)
+        except (IOError, OSError) as err:
+            self.logger.warning(
+                "Unable to write metrics to %s: %s" % (path, err))
+            return 2
+        return 0
 
     def event_logger(self):
         objc = self.objectClass
+        if self.notify and objc.oldies:
+            self.notify('CaptureCompleted', dict([
+                (k, v) for k, v in objc.oldies[-1].items() if v is not None]))
         if len(objc.oldies) == 1:
             if objc.oldies[-1]['cbs'] != self.cbs:
                 print objc.oldies[-1]['cbs'], self.cbs
                 self.logger.info(
                     "Backlight step changed from %d to %d"
                     % (self.cbs, objc.oldies[-1]['cbs']))
+                if self.notify:
+                    self.notify(
+                        'StepChanged', self.cbs, objc.oldies[-1]['cbs'])
             del self.cbs
             self.logger.info(
                 "Time of the day is \"%s\"" % (objc.oldies[-1]['css']))
@@ -132,10 +248,19 @@ class whatsmyname(threading.Thread):
                 self.logger.info(
                     "Backlight step changed from %d to %d"
                     % (objc.oldies[-2]['cbs'], objc.oldies[-1]['cbs']))
+                if self.notify:
+                    self.notify(
+                        'StepChanged',
+                        objc.oldies[-2]['cbs'], objc.oldies[-1]['cbs'])
             if objc.oldies[-1]['css'] != objc.oldies[-2]['css']:
                 self.logger.info(
                     "Time of the day changed from \"%s\" to \"%s\""
                     % (objc.oldies[-2]['css'], objc.oldies[-1]['css']))
+                if self.notify:
+                    self.notify(
+                        'DayStateChanged',
+                        str(objc.oldies[-2]['css']),
+                        str(objc.oldies[-1]['css']))
             if objc.oldies[-1]['slp'] != objc.oldies[-2]['slp']:
                 self.logger.info(
                     "Sleeptime between captures changed from %.2f to %.2f"
@@ -143,7 +268,9 @@ class whatsmyname(threading.Thread):
 
     def setStop(self):
         self.stop = True
+        self.wake()
         self.objectClass.stop = True
+        self.resumed.set()
 
 
 class dbusService(dbus.service.Object):
@@ -160,9 +287,12 @@ class dbusService(dbus.service.Object):
         self.logger.info("Process started with PID %d" % os.getpid())
         self.busObject = 'org.%s.service' % __LowerName__
         self.busPath = '/org/%s/service' % __LowerName__
-        bus_name = dbus.service.BusName(self.busObject, bus=sbus())
+        self.bus = sbus()
+        bus_name = dbus.service.BusName(self.busObject, bus=self.bus)
+        self.leaseWatch = {}  # {client bus name: NameOwnerChanged match}
         self.initSignals()
         dbus.service.Object.__init__(self, bus_name, self.busPath)
+        self.pth.notifier = self
 
     # signal exceptions definition
     def initSignals(self):
@@ -187,6 +317,34 @@ class dbusService(dbus.service.Object):
             m = self.resume()
             print m
 
+    ''' DBus signals listing
+
+     NOTE: signals are emitted from the main loop (see methodHandler.notify),
+           so the capture thread only queues them; clients subscribe through
+           match rules (eg. "member='StepChanged'") and the bus daemon only
+           routes them to subscribed clients.
+    '''
+    @dbus.service.signal(
+        'org.%s.service' % __LowerName__, signature='a{sv}')
+    def CaptureCompleted(self, values):
+        pass
+
+    @dbus.service.signal('org.%s.service' % __LowerName__, signature='ii')
+    def StepChanged(self, old, new):
+        pass
+
+    @dbus.service.signal('org.%s.service' % __LowerName__, signature='ss')
+    def DayStateChanged(self, old, new):
+        pass
+
+    @dbus.service.signal('org.%s.service' % __LowerName__, signature='')
+    def Paused(self):
+        pass
+
+    @dbus.service.signal('org.%s.service' % __LowerName__, signature='')
+    def Resumed(self):
+        pass
+
     ''' DBus methods listing
 
      NOTE: Every function regarding thread execution (start, stop, pause,
@@ -212,7 +370,7 @@ class dbusService(dbus.service.Object):
     @dbus.service.method('org.%s.service' % __LowerName__)
     def pause(self):
         self.logger.debug("Client requested pause. Pausing thread...")
-        retCode = self.pth.loggerFuncWrap(self.pth.pauseTh)
+        retCode = self.pth.loggerFuncWrap(self.pth.userPauseTh)
         # final return code check
         if retCode == 0:
             retMsg = "service successfully paused"
@@ -225,7 +383,7 @@ class dbusService(dbus.service.Object):
     @dbus.service.method('org.%s.service' % __LowerName__)
     def resume(self):
         self.logger.debug("Client requested resume. Resuming thread...")
-        retCode = self.pth.loggerFuncWrap(self.pth.resumeTh)
+        retCode = self.pth.loggerFuncWrap(self.pth.userResumeTh)
         # final return code check
         if retCode == 0:
             retMsg = "service successfully resumed"
@@ -342,6 +500,122 @@ class dbusService(dbus.service.Object):
                 "read program logs for further info")
         return retMsg
 
+    ''' Typed DBus methods
+
+     NOTE: these return DBus typed data (no formatting server-side) and are
+           meant for tools polling the service; None values are left out of
+           dictionaries and become NaN inside arrays.
+    '''
+    @dbus.service.method(
+        'org.%s.service' % __LowerName__,
+        in_signature='as', out_signature='a{sv}')
+    def values(self, fields):
+        self.logger.debug("Client requested values %s" % list(fields))
+        return self.pth.valuesTh([str(x) for x in fields])
+
+    @dbus.service.method(
+        'org.%s.service' % __LowerName__,
+        in_signature='sdduu', out_signature='ad')
+    def series(self, field, since, until, offset, limit):
+        self.logger.debug("Client requested %s series" % field)
+        return self.pth.seriesTh(str(field), since, until, offset, limit)
+
+    @dbus.service.method(
+        'org.%s.service' % __LowerName__,
+        in_signature='dd', out_signature='u')
+    def seriescount(self, since, until):
+        return self.pth.seriesCountTh(since, until)
+
+    @dbus.service.method(
+        'org.%s.service' % __LowerName__,
+        in_signature='as', out_signature='a{sv}')
+    def settings(self, keys):
+        self.logger.debug("Client requested settings %s" % list(keys))
+        return self.pth.settingsTh([str(x) for x in keys])
+
+    @dbus.service.method(
+        'org.%s.service' % __LowerName__, in_signature='d',
+        sender_keyword='sender')
+    def boost(self, interval, sender=None):
+        self.logger.debug(
+            "Client %s requested capture boost (%.1fs)" % (sender, interval))
+        retCode = self.pth.boostTh(interval, str(sender))
+        if retCode == 0:
+            retMsg = "captures boosted to one every %.1f seconds" % interval
+        else:
+            retMsg = (
+                "warning: \"boost\" not processed correctly, "
+                "read program logs for further info")
+        return retMsg
+
+    @dbus.service.method(
+        'org.%s.service' % __LowerName__, sender_keyword='sender')
+    def unboost(self, sender=None):
+        self.logger.debug("Client %s released capture boost" % sender)
+        retCode = self.pth.boostTh(None, str(sender))
+        if retCode == 0:
+            retMsg = "capture boost released"
+        else:
+            retMsg = (
+                "warning: \"unboost\" not processed correctly, "
+                "read program logs for further info")
+        return retMsg
+
+    @dbus.service.method('org.%s.service' % __LowerName__)
+    def metrics(self):
+        self.logger.debug("Client requested metrics. Dumping metrics...")
+        if metrics.enabled:
+            retMsg = metrics.prometheus().rstrip('\n')
+        else:
+            retMsg = (
+                "warning: metrics are disabled, set \"metrics = True\" in "
+                "[Service] profile section to enable them")
+        return retMsg
+
+    @dbus.service.method(
+        'org.%s.service' % __LowerName__, out_signature='i')
+    def status(self):
+        return self.pth.checkTh()
+
+    ''' Camera lease
+
+     NOTE: foreground programs borrow the camera through "lease" instead of
+           pausing the service; it is given back on "release" or as soon as
+           the leasing client leaves the bus (eg. it crashed), so the service
+           can't stay paused forever. Return codes as methodHandler.leaseTh.
+    '''
+    @dbus.service.method(
+        'org.%s.service' % __LowerName__,
+        out_signature='i', sender_keyword='sender')
+    def lease(self, sender=None):
+        self.logger.debug("Client %s requested camera lease" % sender)
+        retCode = self.pth.leaseTh(str(sender))
+        if retCode == 1:
+            self.logger.error("Failed to lend the camera to %s" % sender)
+        if retCode in (0, 2) and not sender in self.leaseWatch:
+            self.leaseWatch[sender] = self.bus.watch_name_owner(
+                sender, lambda owner: self.ownerChanged(sender, owner))
+        return retCode
+
+    @dbus.service.method(
+        'org.%s.service' % __LowerName__,
+        out_signature='i', sender_keyword='sender')
+    def release(self, sender=None):
+        self.logger.debug("Client %s released camera lease" % sender)
+        watch = self.leaseWatch.pop(sender, None)
+        if watch is not None:
+            watch.remove()
+        return self.pth.releaseTh(str(sender))
+
+    # auto-release leases of clients which left the bus
+    def ownerChanged(self, sender, owner):
+        if owner or not sender in self.leaseWatch:
+            return
+        self.leaseWatch.pop(sender).remove()
+        self.logger.info(
+            "Client %s left the bus, releasing its camera lease" % sender)
+        self.pth.releaseTh(str(sender))
+
     @dbus.service.method('org.%s.service' % __LowerName__)
     def capture(self):
         self.logger.debug("Client requested manual capture. Capturing...")
@@ -371,12 +645,46 @@ class dbusService(dbus.service.Object):
 
 class methodHandler():
 
+    # settings that can be changed during execution through "settingset",
+    # as {setting key: string converter}
+    liveSettings = {
+        'geoip': strToBool,
+        'weather': strToBool,
+        'screen': strToBool,
+        'scrmul': float,
+        'latitude': float,
+        'longitude': float,
+        'capnum': int,
+        'capint': float,
+        'dayst': float,
+        'dusksm': float,
+        'nightst': float,
+    }
+    # settings that are applied on profile change without restarting the
+    # thread (others, eg. camera or backlight paths, need a restart)
+    reloadSettings = liveSettings.keys() + [
+        'offset', 'delta', 'exponent', 'steps', 'bkofs', 'invert']
+    # capture rate boost lifetime (unless renewed) and minimum interval
+    boostTTL = 60.0
+    boostMinimum = 2.0
+
     # non-Dbus related initializations
     def __init__(self, settings):
         self.logger = logging.getLogger('.'.join([__LowerName__, 'handler']))
         # var setting
         self.settings = settings
         self.th = None  # service thread
+        self.watcher = None  # profile watcher
+        self.hotplug = None  # device events main loop source
+        self.profile = {}  # profile settings as last read (see reloadTh)
+        self.events = False  # device events available (hotplug not a timer)
+        self.policy = None  # power source policies engine
+        self.notifier = None  # dbusService object, emits DBus signals
+        self.leases = set()  # bus names of clients holding the camera
+        self.leasePaused = False  # thread paused because of leases
+        self.power = None  # logind power states monitor
+        self.powerPaused = False  # thread paused because of power states
+        self.userPaused = False  # thread paused by a client (pause command)
 
     # Thread execution related functions
     # NOTE: function name should be same as calling command's name with
@@ -398,12 +706,28 @@ class methodHandler():
             )
         return rc
 
+    # queue DBus signal emission on the main loop (callable from any thread)
+    def notify(self, name, *args):
+        if self.notifier is None:
+            return 1
+        gobject.idle_add(self.emit, name, args)
+        return 0
+
+    def emit(self, name, args):
+        try:
+            getattr(self.notifier, name)(*args)
+        except Exception as err:
+            self.logger.warning("Unable to emit %s signal: %s" % (name, err))
+        # run once
+        return False
+
     # start thread execution
     def startTh(self):
         if self.th is not None:
             if self.th.isAlive():
                 return 2
-        self.th = whatsmyname(self.settings)
+        self.th = whatsmyname(self.settings, self.notify)
+        self.userPaused = False
         self.th.start()
         if self.th.isAlive():
             return 0
@@ -432,8 +756,10 @@ class methodHandler():
                 # set pause flag from False to None (when thread will be
                 # effectively paused this flag will be set to True)
                 self.th.pause = None
+                self.th.wake()
                 while self.th.pause is not True:
                     time.sleep(0.1)
+                self.notify('Paused')
                 return 0
         return 1
 
@@ -442,11 +768,34 @@ class methodHandler():
         if self.th is not None:
             if self.th.isAlive() and self.th.pause is True:
                 self.th.pause = None
+                self.th.resumed.set()
                 while self.th.pause is not False:
                     time.sleep(0.1)
+                self.notify('Resumed')
                 return 0
         return 1
 
+    # Pause/resume commands: the thread stays paused while leases or power
+    # states hold it (see leaseTh and gateTh) and these are not resumed by
+    # releaseTh and ungateTh while paused by the user
+    def userPauseTh(self):
+        if self.userPaused:
+            return 0
+        if self.leasePaused or self.powerPaused:
+            self.userPaused = True
+            return 0
+        if self.pauseTh() != 0:
+            return 1
+        self.userPaused = True
+        return 0
+
+    def userResumeTh(self):
+        self.userPaused = False
+        if self.leasePaused or self.powerPaused:
+            # resumed as soon as those are over
+            return 0
+        return self.resumeTh()
+
     # check thread execution
     # If alive but paused returns 2, else if Alive and not paused, 0.
     def checkTh(self):
@@ -462,6 +811,71 @@ class methodHandler():
             retCode = 1
         return retCode
 
+    # Lend the camera to a client: thread is paused on first lease and
+    # resumed when the last one is released (only if leases paused it).
+    # Returns 0 if the camera has been freed for the client, 2 if it was
+    # already free (thread paused or not running)
+    def leaseTh(self, owner):
+        self.leases.add(owner)
+        if self.leasePaused:
+            return 0
+        if self.userPaused and self.checkTh() == 2:
+            # held paused until the last release, even if resumed meanwhile
+            self.leasePaused = True
+            return 0
+        if self.checkTh() != 0:
+            return 2
+        if self.pauseTh() != 0:
+            self.leases.discard(owner)
+            return 1
+        self.leasePaused = True
+        return 0
+
+    # Give back a camera lease (see leaseTh)
+    def releaseTh(self, owner):
+        if not owner in self.leases:
+            return 1
+        self.leases.discard(owner)
+        if self.leases or not self.leasePaused:
+            return 0
+        self.leasePaused = False
+        if self.power is not None and self.power.reasons:
+            # power states gated captures meanwhile, leave it paused
+            self.powerPaused = True
+            return 0
+        if self.userPaused:
+            return 0
+        return self.resumeTh()
+
+    # Stop captures because of power states (see calise.power): like leases,
+    # thread is paused only if running and resumed by ungateTh only if paused
+    # here. Returns 0 if the thread has been paused, 2 if it wasn't running
+    def gateTh(self, reasons=None):
+        if self.powerPaused:
+            return 0
+        if self.userPaused and self.checkTh() == 2:
+            # held paused until ungated, even if resumed meanwhile
+            self.powerPaused = True
+            return 0
+        if self.checkTh() != 0:
+            return 2
+        if self.pauseTh() != 0:
+            return 1
+        self.powerPaused = True
+        return 0
+
+    def ungateTh(self):
+        if not self.powerPaused:
+            return 1
+        self.powerPaused = False
+        if self.leases:
+            # camera lent meanwhile, resumed on last lease release
+            self.leasePaused = True
+            return 0
+        if self.userPaused:
+            return 0
+        return self.resumeTh()
+
     # dump data
     def dumpTh(self):
         vals = self.th.objectClass.dumpValues()
@@ -477,6 +891,79 @@ class methodHandler():
         args = self.th.objectClass.arguments
         return args
 
+    # Raise capture rate to one capture every %interval seconds at least
+    # on behalf of client (None releases its boost). Every client has its
+    # own boost, the shortest interval wins, so that a client releasing its
+    # boost doesn't cancel the others. Boosts expire after boostTTL seconds
+    # unless renewed, so that clients which disappear without releasing them
+    # don't keep the camera busy.
+    def boostTh(self, interval, client=None):
+        if self.th is None or not self.th.isAlive():
+            return 1
+        if interval is None:
+            self.th.boosts.pop(client, None)
+            return 0
+        self.th.boosts[client] = (
+            max(float(interval), self.boostMinimum),
+            time.time() + self.boostTTL)
+        return 0
+
+    # last capture values as {field: value}, only given fields (all if none)
+    # NOTE: queries below return no data if the thread has never been started
+    def valuesTh(self, fields=None):
+        if self.th is None:
+            return {}
+        vals = self.th.objectClass.dumpValues()
+        if not fields:
+            fields = vals.keys()
+        ret = {}
+        for key in fields:
+            if not key in vals:
+                raise KeyError("no such field: %s" % key)
+            if vals[key] is not None:
+                ret[key] = vals[key]
+        return ret
+
+    # numeric field values of captures within since and until timestamps (0
+    # means unbounded), paginated through offset and limit (0 means no limit)
+    def seriesTh(self, field, since=0, until=0, offset=0, limit=0):
+        if self.th is None:
+            return []
+        objc = self.th.objectClass
+        if not field in objc.newcomers or field == 'css':
+            raise KeyError("no such numeric field: %s" % field)
+        start, end = objc.historyRange(since, until)
+        start += offset
+        if limit:
+            end = min(end, start + limit)
+        nan = float('nan')
+        return [
+            float(x[field]) if x[field] is not None else nan
+            for x in objc.oldies[start:end]]
+
+    # number of captures within since and until timestamps (see seriesTh)
+    def seriesCountTh(self, since=0, until=0):
+        if self.th is None:
+            return 0
+        start, end = self.th.objectClass.historyRange(since, until)
+        # inverted ranges (since > until) hold no captures
+        return max(end - start, 0)
+
+    # current settings as {key: value}, only given keys (all if none)
+    def settingsTh(self, keys=None):
+        if self.th is None:
+            return {}
+        args = self.th.objectClass.arguments
+        if not keys:
+            keys = args.keys()
+        ret = {}
+        for key in keys:
+            if not key in args:
+                raise KeyError("no such setting: %s" % key)
+            if args[key] is not None:
+                ret[key] = args[key]
+        return ret
+
     # Manual camera capture
     # If an existing running thread is found it will be paused and then
     # resumed else, a temporary thread is initialized (but not started)
@@ -498,61 +985,21 @@ class methodHandler():
                 self.resumeTh()
         else:
             if r == 1:
-                self.th = whatsmyname()
+                self.th = whatsmyname(self.settings, self.notify)
             w = self.th.objectClass.writeStep(standalone=True)
             self.th.event_logger()
         self.logger.debug("Function objects.writeStep returned %d" % w)
         return 0
 
     # Set thread variable's value (one per call)
-    # every and only settings stated there can be changed during execution
-    # TODO: simplify removing actual key names
+    # every and only settings stated in liveSettings can be changed during
+    # execution
     def setTh(self, idx, value):
         retCode = 0
-        if idx in ['geoip']:
-            value = strToBool(value)
-            self.settings['geoip'] = value
-            self.th.objectClass.arguments['geoip'] = value
-        elif idx in ['weather']:
-            value = strToBool(value)
-            self.settings['weather'] = value
-            self.th.objectClass.arguments['weather'] = value
-        elif idx in ['screen']:
-            value = strToBool(value)
-            self.settings['screen'] = value
-            self.th.objectClass.arguments['screen'] = value
-        elif idx in ['scrmul']:
-            value = float(value)
-            self.settings['scrmul'] = value
-            self.th.objectClass.arguments['scrmul'] = value
-        elif idx in ['latitude']:
-            value = float(value)
-            self.settings['latitude'] = value
-            self.th.objectClass.arguments['latitude'] = value
-        elif idx in ['longitude']:
-            value = float(value)
-            self.settings['longitude'] = value
-            self.th.objectClass.arguments['longitude'] = value
-        elif idx in ['capnum']:
-            value = int(value)
-            self.settings['capnum'] = value
-            self.th.objectClass.arguments['capnum'] = value
-        elif idx in ['capint']:
-            value = float(value)
-            self.settings['capint'] = value
-            self.th.objectClass.arguments['capint'] = value
-        elif idx in ['dayst']:
-            value = float(value)
-            self.settings['dayst'] = value
-            self.th.objectClass.arguments['dayst'] = value
-        elif idx in ['dusksm']:
-            value = float(value)
-            self.settings['dusksm'] = value
-            self.th.objectClass.arguments['dusksm'] = value
-        elif idx in ['nightst']:
-            value = float(value)
-            self.settings['nightst'] = value
-            self.th.objectClass.arguments['nightst'] = value
+        if idx in self.liveSettings:
+            value = self.liveSettings[idx](value)
+            self.settings[idx] = value
+            self.th.objectClass.arguments[idx] = value
         else:
             retCode = 1
             self.logger.warning(
@@ -562,12 +1009,123 @@ class methodHandler():
                 "\"%s\" setting to %s successfully processed" % (idx, value))
         return retCode
 
+    # Start watching profiles for changes
+    def watchTh(self):
+        pname = self.settings.get('profile', 'default')
+        self.profile = optionsd.load_profiles(pname)
+        self.watcher = fileWatcher(
+            [p for p in optionsd.get_path(pname)], self.reloadTh)
+        return self.watcher.start()
+
+    # Start watching camera hotplug events: device events descriptor if
+    # available, a timer otherwise (see calise.hotplug)
+    def hotplugTh(self):
+        # (the main loop becomes the only uevents reader, see hotplugEvent)
+        fd = udev.index.watch()
+        if fd is None:
+            self.hotplug = gobject.timeout_add_seconds(
+                hotplug.rescan, self.hotplugEvent)
+            return 2
+        self.events = True
+        self.hotplug = gobject.io_add_watch(
+            fd, gobject.IO_IN, self.hotplugEvent)
+        return 0
+
+    def hotplugEvent(self, *args):
+        cameras = None
+        if self.th is not None and self.th.isAlive():
+            cameras = self.th.objectClass.cameras
+        try:
+            # events have to be read anyway, even if nobody is interested
+            events = udev.index.refresh()
+            if cameras is not None and (self.events or not cameras.present):
+                cameras.update()
+            if not self.events or [
+                e for e in events if e[1] == 'power_supply'
+            ]:
+                self.policyTh()
+        except Exception as err:
+            self.logger.error("Error processing device events: %s" % err)
+        return True
+
+    # Apply power source policy settings (see calise.policy), if the power
+    # source changed. Like profile changes, settings are queued so that the
+    # thread switches them all together before its next cycle
+    def policyTh(self):
+        if self.policy is None:
+            self.policy = policyEngine(self.settings)
+        if not self.policy.enabled():
+            return 2
+        if self.policy.update() is None:
+            return 1
+        diff = dict([
+            (k, v) for k, v in self.policy.values().items()
+            if self.settings.get(k) != v])
+        if not diff:
+            return 0
+        self.logger.info(
+            "Policy settings: %s" % ', '.join(
+                ['%s=%s' % (k, diff[k]) for k in sorted(diff.keys())]))
+        if self.th is not None and self.th.isAlive():
+            self.th.objectClass.queueArguments(diff)
+        else:
+            self.settings.update(diff)
+        return 0
+
+    # Start following logind power states (sleep, lid, idle and locked
+    # session), if enabled
+    def powerTh(self):
+        if not self.settings.get('powergate'):
+            return 2
+        self.power = power.powerMonitor(self.gateTh, self.ungateTh)
+        if self.power.start() != 0:
+            self.power = None
+            return 1
+        return 0
+
+    # Apply changed profile settings to the running thread
+    # Only options changed in the profile since it was last read are queued
+    # (so command line and settingset values of untouched options are kept),
+    # then the thread applies them all together before its next cycle
+    def reloadTh(self, path=None):
+        self.logger.info("Profile %s changed, reloading..." % path)
+        profile = optionsd.load_profiles(
+            self.settings.get('profile', 'default'))
+        changed = dict([
+            (k, v) for k, v in profile.items() if self.profile.get(k) != v])
+        self.profile = profile
+        if self.policy is not None and self.policy.enabled():
+            # profile values are policies base, policy ones win
+            self.policy.rebase(profile)
+            for key in self.policy.active().keys():
+                changed.pop(key, None)
+        diff = {}
+        for key in changed.keys():
+            if self.settings.get(key) == changed[key]:
+                # eg. values stored by the service itself (update_profile)
+                continue
+            if key in self.reloadSettings:
+                diff[key] = changed[key]
+            else:
+                self.logger.warning(
+                    "\"%s\" changed, restart the service to apply it" % key)
+        if not diff:
+            return 1
+        if self.th is not None and self.th.isAlive():
+            self.th.objectClass.queueArguments(diff)
+        else:
+            self.settings.update(diff)
+        return 0
+
 
 class service():
 
     def __init__(self, settings, isroot=False):
         self.isroot = isroot
+        metrics.enable(bool(settings.get('metrics')))
         self.serviceHandler = methodHandler(settings)
+        # power source policy (if any) applies from first capture
+        self.serviceHandler.policyTh()
         # NOTE: thread start on init by default, to avoid comment line below
         self.serviceHandler.loggerFuncWrap(self.serviceHandler.startTh)
         # bus initialization
@@ -578,9 +1136,19 @@ class service():
         self.loop = gobject.MainLoop()
         gobject.threads_init()
         serviceBus = dbusService(self.serviceHandler, self.loop, self.isroot)
+        self.serviceHandler.watchTh()
+        self.serviceHandler.hotplugTh()
+        self.serviceHandler.loggerFuncWrap(self.serviceHandler.powerTh)
 
     def runLoop(self):
         try:
             self.loop.run()
         except KeyboardInterrupt:
             pass
+        if self.serviceHandler.watcher:
+            self.serviceHandler.watcher.stop()
+        if self.serviceHandler.hotplug is not None:
+            gobject.source_remove(self.serviceHandler.hotplug)
+            self.serviceHandler.hotplug = None
+        if self.serviceHandler.power is not None:
+            self.serviceHandler.power.stop()
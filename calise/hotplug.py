@@ -0,0 +1,140 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import errno
+import logging
+import threading
+
+from calise import udev
+from calise.infos import __LowerName__
+
+
+logger = logging.getLogger('.'.join([__LowerName__, 'hotplug']))
+
+# camera errors meaning that the device is gone (unplugged)
+goneErrors = (errno.ENODEV, errno.ENOENT, errno.ENXIO)
+# seconds between device rescans while the camera is missing, only when
+# kernel uevents are not available
+rescan = 10
+
+
+class cameraManager():
+    ''' Camera hotplug manager
+
+    Keeps track of the camera in use: path is the configured device node,
+    device is the stable device path stored in the profile ([Udev] device),
+    if any. When the camera is unplugged (uevents or capture errors, see
+    lost) the manager turns to "missing" and capture threads block in wait
+    (no wakeups at all) until the same device comes back, whatever kernel
+    name it gets; then path is updated so that the capture object can be
+    bound to the new node.
+    Without a stored device, the configured node or the first available
+    camera is taken (as imaging.initializeCamera does).
+
+    source is where devices come from: anything with udev.deviceIndex
+    monitor, sync, scan, get, devices and byDevice methods (udev.index by
+    default, a fake one in tests).
+
+    NOTE: update has to be called whenever the descriptor returned by start
+          is readable (eg. through gobject.io_add_watch), after the source
+          read pending events if it's watched (see udev.deviceIndex.watch),
+          or, if start returned None, every rescan seconds while the camera
+          is missing.
+    '''
+
+    def __init__(self, path, device=None, source=None):
+        self.path = path
+        self.device = device
+        self.source = source
+        if self.source is None:
+            self.source = udev.index
+        self.fd = None
+        self.present = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        ''' Subscribes to device events, returns the descriptor to watch or
+        None if events are not available (see rescan) '''
+        self.fd = self.source.monitor()
+        if self.fd is None:
+            logger.info(
+                "Device events not available, looking for missing cameras "
+                "every %d seconds" % rescan)
+        self.update()
+        return self.fd
+
+    # current camera node, None if the camera is missing
+    def locate(self):
+        kernel = udev.resolve(self.path)
+        if self.device is not None:
+            # the very device (not just any device on the same bus)
+            kernels = self.source.byDevice(self.device)
+            if kernel in kernels:
+                return self.path
+        else:
+            if self.source.get('video4linux', kernel) is not None:
+                return self.path
+            kernels = self.source.devices('video4linux')
+        if kernels:
+            return os.path.join('/dev', kernels[0])
+        return None
+
+    def update(self, scan=False):
+        ''' Looks for the camera (applying pending device events, or all
+        devices again if scan), returns 0 if the camera is present '''
+        if scan or self.fd is None:
+            self.source.scan()
+        else:
+            self.source.sync()
+        path = self.locate()
+        with self.cond:
+            if path is None and self.present:
+                logger.warning("Camera %s removed" % self.path)
+            elif path is not None and not self.present:
+                logger.info("Camera available at %s" % path)
+            elif path is not None and path != self.path:
+                logger.info("Camera %s moved to %s" % (self.path, path))
+            if path is not None:
+                self.path = path
+            self.present = path is not None
+            self.cond.notifyAll()
+        if self.present:
+            return 0
+        return 1
+
+    def lost(self, err=None):
+        ''' Capture failed with a "gone" error (see goneErrors): devices are
+        scanned again, returns 0 if the camera is still (or again) there '''
+        if err is not None:
+            logger.debug("Camera %s error: %s" % (self.path, err))
+        return self.update(scan=True)
+
+    def wait(self, stop=None):
+        ''' Blocks until the camera is present or stop (a callable) returns
+        True (see wake), returns 0 in the first case, 1 otherwise '''
+        with self.cond:
+            while not self.present:
+                if stop is not None and stop():
+                    return 1
+                self.cond.wait()
+        return 0
+
+    # wake up waiting threads (eg. because stop condition changed)
+    def wake(self):
+        with self.cond:
+            self.cond.notifyAll()
@@ -0,0 +1,359 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import stat
+import time
+import errno
+import fcntl
+import logging
+import tempfile
+import threading
+
+from calise.infos import __LowerName__
+
+
+logger = logging.getLogger('.'.join([__LowerName__, 'lease']))
+
+# lease priorities, when a camera is freed the waiter with the highest
+# priority takes it
+SERVICE = 0
+INTERACTIVE = 10
+CALIBRATION = 20
+priorities = (SERVICE, INTERACTIVE, CALIBRATION)
+
+# shared by every user (service can be run as root): sticky and world
+# writable, like its parent, owned by root or by whoever uses it (anybody
+# else could replace its contents)
+leaseDir = os.path.join(tempfile.gettempdir(), '%s-lease' % __LowerName__)
+# no symlinks, no blocking on fifos
+openFlags = getattr(os, 'O_NOFOLLOW', 0) | os.O_NONBLOCK
+
+
+def pidOwner(pid):
+    ''' Uid of process pid, None if there's no such process, -1 if it exists
+    but its owner can't be told (eg. /proc mounted with hidepid) '''
+    try:
+        return os.stat('/proc/%d' % pid).st_uid
+    except OSError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        # EPERM: process exists but belongs to another user
+        if err.errno == errno.EPERM:
+            return -1
+        return None
+    return -1
+
+
+class leaseWaiter(threading.Thread):
+    ''' Background lease taker
+
+    Blocks on the lock file descriptor fd (flock) giving way to waiters of
+    lease with a higher priority (blocking on their queue entries until
+    they're done), sets wakeup once finished: then granted tells whether fd
+    holds the lock.
+
+    NOTE: a cancelled waiter keeps blocking until the lock (or the entry
+          it's waiting on) is freed, then it closes fd; if cancel returns
+          True the lock was already granted and closing fd is up to the
+          caller.
+    '''
+
+    def __init__(self, lease, fd, wakeup):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lease = lease
+        self.fd = fd
+        self.wakeup = wakeup
+        self.mutex = threading.Lock()
+        self.granted = False
+        self.cancelled = False
+        self.finished = False
+        self.error = None
+
+    def run(self):
+        try:
+            self.take()
+        except (IOError, OSError) as err:
+            self.error = err
+        with self.mutex:
+            if not self.granted:
+                os.close(self.fd)
+            self.finished = True
+        self.wakeup.set()
+
+    def take(self):
+        while not self.cancelled:
+            higher = self.lease.higher()
+            if higher:
+                self.lease.waitEntry(higher[0])
+                continue
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            if not self.lease.higher():
+                with self.mutex:
+                    self.granted = not self.cancelled
+                return
+            # a higher priority waiter showed up meanwhile
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def cancel(self):
+        with self.mutex:
+            self.cancelled = True
+            return self.granted
+
+
+class cameraLease():
+    ''' Exclusive camera lease among calise programs
+
+    Every camera has a lock file inside leaseDir, the lease holder keeps an
+    exclusive flock on it (so that the kernel frees the lease as soon as the
+    holder dies) and writes there its pid and priority. Waiters register
+    themselves inside leaseDir ("<camera>.<priority>.<pid>.<id>.wait",
+    exclusively flocked as long as they wait) and block on the lock (see
+    leaseWaiter), giving way to any live waiter with a higher priority by
+    blocking on its entry; so a freed camera is taken by the next calise
+    program right away instead of at its next blind retry, and nobody wakes
+    up meanwhile.
+
+    NOTE: programs other than calise ones are not aware of leases, they can
+          still hold the device (capture.imaging raises on EBUSY).
+    NOTE: callers changing what acquire's stop callable returns have to call
+          wake afterwards.
+    '''
+
+    def __init__(self, device, priority=SERVICE):
+        self.name = (
+            os.path.basename(str(device)).replace('.', '_') or 'camera')
+        self.priority = priority
+        self.fd = None
+        self.entry = None  # waiter queue entry path
+        self.efd = None    # waiter queue entry descriptor
+        self.wakeup = threading.Event()
+
+    def lockPath(self):
+        return os.path.join(leaseDir, '%s.lock' % self.name)
+
+    def prepare(self):
+        ''' Creates leaseDir if needed, returns 0 if it can be trusted '''
+        try:
+            os.mkdir(leaseDir, 0700)
+            os.chmod(leaseDir, 01777)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        info = os.lstat(leaseDir)
+        if not stat.S_ISDIR(info.st_mode):
+            logger.error("%s is not a directory" % leaseDir)
+            return 1
+        if info.st_uid not in (0, os.getuid()):
+            logger.error(
+                "%s is owned by another user (uid %d)"
+                % (leaseDir, info.st_uid))
+            return 1
+        if info.st_mode & stat.S_IWOTH and not info.st_mode & stat.S_ISVTX:
+            logger.error("%s is world writable but not sticky" % leaseDir)
+            return 1
+        return 0
+
+    # live waiters for this camera as [(priority, pid, path), ...], stale
+    # entries (left by dead processes) are removed; entries which are not
+    # regular files, have unknown priorities or don't belong to the owner of
+    # the process they name are ignored
+    def waiters(self):
+        waiters = []
+        for entry in os.listdir(leaseDir):
+            fields = entry.split('.')
+            if (
+                len(fields) != 5 or fields[0] != self.name or
+                fields[-1] != 'wait'
+            ):
+                continue
+            path = os.path.join(leaseDir, entry)
+            if path == self.entry:
+                continue
+            try:
+                priority, pid = int(fields[1]), int(fields[2])
+                info = os.lstat(path)
+            except (ValueError, OSError):
+                continue
+            if not stat.S_ISREG(info.st_mode) or not priority in priorities:
+                continue
+            owner = pidOwner(pid)
+            if owner is None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            if owner != info.st_uid:
+                continue
+            waiters.append((priority, pid, path))
+        return waiters
+
+    # entries of live waiters with a higher priority, highest first
+    def higher(self):
+        return [path for p, pid, path in sorted(self.waiters(), reverse=True)
+                if p > self.priority]
+
+    # blocks until the waiter which registered path is done
+    def waitEntry(self, path):
+        try:
+            fd = os.open(path, os.O_RDONLY | openFlags)
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                return
+            raise
+        try:
+            if stat.S_ISREG(os.fstat(fd).st_mode):
+                fcntl.flock(fd, fcntl.LOCK_SH)
+        finally:
+            os.close(fd)
+
+    # adds this lease to the waiters queue, the entry is locked before it
+    # gets its name so that nobody sees it unlocked
+    def register(self):
+        self.entry = os.path.join(leaseDir, '%s.%d.%d.%d.wait' % (
+            self.name, self.priority, os.getpid(), id(self)))
+        temp = self.entry + '.new'
+        flags = os.O_RDWR | os.O_CREAT | os.O_EXCL | openFlags
+        self.efd = os.open(temp, flags, 0644)
+        fcntl.flock(self.efd, fcntl.LOCK_EX)
+        os.rename(temp, self.entry)
+
+    def unregister(self):
+        os.remove(self.entry)
+        os.close(self.efd)
+        self.entry = None
+        self.efd = None
+
+    # wake acquire up so that its stop callable is checked again
+    def wake(self):
+        self.wakeup.set()
+
+    # current holder as (pid, priority), None if unknown
+    def holder(self):
+        try:
+            with open(self.lockPath()) as fp:
+                pid, priority = fp.read().split()
+            return int(pid), int(priority)
+        except (IOError, ValueError):
+            return None
+
+    # leases can't be used (see acquire)
+    def unleased(self, err):
+        logger.warning(
+            "Camera %s lease not available (%s), using the camera anyway"
+            % (self.name, err))
+        return 0
+
+    def acquire(self, timeout=None, stop=None):
+        ''' Waits for the camera lease
+
+        Returns 0 once the lease is held, 1 if timeout (seconds) expired or
+        stop (a callable) returned True before.
+
+        NOTE: If leaseDir or the lock file can't be used (eg. not trusted or
+              EACCES), 0 is returned right away without holding the lease:
+              the camera itself is still exclusive (see capture.imaging).
+        '''
+        if self.fd is not None:
+            return 0
+        try:
+            if self.prepare() != 0:
+                return self.unleased("untrusted %s" % leaseDir)
+            fd = os.open(
+                self.lockPath(), os.O_RDWR | os.O_CREAT | openFlags, 0666)
+        except OSError as err:
+            return self.unleased(err)
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            os.close(fd)
+            return self.unleased("%s is not a file" % self.lockPath())
+        try:
+            os.fchmod(fd, 0666)
+        except OSError:
+            # lock file created by another user
+            pass
+        # free camera (the usual case): no need to queue
+        if not self.higher():
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return self.hold(fd)
+            except IOError as err:
+                if err.errno not in (errno.EAGAIN, errno.EACCES):
+                    os.close(fd)
+                    raise
+        logger.info(
+            "Camera %s is leased (holder: %s), waiting..."
+            % (self.name, self.holder()))
+        self.wakeup.clear()
+        deadline = timer = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+            timer = threading.Timer(timeout, self.wakeup.set)
+            timer.daemon = True
+            timer.start()
+        try:
+            self.register()
+        except OSError as err:
+            if timer is not None:
+                timer.cancel()
+            os.close(fd)
+            if self.efd is not None:
+                os.close(self.efd)
+            self.entry = self.efd = None
+            return self.unleased(err)
+        waiter = leaseWaiter(self, fd, self.wakeup)
+        waiter.start()
+        try:
+            while not waiter.finished:
+                if (
+                    (stop is not None and stop()) or
+                    (deadline is not None and time.time() >= deadline)
+                ):
+                    if waiter.cancel():
+                        os.close(fd)
+                    return 1
+                self.wakeup.wait()
+                self.wakeup.clear()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self.unregister()
+        if waiter.error is not None:
+            return self.unleased(waiter.error)
+        if not waiter.granted:
+            return 1
+        logger.info("Camera %s lease obtained" % self.name)
+        return self.hold(fd)
+
+    # lock taken on fd: lease the camera
+    def hold(self, fd):
+        os.ftruncate(fd, 0)
+        os.write(fd, '%d %d\n' % (os.getpid(), self.priority))
+        self.fd = fd
+        return 0
+
+    def release(self):
+        if self.fd is None:
+            return 1
+        os.ftruncate(self.fd, 0)
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+        return 0
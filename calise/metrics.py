@@ -0,0 +1,224 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import threading
+import tempfile
+
+from calise.infos import __LowerName__
+
+
+# metrics are only collected once enabled (see enable()), inc(), observe()
+# and timer() are no-ops otherwise
+enabled = False
+
+# seconds buckets, for latency histograms
+timeBuckets = (.001, .005, .01, .05, .1, .5, 1.0, 5.0, 10.0)
+# definitions syntax:
+#   name: (type, help, buckets)
+definitions = {
+    'frames_total': (
+        'counter', "Camera frames read", None),
+    'frame_eagain_total': (
+        'counter', "Camera reads retried because of EAGAIN", None),
+    'frame_seconds': (
+        'histogram', "Camera frame read latency (retries included)",
+        timeBuckets),
+    'measurements_total': (
+        'counter', "Ambient brightness measurements (capture sessions)", None),
+    'frames_per_measurement': (
+        'histogram', "Frames captured per ambient brightness measurement",
+        (1, 2, 5, 10, 15, 20, 30, 50)),
+    'backlight_reads_total': (
+        'counter', "Sysfs backlight files read", None),
+    'backlight_writes_total': (
+        'counter', "Backlight steps written on sysfs", None),
+    'backlight_write_seconds': (
+        'histogram', "Sysfs backlight write latency", timeBuckets),
+    'ephem_seconds': (
+        'histogram', "Sun position (ephem) computation time", timeBuckets),
+    'weather_fetch_seconds': (
+        'histogram', "Weather internet lookup time", timeBuckets),
+    'geoip_fetch_seconds': (
+        'histogram', "Geoip internet lookup time", timeBuckets),
+    'thread_wakeups_total': (
+        'counter', "Service thread wakeups", None),
+    'backlight_overrides_total': (
+        'counter', "Backlight steps changed outside of the service", None),
+    'learned_overrides_total': (
+        'counter', "User backlight overrides learned (offset/delta updated)",
+        None),
+    'display_off_cycles_total': (
+        'counter', "Capture cycles skipped because displays were off", None),
+}
+
+registry = {}
+lock = threading.Lock()
+
+
+class counter():
+
+    def __init__(self, name, helpstr):
+        self.name = name
+        self.help = helpstr
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+    def prometheus(self, prefix):
+        name = '%s_%s' % (prefix, self.name)
+        return [
+            '# HELP %s %s' % (name, self.help),
+            '# TYPE %s counter' % name,
+            '%s %s' % (name, self.value)]
+
+
+class histogram():
+    ''' Fixed buckets histogram (counts are non-cumulative internally) '''
+
+    def __init__(self, name, helpstr, buckets):
+        self.name = name
+        self.help = helpstr
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        idx = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            idx += 1
+        self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+    def prometheus(self, prefix):
+        name = '%s_%s' % (prefix, self.name)
+        lines = [
+            '# HELP %s %s' % (name, self.help),
+            '# TYPE %s histogram' % name]
+        total = 0
+        for idx in range(len(self.buckets)):
+            total += self.counts[idx]
+            lines.append(
+                '%s_bucket{le="%s"} %d' % (name, self.buckets[idx], total))
+        lines.append('%s_bucket{le="+Inf"} %d' % (name, self.count))
+        lines.append('%s_sum %s' % (name, self.sum))
+        lines.append('%s_count %d' % (name, self.count))
+        return lines
+
+
+def enable(status=True):
+    global enabled
+    enabled = status
+    return 0
+
+
+def get(name):
+    ''' Registered metric object (created on first request) '''
+    metric = registry.get(name)
+    if metric is None:
+        with lock:
+            metric = registry.get(name)
+            if metric is None:
+                mtype, helpstr, buckets = definitions[name]
+                if mtype == 'histogram':
+                    metric = histogram(name, helpstr, buckets)
+                else:
+                    metric = counter(name, helpstr)
+                registry[name] = metric
+    return metric
+
+
+def inc(name, n=1):
+    if enabled:
+        get(name).inc(n)
+
+
+def observe(name, value):
+    if enabled:
+        get(name).observe(value)
+
+
+class timer():
+    ''' Histogram timer, usage: with metrics.timer('name'): ... '''
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start is not None:
+            observe(self.name, time.time() - self.start)
+        return False
+
+
+def timed(name):
+    ''' Histogram timer decorator '''
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    ''' {name: value} of every metric collected so far '''
+    return dict([(k, registry[k].snapshot()) for k in registry.keys()])
+
+
+def prometheus(prefix=__LowerName__):
+    ''' Prometheus text exposition format of every metric collected '''
+    lines = []
+    for name in sorted(registry.keys()):
+        lines += registry[name].prometheus(prefix)
+    return '\n'.join(lines) + '\n'
+
+
+def dump(path):
+    ''' Atomically writes prometheus() output to path (eg. to be read by
+    node_exporter textfile collector) '''
+    fd, tmp = tempfile.mkstemp(
+        prefix='.%s-' % os.path.basename(path), dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as fp:
+        fp.write(prometheus())
+    os.chmod(tmp, 0644)
+    os.rename(tmp, path)
+    return 0
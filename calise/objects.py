@@ -16,13 +16,26 @@
 #    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
 
 import time
+import errno
 import datetime
 import logging
+import threading
 
 from calise.system import computation
-from calise.capture import imaging, processList
+from calise.capture import imaging, processList, formatCaptureMode
+from calise.capture import fusionCapture, CameraError
+from calise.hotplug import cameraManager, goneErrors
+from calise import camera
+from calise.backlight import stepFromPercentage, backlightGroup, parseGroup
+from calise.backlight import percentageFromStep
+from calise.calibration.fit import onlineFit
+from calise.backlight import transition
+from calise.lease import cameraLease, SERVICE
 from calise.sun import getSun, get_daytime_mul, get_geo
 from calise.infos import __LowerName__
+from calise.optionsd import update_profile
+from calise import startup
+from calise import metrics
 
 
 caliseCompute = computation()
@@ -33,25 +46,149 @@ def forceTerm():
     sys.exit(1)
 
 
+def parseFusion(settings):
+    ''' Secondary cameras list from 'fusecams', 'fuseofs' and 'fusedel'
+    (comma separated) settings, as [(path, offset, delta), ...]
+
+    Missing offsets and deltas default to the primary camera ones ('offset'
+    and 'delta' settings), ValueError is raised for malformed lists.
+    '''
+    if not settings.get('fusecams'):
+        return []
+    paths = [x.strip() for x in settings['fusecams'].split(',')]
+    values = []
+    for key, default in (('fuseofs', 'offset'), ('fusedel', 'delta')):
+        if settings.get(key):
+            values.append(
+                [float(x) for x in str(settings[key]).split(',')])
+        else:
+            values.append([float(settings[default])] * len(paths))
+    offsets, deltas = values
+    if not len(paths) == len(offsets) == len(deltas):
+        raise ValueError(
+            "Fusion devices, offsets and deltas must have the same length")
+    return zip(paths, offsets, deltas)
+
+
 class objects():
 
+    # user overrides hold (see checkOverride): percentage points band and
+    # maximum seconds
+    holdBand = 10.0
+    holdTimeout = 3600.0
+
     def __init__(self, settings):
         self.logger = logging.getLogger(".".join([__LowerName__, 'objects']))
         self.arguments = settings
+        self.pending = {}  # settings changes waiting for next cycle
+        self.pendingLock = threading.Lock()
         self.oldies = []
         self.resetComers()
         self.wts = None  # weather timestamp
         self.gts = None  # geoip timestamp
         self.capture = imaging()
-        self.capture.initializeCamera(self.arguments['cam'])
+        self.lease = None
+        self.bound = None  # camera node the capture object is bound to
+        # camera hotplug (see bindCamera), the profile device is followed
+        # whatever node it gets
+        self.cameras = cameraManager(
+            self.arguments['cam'], self.arguments.get('udevdev'))
+        with startup.phase('camera-init'):
+            self.cameras.start()
+            if self.cameras.present:
+                self.attachCamera(self.cameras.path)
+            else:
+                self.logger.warning(
+                    "Camera %s not available, waiting for it"
+                    % self.arguments['cam'])
+        # secondary cameras (multi-camera fusion), if any
+        self.fusion = None
+        try:
+            fused = parseFusion(self.arguments)
+        except ValueError as err:
+            self.logger.error(
+                "Fusion disabled, bad [Fusion] settings: %s" % err)
+            fused = []
+        if fused:
+            self.fusion = fusionCapture(
+                fused, self.arguments['offset'], self.arguments['delta'])
+        # additional backlight interfaces, if any
+        self.group = None
+        if self.arguments.get('bkgroup'):
+            self.group = backlightGroup(parseGroup(self.arguments['bkgroup']))
+        # smooth transitions on main backlight interface, if enabled
+        self.transition = None
+        if self.arguments.get('bktrans'):
+            self.transition = transition(
+                self.arguments['path'], self.arguments['bktrans'],
+                self.arguments.get('bkrate') or 20.0)
+            self.transition.start()
+        # user backlight overrides learning (see checkOverride)
+        self.written = None  # last step written by the service
+        self.held = None  # user override being kept (see checkOverride)
+        self.heldRef = None  # percentage the hold band is centered on
+        self.heldSince = None
+        self.learner = None
+        if self.arguments.get('learn'):
+            self.learner = onlineFit(
+                self.arguments['offset'], self.arguments['delta'],
+                self.arguments['exponent'])
         self.stop = False
 
+    def attachCamera(self, path):
+        self.capture.initializeCamera(
+            path, self.arguments.get('capmode'), self.arguments.get('ctrls'))
+        self.bound = path
+        # other calise programs (interactive, calibration) take precedence
+        self.lease = cameraLease(self.capture.camPath, SERVICE)
+
+    def bindCamera(self, stop=None):
+        ''' Camera hotplug handling, to be called before every capture
+
+        If the camera is missing (see calise.hotplug) the capture object is
+        detached and the caller blocks until the camera comes back or stop
+        (a callable) returns True; a camera back on a different node is
+        bound again. Returns 0 when a camera is bound, 1 if stopped before.
+        '''
+        if not self.cameras.present:
+            if self.capture.cameraObj is not None:
+                self.capture.detachCamera()
+                self.logger.warning(
+                    "Camera missing, capture schedule suspended")
+            if self.cameras.wait(stop) != 0:
+                return 1
+        if self.capture.cameraObj is None or self.bound != self.cameras.path:
+            self.capture.detachCamera()
+            self.attachCamera(self.cameras.path)
+            self.logger.info(
+                "Camera bound to %s, capture schedule resumed"
+                % self.capture.camPath)
+        return 0
+
     def dumpValues(self, allv=False):
         if allv:
             return self.oldies
         else:
             return self.oldies[-1]
 
+    def historyRange(self, since=0, until=0):
+        ''' oldies index range (start, end) of captures whose timestamp is
+        within since and until (0 means unbounded), through binary search
+        (oldies are stored in capture order) '''
+        def bisect(ts, right=False):
+            lo, hi = 0, len(self.oldies)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                cts = self.oldies[mid]['cts']
+                if cts < ts or (right and cts == ts):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+        start = bisect(since) if since else 0
+        end = bisect(until, True) if until else len(self.oldies)
+        return start, end
+
     def resetComers(self):
         self.newcomers = {
             "amb": None,  # ambient brightness
@@ -77,50 +214,118 @@ class objects():
               returns EAGAIN for more than 15 seconds, in that case requests
               will continue until *success* or TERM flag is set (through
               self.stop).
+        NOTE: The camera is taken through a lease (see calise.lease) so that
+              captures wait for other calise programs and start as soon as
+              they're done with the camera; retries every 10 seconds are
+              left only for programs unaware of leases.
+        NOTE: If the camera is unplugged, CameraError (ENODEV) is raised and
+              the camera is looked for again (see bindCamera).
         '''
         if not self.newcomers['cts']:
             self.getCts()
+        # (no waiting here, that's up to callers)
+        if self.bindCamera(lambda: True) != 0:
+            raise CameraError(
+                errno.ENODEV, "Camera %s is missing" % self.cameras.path)
         while True:
-            # camera initialization
-            ci = 1
-            while ci != 0:
+            # camera lease
+            if self.lease.acquire(stop=lambda: self.stop is True) != 0:
+                forceTerm()
+                break
+            try:
+                # camera initialization
+                ci = 1
+                while ci != 0:
+                    try:
+                        self.capture.startCapture()
+                        ci = 0
+                    except KeyboardInterrupt:
+                        if ci == 1:
+                            ci = -1
+                            self.logger.error(
+                                "Camera object is busy (not by calise). "
+                                "Waiting until it's available again (check "
+                                "every 10 seconds).")
+                        # check if term flag (self.stop) is set, once per
+                        # second for 10 seconds
+                        for x in range(10):
+                            if self.stop is True:
+                                forceTerm()
+                                break
+                            elif self.stop is False:
+                                time.sleep(1)
+                # camera capture
+                if self.capture.negotiated:
+                    self.storeCaptureMode()
+                # secondary cameras capture alongside the primary one
+                if self.fusion:
+                    self.fusion.start(
+                        self.arguments['capint'], self.arguments['capnum'])
                 try:
-                    self.capture.startCapture()
-                    ci = 0
+                    camValues = self.capture.getFrameBri(
+                        self.arguments['capint'], self.arguments['capnum'])
                 except KeyboardInterrupt:
-                    if ci == 1:
-                        ci = -1
-                        self.logger.error(
-                            "Camera object is busy. Waiting until it's "
-                            "available again (check every 10 seconds).")
-                    # check if term flag (self.stop) is set, once per second for
-                    # 10 seconds
-                    for x in range(10):
-                        if self.stop is True:
-                            forceTerm()
-                            break
-                        elif self.stop is False:
-                            time.sleep(1)
-            # camera capture
-            try:
-                camValues = self.capture.getFrameBri(
-                    self.arguments['capint'], self.arguments['capnum'])
-            except KeyboardInterrupt:
-                if self.stop is True:
-                    forceTerm()
-                    break
-                else:
-                    continue
-            # camera uninitialization
-            self.capture.stopCapture()
+                    # session dropped, secondary ones are waited for (their
+                    # values are discarded by next collect)
+                    self.capture.stopCapture()
+                    if self.fusion:
+                        self.fusion.collect(self.arguments['capint'] * 2)
+                    if self.stop is True:
+                        forceTerm()
+                        break
+                    else:
+                        continue
+                startup.mark('first-frame')
+                # camera uninitialization
+                self.capture.stopCapture()
+            except camera.Error as err:
+                if err[0] not in goneErrors:
+                    raise
+                # camera unplugged: next cycle waits for it (see bindCamera)
+                self.cameras.lost(err)
+                raise CameraError(
+                    errno.ENODEV, "Camera %s is gone" % self.bound)
+            finally:
+                # whatever happened, other calise programs may go on
+                self.lease.release()
+            self.logger.debug(
+                "Camera control ioctls saved so far: %d"
+                % self.capture.ctrlSaved)
+            metrics.inc('measurements_total')
+            metrics.observe('frames_per_measurement', len(camValues))
             camValues = processList(camValues)
             self.logger.debug(
                 "Processed values: %s"
                 % ', '.join(["%d" % x for x in camValues]))
             self.newcomers['amb'] = sum(camValues) / float(len(camValues))
+            if self.fusion:
+                # secondary sessions started together with primary one, only
+                # wait for them a couple of capture intervals more
+                fusedValues = self.fusion.collect(self.arguments['capint'] * 2)
+                self.newcomers['amb'] = (
+                    (self.newcomers['amb'] + sum(fusedValues)) /
+                    float(len(fusedValues) + 1))
             break
         return self.newcomers['amb']
 
+    # stop backlight transition thread (if any)
+    def releaseBacklight(self):
+        if self.transition:
+            self.logger.debug(
+                "Backlight transition writes: %d" % self.transition.writes)
+            self.transition.stop()
+
+    # cache negotiated capture mode in the profile (so that next service
+    # start can skip negotiation)
+    def storeCaptureMode(self):
+        self.capture.negotiated = False
+        mode = formatCaptureMode(self.capture.capMode)
+        self.arguments['capmode'] = mode
+        if update_profile(
+            'Udev', {'capture-mode': mode},
+            self.arguments.get('profile', 'default')) is None:
+            self.logger.debug("No writable profile to store capture mode in")
+
     # simple function to obtain screen brightness (new or existing value)
     def getScr(self):
         if not self.newcomers['cts']:
@@ -149,7 +354,8 @@ class objects():
             self.arguments['offset'], self.arguments['delta'],
             self.newcomers['scr'],
             self.arguments['scrmul'],
-            self.adjustScale(self.newcomers['cbs']))
+            self.adjustScale(self.newcomers['cbs']),
+            self.arguments['exponent'])
         self.logger.debug(
             "Correction amount (in /255): %4.1f" % caliseCompute.cor)
         self.newcomers['pct'] = caliseCompute.pct
@@ -168,15 +374,8 @@ class objects():
         steps = self.arguments['steps']
         bkofs = self.arguments['bkofs']
         self.getPct()
-        stp = int(self.newcomers['pct'] / (100.0 / steps) - .5 + bkofs)
-        if self.arguments['invert']:
-            stp = steps - 1 + bkofs - stp + bkofs
-        # out-of-bounds control...
-        if stp > steps - 1 + bkofs:
-            stp = steps - 1 + bkofs
-        elif stp < bkofs:
-            stp = bkofs
-        self.newcomers['sbs'] = stp
+        self.newcomers['sbs'] = stepFromPercentage(
+            self.newcomers['pct'], steps, bkofs, self.arguments['invert'])
         return self.newcomers['sbs']
 
     # complementary to getPct function
@@ -195,11 +394,30 @@ class objects():
         if standalone:
             self.getCts()
         self.getSbs()
+        if self.checkOverride():
+            # user choice is kept, model now follows it
+            return 1
         bfile = self.arguments['bfile']
         if self.arguments['invert']:
             increasing = not increasing
         refer = int(self.newcomers['sbs']) - int(self.newcomers['cbs'])
-        if abs(refer) > 0 and increasing is None:
+        if self.group and increasing is None:
+            # additional interfaces are written while writing the main one
+            self.group.start(self.newcomers['pct'])
+        try:
+            return self.writeMainStep(refer, increasing, bfile)
+        finally:
+            if self.group:
+                self.group.join()
+
+    def writeMainStep(self, refer, increasing, bfile):
+        if abs(refer) > 0 and increasing is None and self.transition:
+            # ramp (and write permission check) are up to transition thread
+            self.transition.setTarget(self.newcomers['sbs'])
+            self.newcomers['cbs'] = self.newcomers['sbs']
+            self.written = self.newcomers['sbs']
+            return 0
+        elif abs(refer) > 0 and increasing is None:
             try:
                 fp = open(bfile, 'w')
             except IOError as err:
@@ -211,13 +429,100 @@ class objects():
                         % (err.errno, bfile))
                     return 2
             else:
-                with fp:
+                with metrics.timer('backlight_write_seconds'), fp:
                     fp.write(str(self.newcomers['sbs']) + "\n")
                     self.newcomers['cbs'] = self.newcomers['sbs']
-                    return 0
+                    self.written = self.newcomers['sbs']
+                metrics.inc('backlight_writes_total')
+                startup.mark('first-backlight-write')
+                return 0
         else:
             return 1
 
+    def checkOverride(self):
+        ''' User backlight overrides detection
+
+        If current backlight step differs from the last one written by the
+        service, someone else (the user) changed it: that step is taken as
+        the right one for current ambient brightness, so it's not
+        overwritten and, if learning is enabled ('learn' setting), the
+        (ambient, user percentage) point updates offset and delta (stored
+        in the profile too).
+        The user step is then held until the computed percentage moves more
+        than holdBand away from the one computed on the first cycle after
+        the override (that is, ambient brightness changed enough) or for
+        holdTimeout seconds at most.
+        Returns True if the current step has to be kept.
+        '''
+        cbs = self.newcomers['cbs']
+        if self.written is None:
+            # no reference yet, current step is the baseline
+            self.written = cbs
+            return False
+        if cbs == self.written or (
+            self.transition and self.transition.ramping()
+        ):
+            return self.checkHold()
+        self.logger.info(
+            "Backlight step changed from %d to %d outside of the service, "
+            "keeping it" % (self.written, cbs))
+        metrics.inc('backlight_overrides_total')
+        self.written = cbs
+        self.held = cbs
+        self.heldRef = None
+        self.heldSince = time.time()
+        if self.learner is None:
+            return True
+        pct = percentageFromStep(
+            cbs, self.arguments['steps'], self.arguments['bkofs'],
+            self.arguments['invert'])
+        fit = self.learner.update(
+            self.newcomers['amb'] - caliseCompute.cor, pct)
+        if fit is None:
+            return True
+        # rounded so that values read back from the profile are the same
+        offset, delta = round(fit[0], 3), round(fit[1], 6)
+        self.arguments['offset'] = self.learner.offset = offset
+        self.arguments['delta'] = self.learner.delta = delta
+        metrics.inc('learned_overrides_total')
+        self.logger.info(
+            "Learned from user override (%d so far): offset %.2f, "
+            "delta %.4f" % (self.learner.points, offset, delta))
+        update_profile(
+            'Camera', {'offset': offset, 'delta': delta},
+            self.arguments.get('profile', 'default'))
+        return True
+
+    # True while an user override is held (see checkOverride)
+    def checkHold(self):
+        if self.held is None:
+            return False
+        pct = self.newcomers['pct']
+        if time.time() - self.heldSince > self.holdTimeout:
+            reason = "timeout"
+        elif (
+            self.heldRef is not None and
+            abs(pct - self.heldRef) > self.holdBand
+        ):
+            reason = "ambient brightness changed"
+        else:
+            if self.heldRef is None:
+                # first cycle after the override (with learned values, if any)
+                self.heldRef = pct
+            return True
+        self.logger.info(
+            "Releasing backlight step %d set by the user (%s)"
+            % (self.held, reason))
+        self.resetOverride()
+        return False
+
+    # forget overrides state (eg. backlight driven by other programs)
+    def resetOverride(self):
+        self.written = None
+        self.held = None
+        self.heldRef = None
+        self.heldSince = None
+
     # get "weather" multiplier, updates only once per hour
     def getWtr(self, cur=None):
         if cur is None:
@@ -258,6 +563,35 @@ class objects():
         self.logger.debug("Function '%s' returned %d" % ('writeStep', r))
         return 0
 
+    def queueArguments(self, values):
+        ''' Queues settings changes, applied all together before next cycle
+        (so that a cycle never sees a partially updated configuration) '''
+        with self.pendingLock:
+            self.pending.update(values)
+
+    def applyArguments(self):
+        with self.pendingLock:
+            values, self.pending = self.pending, {}
+        if not values:
+            return 1
+        self.arguments.update(values)
+        if self.learner and (
+            self.arguments['offset'] != self.learner.offset or
+            self.arguments['delta'] != self.learner.delta or
+            self.arguments['exponent'] != self.learner.exponent
+        ):
+            # model changed elsewhere (eg. new calibration), start again
+            self.learner = onlineFit(
+                self.arguments['offset'], self.arguments['delta'],
+                self.arguments['exponent'])
+        if self.fusion:
+            self.fusion.offset = self.arguments['offset']
+            self.fusion.delta = self.arguments['delta']
+        self.logger.info(
+            "Settings updated: %s" % ', '.join(
+                ['%s=%s' % (k, values[k]) for k in sorted(values.keys())]))
+        return 0
+
     def executer(self, execute=True, ctime=None):
         ''' service "core"
 
@@ -267,6 +601,7 @@ class objects():
         accordingly
 
         '''
+        self.applyArguments()
         if not self.newcomers['cts']:
             self.getCts()
         if ctime is None:
@@ -16,6 +16,7 @@
 #    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
 import argparse
 import ConfigParser
 import logging
@@ -30,9 +31,12 @@ settings = {}
 # Logging
 logger = logging.getLogger('.'.join([__LowerName__, 'options']))
 
+# Compiled profiles cache: {path: profileSettings} (see load_profile)
+profileCache = {}
+
 # Service commands definitions
 execCommands = ['kill', 'restart', 'pause', 'resume', 'capture']
-queryCommands = ['dump', 'dumpall', 'dumpsettings', 'check']
+queryCommands = ['dump', 'dumpall', 'dumpsettings', 'metrics', 'check']
 serviceCommands = execCommands + queryCommands
 
 # Default service version's settings
@@ -49,6 +53,9 @@ defSerSettings = {
     'dusksm': 0.7,
     'nightst': 0.0,
     'path': None,
+    'exponent': 0.73,
+    'learn': True,
+    'powergate': True,
 }
 
 # Default interactive version's settings
@@ -65,8 +72,13 @@ defIntSettings = {
     'loglevel': 'warning',
     'logfile': None,
     'gui': True,
+    'attach': True,
     'verbose': False,
     'path': None,
+    'band': 2.0,
+    'tau': 30.0,
+    'jump': 20.0,
+    'exponent': 0.73,
 }
 
 
@@ -106,6 +118,91 @@ def get_path(pname='default', sufx='.conf'):
                 yield os.path.join(directory, pname + sufx)
 
 
+def editProfile(lines, section, values):
+    ''' Sets {option: value} pairs of %section inside profile lines
+
+    Only lines of given options are replaced (new options are appended to
+    the section, new sections to the profile), everything else (comments
+    included) is left untouched. Returns the list of changed options.
+    '''
+    optRe = re.compile(r'^\s*([^#;\s][^=:]*?)\s*[=:]')
+    secRe = re.compile(r'^\s*\[([^\]]+)\]')
+    pending = dict(values)
+    changed = []
+    current = None
+    end = None  # index after the last non blank line of %section
+    for idx, line in enumerate(lines):
+        match = secRe.match(line)
+        if match:
+            current = match.group(1).strip()
+            if current == section:
+                end = idx + 1
+            continue
+        if current != section:
+            continue
+        if line.strip():
+            end = idx + 1
+        match = optRe.match(line)
+        if not match or not match.group(1).strip() in pending:
+            continue
+        key = match.group(1).strip()
+        value = str(pending.pop(key))
+        newline = '%s = %s\n' % (key, value)
+        if line != newline:
+            lines[idx] = newline
+            changed.append(key)
+    if not pending:
+        return changed
+    added = ['%s = %s\n' % (k, pending[k]) for k in sorted(pending.keys())]
+    changed.extend(sorted(pending.keys()))
+    if end is None:
+        if lines and lines[-1].strip():
+            if not lines[-1].endswith('\n'):
+                lines[-1] += '\n'
+            lines.append('\n')
+        lines.extend(['[%s]\n' % section] + added)
+    else:
+        if not lines[end - 1].endswith('\n'):
+            lines[end - 1] += '\n'
+        lines[end:end] = added
+    return changed
+
+
+def update_profile(section, values, pname='default'):
+    ''' Profile updater
+
+    Stores given {option: value} pairs inside %section of the last (the most
+    user-specific) existing and writable profile among get_path(pname)
+    ones. Only changed options are rewritten (see editProfile), through a
+    temporary file renamed over the profile.
+    Returns updated profile path or None if there's no profile to update.
+
+    NOTE: used to cache values found at runtime (eg. negotiated capture mode)
+          so that next executions can skip finding them again.
+    '''
+    target = None
+    for path in get_path(pname):
+        if os.path.isfile(path) and os.access(path, os.W_OK):
+            target = path
+    if target is None:
+        return None
+    with open(target, 'r') as fp:
+        lines = fp.readlines()
+    changed = editProfile(lines, section, values)
+    if not changed:
+        return target
+    tmp = '%s.%d.tmp' % (target, os.getpid())
+    with open(tmp, 'w') as fp:
+        fp.writelines(lines)
+    os.chmod(tmp, os.stat(target).st_mode & 07777)
+    os.rename(tmp, target)
+    profileCache.pop(target, None)
+    logger.debug(
+        "Profile %s updated: %s" % (target, ', '.join(
+            ['%s.%s=%s' % (section, k, values[k]) for k in changed])))
+    return target
+
+
 class wlogger():
     ''' Logger initializer
 
@@ -207,6 +304,10 @@ class serviceGetArgs():
             action='version',
             version='%(pro)s %(ver)s' % dict(pro='%(prog)s', ver=__version__),
             help="display current version")
+        parser.add_argument(
+            '--profile-startup',
+            metavar='<path>', dest='profstart', default=None,
+            help="write startup import and phase timings (JSON) to <path>")
         # Service execution
         parser.add_argument(
             '-k', '--stop',
@@ -323,6 +424,10 @@ class serviceGetArgs():
             '--dump-settings',
             action='store_true', default=None, dest='dumpsettings',
             help="dump current execution's settings")
+        parser.add_argument(
+            '--metrics',
+            action='store_true', default=None, dest='metrics',
+            help="dump service metrics (Prometheus text format)")
         self.arguments = vars(parser.parse_args(self.argslist))
         self.parser = parser
 
@@ -417,6 +522,10 @@ class coreGetArgs():
             action='version',
             version='%(pro)s %(ver)s' % dict(pro='%(prog)s', ver=__version__),
             help="display current version")
+        parser.add_argument(
+            '--profile-startup',
+            metavar='<path>', dest='profstart', default=None,
+            help="write startup import and phase timings (JSON) to <path>")
         parser.add_argument(
             '--calibrate', '--configure',
             action='store_true', default=None, dest='configure',
@@ -451,6 +560,16 @@ class coreGetArgs():
             '--no-gui',
             action='store_true', default=None, dest='ngui',
             help="disable GUI (run cli-interface)")
+        parser.add_argument(
+            '--attach',
+            action='store_true', default=None, dest='yattach',
+            help=(
+                "GUI only: attach to a running service instead of using "
+                "the camera directly"))
+        parser.add_argument(
+            '--no-attach',
+            action='store_true', default=None, dest='nattach',
+            help="GUI only: always use the camera directly")
         parser.add_argument(
             '--screen',
             action='store_true', default=None, dest='yscreen',
@@ -514,6 +633,10 @@ class coreGetArgs():
             settings['gui'] = True
         elif args['ngui']:
             settings['gui'] = False
+        if args['yattach']:
+            settings['attach'] = True
+        elif args['nattach']:
+            settings['attach'] = False
         if args['yscreen']:
             settings['screen'] = True
         elif args['nscreen']:
@@ -545,14 +668,20 @@ class profiler():
         'Camera': {
             'offset': (float, 'offset'),
             'delta': (float, 'delta'),
+            'exponent': (float, 'exponent'),
             'camera': (str, 'cam'),
             'device': (str, 'cam'),
+            'controls': (str, 'ctrls'),
         },
         'Backlight': {
             'steps': (int, 'steps'),
             'offset': (int, 'bkofs'),
             'invert': (bool, 'invert'),
             'path': (str, 'path'),
+            'minimum': (int, 'bkmin'),
+            'group': (str, 'bkgroup'),
+            'transition': (float, 'bktrans'),
+            'transition-rate': (float, 'bkrate'),
         },
         'Service': {
             'latitude': (float, 'latitude'),
@@ -564,6 +693,10 @@ class profiler():
             'day-sleeptime': (float, 'dayst'),
             'night-sleeptime': (float, 'nightst'),
             'twilight-multiplier': (float, 'dusksm'),
+            'metrics': (bool, 'metrics'),
+            'metrics-file': (str, 'metricsfile'),
+            'learn': (bool, 'learn'),
+            'power-gating': (bool, 'powergate'),
             },
         'Daemon': {
             'latitude': (float, 'latitude'),
@@ -585,51 +718,132 @@ class profiler():
             'record': (bool, 'record'),
             'recordfile': (str, 'recfile'),
             'gui': (bool, 'gui'),
+            'attach': (bool, 'attach'),
             'verbose': (bool, 'verbose'),
+            'deadband': (float, 'band'),
+            'time-constant': (float, 'tau'),
+            'step-change': (float, 'jump'),
         },
         'Info': {
             'loglevel': (str, 'loglevel'),
             'logfile': (str, 'logfile'),
         },
+        'Udev': {
+            'device': (str, 'udevdev'),
+            'capture-mode': (str, 'capmode'),
+        },
+        'Fusion': {
+            'devices': (str, 'fusecams'),
+            'offsets': (str, 'fuseofs'),
+            'deltas': (str, 'fusedel'),
+        },
+        'Policy': {
+            'ac': (str, 'polac'),
+            'battery': (str, 'polbat'),
+        },
     }
 
-    def __init__(self):
-        self.config = ConfigParser.RawConfigParser()
-
     def check_config(self, configFile):
-        if os.path.isfile(configFile):
-            try:
-                self.config.read(configFile)
-                logger.info("Profile found: %s" % configFile)
-            except (
-                ConfigParser.MissingSectionHeaderError,
-                ConfigParser.ParsingError) as err:
-                err = str(err).replace('\t', '').splitlines()
-                logger.warning(err[0])
-                for line in err[1:]:
-                    logger.debug(line)
-                return 1
-            self.parse_config()
+        try:
+            prof = load_profile(configFile)
+        except (
+            ConfigParser.MissingSectionHeaderError,
+            ConfigParser.ParsingError) as err:
+            err = str(err).replace('\t', '').splitlines()
+            logger.warning(err[0])
+            for line in err[1:]:
+                logger.debug(line)
+            return 1
+        if prof is not None:
+            logger.info("Profile found: %s" % configFile)
+            prof.apply(settings)
         return 0
 
-    def parse_config(self, config=None):
-        global settings
-        if config is None:
-            config = self.config
-        # parse keys from options dictionary as self.settings keys
-        for option in self.options.keys():
-            for key in self.options[option]:
-                if config.has_option(option, key):
-                    vtype, skey = self.options[option][key]
+    def parse_config(self, config):
+        profileSettings(None, None, config).apply(settings)
+
+    def read_configs(self):
+        for conf in get_path():
+            self.check_config(conf)
+
+
+class profileSettings(object):
+    ''' Typed settings compiled out of a single profile
+
+    Every setting key of profiler.options is a slot, set only if the profile
+    has the corresponding option; source and stamp (mtime, size) identify
+    the profile file the object has been compiled from.
+    '''
+
+    __slots__ = ['source', 'stamp'] + sorted(set(
+        [v[1] for k in profiler.options.values() for v in k.values()]))
+
+    def __init__(self, source, stamp, config):
+        self.source = source
+        self.stamp = stamp
+        for section in profiler.options.keys():
+            for key in profiler.options[section]:
+                if config.has_option(section, key):
+                    vtype, skey = profiler.options[section][key]
                     if int == vtype:
-                        settings[skey] = config.getint(option, key)
+                        value = config.getint(section, key)
                     elif float == vtype:
-                        settings[skey] = config.getfloat(option, key)
+                        value = config.getfloat(section, key)
                     elif bool == vtype:
-                        settings[skey] = config.getboolean(option, key)
+                        value = config.getboolean(section, key)
                     else:
-                        settings[skey] = config.get(option, key)
+                        value = config.get(section, key)
+                    setattr(self, skey, value)
 
-    def read_configs(self):
-        for conf in get_path():
-            self.check_config(conf)
+    def keys(self):
+        return [key for key in self.__slots__[2:] if hasattr(self, key)]
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def apply(self, target):
+        ''' Copies every setting found in the profile to target dict '''
+        for key in self.keys():
+            target[key] = getattr(self, key)
+        return target
+
+
+def load_profile(path):
+    ''' Cached profile loader
+
+    Returns the profileSettings object of given profile path (None if there's
+    no such file). Profiles are parsed only once as long as their mtime and
+    size do not change, otherwise they're reparsed (hot-reload).
+
+    NOTE: ConfigParser parse errors are raised to the caller.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        profileCache.pop(path, None)
+        return None
+    if not os.path.isfile(path):
+        return None
+    stamp = (st.st_mtime, st.st_size)
+    prof = profileCache.get(path)
+    if prof is None or prof.stamp != stamp:
+        config = ConfigParser.RawConfigParser()
+        config.read(path)
+        prof = profileSettings(path, stamp, config)
+        profileCache[path] = prof
+    return prof
+
+
+def load_profiles(pname='default'):
+    ''' Merged settings dict of every profile found for given profile name,
+    following get_path() priority (only changed profiles get reparsed) '''
+    merged = {}
+    for path in get_path(pname):
+        try:
+            prof = load_profile(path)
+        except ConfigParser.Error as err:
+            logger.warning("Profile %s skipped: %s" % (path, err))
+            continue
+        if prof is not None:
+            prof.apply(merged)
+    return merged
@@ -0,0 +1,160 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import logging
+
+from calise.optionsd import profiler
+from calise.infos import __LowerName__
+
+
+logger = logging.getLogger('.'.join([__LowerName__, 'policy']))
+
+supplyClass = os.path.join('/sys', 'class', 'power_supply')
+# power sources
+AC = 'ac'
+BATTERY = 'battery'
+# settings a policy can change (all of them live settings, see
+# dbusService.methodHandler.liveSettings)
+policyKeys = (
+    'capnum', 'capint', 'dayst', 'nightst', 'dusksm', 'screen', 'geoip',
+    'weather')
+# boolean values, as ConfigParser.getboolean accepts them
+boolStates = {
+    '1': True, 'yes': True, 'true': True, 'on': True,
+    '0': False, 'no': False, 'false': False, 'off': False}
+
+
+def readAttr(supply, name, root=supplyClass):
+    try:
+        with open(os.path.join(root, supply, name)) as fp:
+            return fp.read().strip()
+    except IOError:
+        return None
+
+
+def powerSource(root=supplyClass):
+    ''' Current power source, either AC or BATTERY
+
+    AC if any mains (or USB) supply is online or if there are no batteries
+    at all (eg. desktops, sysfs not available), BATTERY otherwise.
+    '''
+    try:
+        supplies = os.listdir(root)
+    except OSError:
+        return AC
+    batteries = 0
+    for supply in supplies:
+        stype = readAttr(supply, 'type', root)
+        if stype in ('Mains', 'USB'):
+            if readAttr(supply, 'online', root) == '1':
+                return AC
+        elif stype == 'Battery' and readAttr(supply, 'present', root) != '0':
+            batteries += 1
+    if batteries:
+        return BATTERY
+    return AC
+
+
+def parsePolicy(string):
+    ''' Policy string to settings dictionary converter
+
+    Converts a "<option>:<value>,<option>:<value>,..." string (as stored in
+    profiles, option names are [Service] and [Advanced] ones, eg.
+    "capture-number:6,day-sleeptime:600,screen-compensation:no") into a
+    {settings key: typed value} dictionary. Invalid entries are skipped.
+    '''
+    options = dict(profiler.options['Advanced'])
+    options.update(profiler.options['Service'])
+    values = {}
+    for item in str(string or '').split(','):
+        if not item.strip():
+            continue
+        try:
+            name, value = [x.strip() for x in item.split(':')]
+            vtype, key = options[name]
+        except (ValueError, KeyError):
+            logger.warning("Invalid policy entry '%s', skipped" % item)
+            continue
+        if not key in policyKeys:
+            logger.warning("'%s' can't be set by policies, skipped" % name)
+            continue
+        try:
+            if vtype == bool:
+                value = boolStates[value.lower()]
+            else:
+                value = vtype(value)
+        except (ValueError, KeyError):
+            logger.warning("Invalid policy entry '%s', skipped" % item)
+            continue
+        values[key] = value
+    return values
+
+
+class policyEngine():
+    ''' Power source dependent settings
+
+    Every power source (AC, BATTERY) may have a policy, that is a set of
+    settings which override profile ones (base) while running on it (eg.
+    fewer captures per session and longer sleeptimes on battery).
+    values() is what settings should be now, it changes only when update()
+    reports a new power source.
+
+    NOTE: root is the power_supply sysfs class path (a fake tree in tests).
+    '''
+
+    def __init__(self, settings, root=supplyClass):
+        self.root = root
+        self.policies = {
+            AC: parsePolicy(settings.get('polac')),
+            BATTERY: parsePolicy(settings.get('polbat')),
+        }
+        self.source = None
+        self.base = {}
+        self.rebase(settings)
+
+    def enabled(self):
+        return any(self.policies.values())
+
+    def rebase(self, settings):
+        ''' Takes settings (eg. reloaded profiles) as base values, returns
+        them with current policy applied '''
+        for key in policyKeys:
+            if key in settings:
+                self.base[key] = settings[key]
+        return dict(settings, **self.values())
+
+    def update(self):
+        ''' Checks the power source, returns it if changed, None otherwise '''
+        source = powerSource(self.root)
+        if source == self.source:
+            return None
+        logger.info("Power source: %s" % source)
+        self.source = source
+        return source
+
+    # settings of the current source policy
+    def active(self):
+        if self.source is None:
+            return {}
+        return dict(self.policies[self.source])
+
+    def values(self):
+        values = dict(self.base)
+        if self.source is not None:
+            values.update(self.policies[self.source])
+        return values
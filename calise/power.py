@@ -0,0 +1,194 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import logging
+import dbus
+
+from calise.infos import __LowerName__
+
+
+logger = logging.getLogger('.'.join([__LowerName__, 'power']))
+
+loginName = 'org.freedesktop.login1'
+loginPath = '/org/freedesktop/login1'
+managerIface = 'org.freedesktop.login1.Manager'
+seatIface = 'org.freedesktop.login1.Seat'
+sessionIface = 'org.freedesktop.login1.Session'
+propertiesIface = 'org.freedesktop.DBus.Properties'
+drmClass = os.path.join('/sys', 'class', 'drm')
+
+
+def displayOff():
+    ''' True if every connected display is in a DPMS power saving state
+
+    Read from drm connectors in sysfs (no events there, it's meant to be
+    checked before captures), False if any display is on or no connector
+    exposes its state.
+    '''
+    states = []
+    for connector in glob.glob(os.path.join(drmClass, 'card*-*')):
+        try:
+            with open(os.path.join(connector, 'status')) as fp:
+                if fp.read().strip() != 'connected':
+                    continue
+            with open(os.path.join(connector, 'dpms')) as fp:
+                states.append(fp.read().strip())
+        except IOError:
+            continue
+    return len(states) > 0 and not states.count('On')
+
+
+class powerMonitor():
+    ''' logind power states integration
+
+    Follows logind (system bus) PrepareForSleep signal, lid state and idle
+    and locked hints of the active session of the seat; gate(reasons) is
+    called as soon as one of them means nobody is in front of the display
+    (reasons is a list like ['lid', 'idle']), ungate() once none is left.
+    A delay inhibitor is held meanwhile: on PrepareForSleep gate() is
+    expected to return only after the in-flight capture (if any) is done,
+    then the inhibitor is released and the system goes to sleep; it's taken
+    again on resume.
+
+    NOTE: callbacks are executed inside the main loop, as dbus signal
+          handlers.
+    '''
+
+    def __init__(self, gate, ungate, seat='seat0'):
+        self.gate = gate
+        self.ungate = ungate
+        self.seat = seat
+        self.bus = None
+        self.manager = None
+        self.inhibitor = None  # delay inhibitor file descriptor
+        self.sleeping = False
+        self.reasons = []  # current gating reasons
+        self.matches = []  # signal receivers
+
+    def start(self):
+        ''' Returns 0 on success, 1 if logind is not available '''
+        try:
+            self.bus = dbus.SystemBus()
+            obj = self.bus.get_object(loginName, loginPath)
+        except dbus.exceptions.DBusException as err:
+            logger.warning(
+                "logind not available (%s), power states are ignored"
+                % err.get_dbus_name())
+            return 1
+        self.manager = dbus.Interface(obj, managerIface)
+        self.matches = [
+            self.bus.add_signal_receiver(
+                self.prepareForSleep, 'PrepareForSleep', managerIface,
+                loginName, loginPath),
+            # lid (manager), active session (seat), idle and locked hints
+            # (sessions): everything is read again on any change
+            self.bus.add_signal_receiver(
+                self.propertiesChanged, 'PropertiesChanged', propertiesIface,
+                loginName),
+        ]
+        self.inhibit()
+        self.evaluate()
+        return 0
+
+    def stop(self):
+        for match in self.matches:
+            match.remove()
+        self.matches = []
+        self.uninhibit()
+
+    def inhibit(self):
+        if self.inhibitor is not None:
+            return 0
+        try:
+            fd = self.manager.Inhibit(
+                'sleep', __LowerName__,
+                "Finishing ambient brightness capture", 'delay')
+        except dbus.exceptions.DBusException as err:
+            logger.warning(
+                "Unable to take sleep delay inhibitor: %s"
+                % err.get_dbus_name())
+            return 1
+        self.inhibitor = fd.take()
+        return 0
+
+    def uninhibit(self):
+        if self.inhibitor is None:
+            return 1
+        os.close(self.inhibitor)
+        self.inhibitor = None
+        return 0
+
+    # property of a login1 object, default if not available
+    def getProperty(self, path, iface, name, default=None):
+        try:
+            obj = self.bus.get_object(loginName, path)
+            return obj.Get(iface, name, dbus_interface=propertiesIface)
+        except dbus.exceptions.DBusException:
+            return default
+
+    # current gating reasons
+    def states(self):
+        reasons = []
+        if self.sleeping:
+            reasons.append('sleep')
+        if self.getProperty(loginPath, managerIface, 'LidClosed', False):
+            reasons.append('lid')
+        try:
+            seat = self.manager.GetSeat(self.seat)
+        except dbus.exceptions.DBusException:
+            return reasons
+        session = self.getProperty(seat, seatIface, 'ActiveSession')
+        if not session or session[1] == '/':
+            # nobody logged in on the seat
+            return reasons
+        if self.getProperty(session[1], sessionIface, 'IdleHint', False):
+            reasons.append('idle')
+        if self.getProperty(session[1], sessionIface, 'LockedHint', False):
+            reasons.append('locked')
+        return reasons
+
+    def evaluate(self):
+        reasons = self.states()
+        if reasons == self.reasons:
+            return 1
+        previous, self.reasons = self.reasons, reasons
+        if reasons and not previous:
+            logger.info("Captures gated: %s" % ', '.join(reasons))
+            self.gate(reasons)
+        elif previous and not reasons:
+            logger.info("Captures ungated")
+            self.ungate()
+        else:
+            logger.debug("Gating reasons: %s" % ', '.join(reasons))
+        return 0
+
+    def prepareForSleep(self, start):
+        self.sleeping = bool(start)
+        if self.sleeping:
+            logger.info("System is going to sleep")
+            self.evaluate()
+            self.uninhibit()
+        else:
+            logger.info("System resumed")
+            self.inhibit()
+            self.evaluate()
+
+    def propertiesChanged(self, iface, changed, invalidated):
+        if iface in (managerIface, seatIface, sessionIface):
+            self.evaluate()
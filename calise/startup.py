@@ -0,0 +1,190 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+# Startup profiling, enabled through "--profile-startup <path>" on any entry
+# point: records the import time of every module loaded after init() and the
+# duration of every startup phase (see phase() and mark()), then writes them
+# as JSON to <path>.
+# NOTE: this module has to be imported (and init() called) before any other
+#       import in entry points, so it only depends on the standard library
+#       and does nothing at all if not enabled.
+
+import sys
+import time
+import threading
+import __builtin__
+
+
+profiler = None
+option = '--profile-startup'
+
+
+class startupProfiler():
+    ''' Import hook plus phase timer
+
+    Every first-time import (module not in sys.modules yet) is recorded with
+    its cumulative time (nested imports included) and its self time.
+    '''
+
+    def __init__(self, path, program=None):
+        self.path = path
+        self.program = program
+        self.t0 = time.time()
+        self.imports = []
+        self.phases = []
+        self.marks = {}
+        self.local = threading.local()
+        self.builtinImport = None
+
+    def install(self):
+        self.builtinImport = __builtin__.__import__
+        __builtin__.__import__ = self.timedImport
+
+    def uninstall(self):
+        if self.builtinImport is not None:
+            __builtin__.__import__ = self.builtinImport
+            self.builtinImport = None
+
+    def timedImport(
+        self, name, globs=None, locs=None, fromlist=None, level=-1
+    ):
+        if not name:
+            # explicit relative import, can't tell what's imported
+            return self.builtinImport(name, globs, locs, fromlist, level)
+        if not name in sys.modules:
+            self.timed(name, globs, locs, level)
+        # submodules in fromlist ("from package import module") are imported
+        # by the import machinery itself, without calling __import__: each
+        # one is imported (and timed) on its own first
+        parent = sys.modules.get(name)
+        for item in fromlist or ():
+            module = '%s.%s' % (name, item)
+            if (
+                item == '*' or parent is None or hasattr(parent, item) or
+                module in sys.modules
+            ):
+                continue
+            try:
+                self.timed(module, globs, locs, level)
+            except ImportError:
+                # not a module, left to the import below
+                pass
+        return self.builtinImport(name, globs, locs, fromlist, level)
+
+    # imports module recording its import time
+    def timed(self, name, globs, locs, level):
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.time()
+        try:
+            return self.builtinImport(name, globs, locs, None, level)
+        finally:
+            elapsed = time.time() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.imports.append({
+                'module': name,
+                'start': round(start - self.t0, 6),
+                'cumulative': round(elapsed, 6),
+                'self': round(elapsed - children, 6),
+            })
+
+    def addPhase(self, name, start, end):
+        self.phases.append({
+            'phase': name,
+            'start': round(start - self.t0, 6),
+            'duration': round(end - start, 6),
+        })
+
+    def addMark(self, name):
+        if name in self.marks:
+            return 1
+        self.marks[name] = round(time.time() - self.t0, 6)
+        self.dump()
+        return 0
+
+    def dump(self):
+        import json
+        report = {
+            'program': self.program,
+            'argv': sys.argv,
+            'elapsed': round(time.time() - self.t0, 6),
+            'imports': sorted(
+                self.imports, key=lambda x: x['cumulative'], reverse=True),
+            'phases': self.phases,
+            'marks': self.marks,
+        }
+        try:
+            with open(self.path, 'w') as fp:
+                json.dump(report, fp, indent=2)
+        except IOError as err:
+            sys.stderr.write(
+                "Unable to write startup profile to %s: %s\n"
+                % (self.path, err))
+            return 1
+        return 0
+
+
+class phase():
+    ''' Phase timer, usage: with phase('name'): ... (no-op if disabled) '''
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if profiler is not None:
+            self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if profiler is not None and self.start is not None:
+            profiler.addPhase(self.name, self.start, time.time())
+        return False
+
+
+def mark(name):
+    ''' Records (only the first time) how long it took to get there since
+    startup, eg. first frame captured, first backlight step written '''
+    if profiler is not None:
+        return profiler.addMark(name)
+    return 1
+
+
+def init(argv):
+    ''' Enables startup profiling if "--profile-startup <path>" is in argv
+    (the option is removed from argv, so argument parsers don't see it) '''
+    global profiler
+    path = None
+    for idx in range(1, len(argv)):
+        if argv[idx] == option and idx + 1 < len(argv):
+            path = argv[idx + 1]
+            del argv[idx:idx + 2]
+            break
+        elif argv[idx].startswith(option + '='):
+            path = argv[idx][len(option) + 1:]
+            del argv[idx]
+            break
+    if path is None:
+        return 1
+    import os
+    import atexit
+    profiler = startupProfiler(path, os.path.basename(argv[0]))
+    profiler.install()
+    atexit.register(profiler.dump)
+    return 0
@@ -23,6 +23,7 @@ import urllib
 import logging
 
 from calise.infos import __LowerName__
+from calise import metrics
 
 
 logger = logging.getLogger(".".join([__LowerName__, 'ephem']))
@@ -44,6 +45,7 @@ def convertPyEphemToEpoch(timeString):
     return timeEpoch
 
 
+@metrics.timed('ephem_seconds')
 def getSun(latitude, longitude, timestamp=None):
     ''' Returns Sun rising and setting times and durations
     
@@ -148,11 +150,13 @@ def url_parse(lat, lon, parser='wunderground'):
             ".*?<condition data=\"([A-Z a-z]*?)\"/>"
             ".*?</xml_api_reply>"), re.DOTALL)
     try:
-        wur = urllib.urlopen('https://%s?%s' % (api, params))
+        with metrics.timer('weather_fetch_seconds'):
+            wur = urllib.urlopen('https://%s?%s' % (api, params))
+            data = wur.read()
     # IOError is raised if there's no internet connection
     except IOError:
         return None
-    cm = prog.match(wur.read())
+    cm = prog.match(data)
     # Some apis return a blank string instead of None with the second "if"
     # condition the parser is aware of that
     if cm is not None and len(cm.group(1).split()) > 0:
@@ -220,11 +224,13 @@ def get_geo():
     geo = None
     api = 'geoiplookup.wikimedia.org'
     try:
-        gur = urllib.urlopen('https://%s' % api)
+        with metrics.timer('geoip_fetch_seconds'):
+            gur = urllib.urlopen('https://%s' % api)
+            data = gur.read()
     except IOError:
         return None
     try:
-        geo = eval(gur.read().replace("Geo = ", ""))
+        geo = eval(data.replace("Geo = ", ""))
         geo['lat'] = float(geo['lat'])
         geo['lon'] = float(geo['lon'])
         logger.debug(
@@ -18,9 +18,12 @@
 import os
 import sys
 import errno
-from math import atan, pi
+from math import atan, pi, exp
 from time import time
 
+from calise.backlight import stepFromPercentage
+from calise import metrics
+
 
 class computation():
     ''' Computation-realted tasks
@@ -86,7 +89,7 @@ class computation():
     def percentage(
         self,
         amb, ofs=0.0, delta=255 / (100 ** (1 / 0.73)),
-        scr=0, areamul=0, dstep=0,
+        scr=0, areamul=0, dstep=0, exp=.73,
     ):
         if (scr == None)|(dstep == None):
             self.cor = 0
@@ -100,7 +103,7 @@ class computation():
         amb = amb - cor
         if ofs > amb:
             ofs = amb
-        self.pct = ((amb - ofs) / delta) ** .73
+        self.pct = ((amb - ofs) / delta) ** exp
 
 
     def read_backlight(self, ix=0, pt=None):
@@ -122,6 +125,7 @@ class computation():
                 try:
                     with open(os.path.join(path, af[ix]), 'r') as fp:
                         ret = int(fp.readline())
+                    metrics.inc('backlight_reads_total')
                 except ValueError:
                     sys.stderr.write(
                         "ValueError: choosen \"%s\" file (%s) is not valid\n"
@@ -164,6 +168,78 @@ class computation():
         return ret
 
 
+class controller():
+    ''' Backlight step controller
+
+    Smooths brightness percentages with an exponential moving average and
+    turns them into backlight steps through a deadband, so that the backlight
+    is only changed for actual ambient changes. State is O(1) per sample.
+
+        band  deadband width (percentage points): the smoothed percentage has
+              to move more than band away from the one of the current step
+              before a new step is committed
+        tau   EMA time constant (seconds), shortened in proportion to the
+              deviation of each sample, so that big changes converge faster
+              (0 means no smoothing)
+        jump  step-change threshold (percentage points): two consecutive
+              samples deviating more than jump in the same direction are
+              considered an ambient step change, EMA is restarted from the
+              new value and the deadband is bypassed (0 disables both
+              step-change detection and tau shortening)
+
+    '''
+
+    def __init__(
+        self, steps, bkofs, invert=False, band=2.0, tau=30.0, jump=20.0):
+        self.steps = steps
+        self.bkofs = bkofs
+        self.invert = invert
+        self.band = band
+        self.tau = tau
+        self.jump = jump
+        self.reset()
+
+    def reset(self):
+        self.ema = None # smoothed percentage
+        self.ts = None # last sample timestamp
+        self.pct = None # smoothed percentage the current step comes from
+        self.step = None # current (committed) step
+        self.sign = 0 # direction of last out-of-jump sample (-1, 0, +1)
+        self.settling = False # True if last sample was a step change
+
+    def update(self, pct, ts=None):
+        ''' Feeds a percentage sample, returns the (committed) step '''
+        if ts is None:
+            ts = time()
+        if self.ema is None:
+            self.ema = pct
+        else:
+            dev = pct - self.ema
+            sign = 0
+            if self.jump > 0 and abs(dev) > self.jump:
+                sign = 1 if dev > 0 else -1
+            self.settling = bool(sign) and sign == self.sign
+            self.sign = sign
+            if self.settling or self.tau <= 0:
+                self.ema = pct
+            else:
+                tau = self.tau
+                if self.jump > 0:
+                    tau /= 1.0 + abs(dev) / self.jump
+                dt = max(ts - self.ts, 0.0)
+                self.ema += (1.0 - exp(-dt / tau)) * dev
+        self.ts = ts
+        step = stepFromPercentage(
+            self.ema, self.steps, self.bkofs, self.invert)
+        if (
+            self.step is None or self.settling or
+            (step != self.step and abs(self.ema - self.pct) > self.band)
+        ):
+            self.step = step
+            self.pct = self.ema
+        return self.step
+
+
 '''Execution class
 This class obtains a step value out of some vars that must be given manually
 '''
@@ -176,10 +252,13 @@ class execution():
     ofs = None # equation offset (user defined, got from calibration)
     delta = None # equation modifier (user defined, got from calibration)
     pos = None # sys backlight device control folder
-    tol = None # percentage tolerance for hard drop
+    tol = None # percentage threshold for ambient step changes
+    ctl = None # step controller (deadband and moving average)
 
     bfile = None # brightness sys file (taken from computation)
     bkstp = None # current backlight step (taken from computation)
+    group = None # additional backlight interfaces (backlight.backlightGroup)
+    transition = None # smooth transition engine (backlight.transition)
 
     # each dictionary voice contains all previous valid measurements
     data = {
@@ -206,7 +285,7 @@ class execution():
         self,
         steps, bkofs, invert=False,
         ofs=0.0, delta=255/(100**(1/.73)), tol=20,
-        pos=None
+        pos=None, band=2.0, tau=30.0, exp=.73
     ):
         self.steps = steps
         self.bkofs = bkofs
@@ -214,30 +293,21 @@ class execution():
         self.den = 100.00/self.steps
         self.ofs = ofs
         self.delta = delta
+        self.exp = exp
         self.tol = tol
         self.pos = pos
+        self.ctl = controller(steps, bkofs, invert, band, tau, tol)
 
     # set_flt needs a step value on the scale 0 < 1, so, if there's a
     # different scale/offset, it has to be reduced to a 0 < 1 one.
     def AdjustScale(self, cur):
         return (cur - self.bkofs + 1) * (1.00 / self.steps)
 
-    # picks brightness percentages, backlight steps and offset and invert, then
-    # returns the corresponding backlight step
-    def SetStep(self,pct):
-        steps = self.steps
-        bkofs = self.bkofs
-        percs = self.data['percent']
-        average = sum(percs)/len(percs)
-        stp = int(average / self.den - .5 + bkofs)
-        if self.invert:
-	    stp = steps - 1 + bkofs - stp + bkofs
-        # out-of-bounds control...
-        if stp > steps - 1 + bkofs:
-	    stp = steps - 1 + bkofs
-        elif stp < bkofs:
-	    stp = bkofs
-        self.data['step'].append(stp)
+    # feeds last brightness percentage to the step controller and stores the
+    # corresponding backlight step
+    def SetStep(self, pct):
+        ts = self.data['timestamp'][-1]
+        self.data['step'].append(self.ctl.update(pct, ts))
 
     # updates value ambient and screen brightness list, can be ommitted if amb
     # is specified in the elaborate() function
@@ -255,8 +325,7 @@ class execution():
 	    raise TypeError('scr has to be either float or int (or None)')
 
     # main function of the class, takes all class vars and returns a backlight
-    # step according to them. If there is a difference greater than 20 between
-    # two consequent percentages, resets all data
+    # step according to them (see controller)
     def elaborate(self,amb=None,scr=None, areamul=None):
         if amb is not None:
 	    self.store(amb, scr)
@@ -268,28 +337,33 @@ class execution():
         comp.get_values('step', self.pos)
         comp.percentage(
             amb, self.ofs, self.delta,
-            scr, areamul, self.AdjustScale(comp.bkstp)
+            scr, areamul, self.AdjustScale(comp.bkstp), self.exp
         )
         self.data['correction'].append(comp.cor)
         self.data['percent'].append(comp.pct)
-        if len(self.data['percent']) > 1:
-            if (
-                abs( self.data['percent'][-1] - self.data['percent'][-2] ) >
-                self.tol
-            ):
-	        for bookmark in self.data:
-	            if bookmark is 'step':
-		        self.data[bookmark] = []
-	            else:
-		        self.data[bookmark] = [ self.data[bookmark][-1] ]
-        self.SetStep(sum(self.data['percent'])/len(self.data['percent']))
+        self.SetStep(comp.pct)
         self.data['bkstp'].append(comp.bkstp)
         self.bfile = comp.bfile
 
     # checks for read permission and writes current backlight step on sys
-    # brightness file (the one selected throug computation)
+    # brightness file (the one selected throug computation). Additional
+    # backlight interfaces (if any) are written in parallel, with the same
+    # (smoothed and deadbanded) percentage the main step comes from
     def WriteStep(self):
-        if self.data['step'][-1] != self.data['bkstp'][-1]:
+        if self.group and self.ctl.pct is not None:
+            self.group.start(self.ctl.pct)
+        try:
+            return self.WriteMainStep()
+        finally:
+            if self.group:
+                self.group.join()
+
+    def WriteMainStep(self):
+        if self.transition and self.data['step'][-1] != self.data['bkstp'][-1]:
+            # ramp towards the new step, superseding any previous target
+            self.transition.setTarget(self.data['step'][-1])
+            return True
+        elif self.data['step'][-1] != self.data['bkstp'][-1]:
             try:
                 fp = open(self.bfile, 'w')
             except IOError as err:
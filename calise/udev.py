@@ -0,0 +1,278 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import errno
+import socket
+import logging
+import threading
+
+from calise.infos import __LowerName__
+
+
+logger = logging.getLogger('.'.join([__LowerName__, 'udev']))
+
+sysClass = os.path.join('/sys', 'class')
+subsystems = ('video4linux', 'backlight')
+# subsystems whose uevents are reported but devices not indexed
+eventSubsystems = subsystems + ('power_supply',)
+# attributes not stored in records (device numbers, events and values that
+# change all the time)
+skipAttrs = (
+    'dev', 'uevent', 'brightness', 'actual_brightness', 'bl_power')
+NETLINK_KOBJECT_UEVENT = 15
+
+
+def sameDevice(device, stored):
+    ''' True if stored (a profile [Udev] device) is device (a record DEVICE)
+
+    Older profiles store just the first three parts of the device path (the
+    bus, eg. '/devices/pci0000:00/0000:00:1d.7'), which match every device
+    attached there.
+    '''
+    if device is None or stored is None:
+        return False
+    return device == stored or device.startswith(stored.rstrip('/') + '/')
+
+
+def readRecord(subsystem, kernel):
+    ''' Sysfs record of a class device
+
+    Returned as a dictionary like {'KERNEL': 'video0', 'DEVICE':
+    '/devices/pci0000:00/0000:00:1d.7/usb2/2-1/2-1:1.0', 'SUBSYSTEM':
+    'video4linux', 'DRIVER': '', 'ATTR': {'name': ..., ...}}, None if there's
+    no such device. DEVICE (the path of the parent device, eg. the USB
+    interface, so the port the camera is plugged in) doesn't change when the
+    device gets a different kernel name, so it's what profiles store ([Udev]
+    device).
+    '''
+    devicePath = os.path.join(sysClass, subsystem, kernel)
+    if not os.path.isdir(devicePath):
+        return None
+    record = {
+        'KERNEL': kernel,
+        'DEVICE': None,
+        'SUBSYSTEM': None,
+        'DRIVER': '',
+        'ATTR': {},
+    }
+    if os.path.islink(devicePath):
+        td = [x for x in os.readlink(devicePath).split('/') if x != '..']
+        # (without the class directory and the kernel name)
+        record['DEVICE'] = os.path.join('/', *td[:-2])
+    subsystemPath = os.path.join(devicePath, 'subsystem')
+    if os.path.islink(subsystemPath):
+        record['SUBSYSTEM'] = os.readlink(subsystemPath).split('/')[-1]
+    for name in os.listdir(devicePath):
+        path = os.path.join(devicePath, name)
+        if name in skipAttrs or not os.path.isfile(path):
+            continue
+        try:
+            with open(path, 'r') as fp:
+                record['ATTR'][name] = ' '.join(fp.read().split())
+        except IOError:
+            # write-only or unreadable attributes
+            continue
+    return record
+
+
+class deviceIndex():
+    ''' video4linux and backlight class devices index
+
+    Every device is read from sysfs only once (on first lookup); then, if
+    kernel uevents can be received (netlink socket, see monitor), records
+    are updated only for devices which have been added, changed or removed.
+    Without uevents, a lookup miss scans the single device again.
+
+    NOTE: records are keyed by (subsystem, kernel name), byDevice looks
+          them up by stable device path (DEVICE).
+    NOTE: the index is shared among threads: records are accessed under
+          lock and, once a main loop drains the socket (see watch), lookups
+          don't read uevents any more, so that none of them gets lost.
+    '''
+
+    def __init__(self):
+        self.records = {}  # {(subsystem, kernel): record}
+        self.scanned = False
+        self.sock = None
+        self.watched = False  # uevents read by a main loop only
+        self.lock = threading.RLock()
+
+    def scan(self):
+        records = {}
+        for subsystem in subsystems:
+            classPath = os.path.join(sysClass, subsystem)
+            if not os.path.isdir(classPath):
+                continue
+            for kernel in sorted(os.listdir(classPath)):
+                record = readRecord(subsystem, kernel)
+                if record is not None:
+                    records[(subsystem, kernel)] = record
+        with self.lock:
+            self.records = records
+            self.scanned = True
+        logger.debug("Indexed %d devices" % len(records))
+
+    def monitor(self):
+        ''' Subscribes to kernel uevents, returns the socket file descriptor
+        (to be watched by a main loop, if any) or None if not available '''
+        if self.sock is not None:
+            return self.sock.fileno()
+        try:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))
+        except (AttributeError, socket.error) as err:
+            logger.debug("Kernel uevents not available: %s" % err)
+            return None
+        sock.setblocking(False)
+        self.sock = sock
+        return sock.fileno()
+
+    def watch(self):
+        ''' Same as monitor, for a main loop which calls refresh whenever
+        the descriptor is readable: from then on it's the only uevents
+        reader (see sync) '''
+        fd = self.monitor()
+        if fd is not None:
+            self.watched = True
+        return fd
+
+    # applies pending uevents, unless a main loop does it (see watch)
+    def sync(self):
+        if self.watched and self.scanned:
+            return
+        self.refresh()
+
+    def refresh(self):
+        ''' Applies pending uevents, returns them as [(action, subsystem,
+        kernel), ...] (only regarding eventSubsystems)
+
+        NOTE: If uevents have been lost (socket buffer overflow), devices are
+              scanned again and a ('change', subsystem, None) event is
+              returned for every one of eventSubsystems.
+        '''
+        with self.lock:
+            return self.apply()
+
+    def apply(self):
+        if not self.scanned:
+            self.scan()
+        events = []
+        if self.sock is None:
+            return events
+        while True:
+            try:
+                data = self.sock.recv(16384)
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                elif err.errno == errno.ENOBUFS:
+                    logger.warning("Device events lost, scanning devices")
+                    self.scan()
+                    events += [('change', s, None) for s in eventSubsystems]
+                    continue
+                raise
+            event = self.parse(data)
+            if event is None:
+                continue
+            action, subsystem, kernel = event
+            if not subsystem in subsystems:
+                # not indexed, only reported
+                pass
+            elif action == 'remove':
+                self.records.pop((subsystem, kernel), None)
+            else:
+                record = readRecord(subsystem, kernel)
+                if record is not None:
+                    self.records[(subsystem, kernel)] = record
+            logger.debug("Device %s %s: %s" % (subsystem, kernel, action))
+            events.append(event)
+        return events
+
+    # (action, subsystem, kernel) out of a kernel uevent, None if it doesn't
+    # regard one of eventSubsystems
+    def parse(self, data):
+        fields = data.split('\0')
+        if not '@' in fields[0]:
+            # udevd messages (libudev), kernel ones are enough
+            return None
+        env = dict(x.split('=', 1) for x in fields[1:] if '=' in x)
+        if not env.get('SUBSYSTEM') in eventSubsystems:
+            return None
+        action = env.get('ACTION', fields[0].split('@')[0])
+        kernel = env.get('DEVPATH', fields[0]).split('/')[-1]
+        return action, env['SUBSYSTEM'], kernel
+
+    def get(self, subsystem, kernel):
+        ''' Record of given device (copy), None if there's no such device '''
+        with self.lock:
+            self.sync()
+            record = self.records.get((subsystem, kernel))
+            if record is None and self.sock is None:
+                # no uevents: the device may have been plugged since last
+                # scan
+                record = readRecord(subsystem, kernel)
+                if record is not None:
+                    self.records[(subsystem, kernel)] = record
+            if record is None:
+                return None
+            return dict(record, ATTR=dict(record['ATTR']))
+
+    def devices(self, subsystem):
+        ''' Kernel names of the indexed devices of given subsystem '''
+        with self.lock:
+            self.sync()
+            return sorted(
+                k for s, k in self.records.keys() if s == subsystem)
+
+    def byDevice(self, device, subsystem='video4linux'):
+        ''' Kernel names of given stable device path (DEVICE) devices
+
+        NOTE: older (bus only, see sameDevice) paths are matched only if
+              there's a single device attached to that bus, since any of
+              them could be taken otherwise.
+        '''
+        with self.lock:
+            self.sync()
+            items = [
+                (k, r['DEVICE']) for (s, k), r in self.records.items()
+                if s == subsystem]
+        kernels = sorted(k for k, d in items if d == device)
+        if kernels:
+            return kernels
+        older = [(k, d) for k, d in items if sameDevice(d, device)]
+        if len(set(d for k, d in older)) > 1:
+            logger.warning(
+                "%s matches more than one device, run calise --configure "
+                "to store the camera again" % device)
+            return []
+        return sorted(k for k, d in older)
+
+
+index = deviceIndex()
+
+
+def resolve(node):
+    ''' Kernel name of a device node (symbolic links followed) '''
+    return os.path.basename(os.path.realpath(node))
+
+
+def query(node, subsystem='video4linux'):
+    ''' Cached record of a device node (eg. /dev/video0) '''
+    index.monitor()
+    return index.get(subsystem, resolve(node))
@@ -0,0 +1,118 @@
+#    Copyright (C)   2011-2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+import logging
+import gobject
+
+from calise.infos import __LowerName__
+
+
+logger = logging.getLogger('.'.join([__LowerName__, 'watcher']))
+
+# inotify constants (from <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+EVENT_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class fileWatcher():
+    ''' inotify-based file watcher
+
+    Watches the parent directories of given files (so that files replaced by
+    editors through rename are noticed too) and calls callback(path) for
+    every event regarding one of them. The inotify descriptor is added to the
+    gobject main loop, so there are no polling wakeups at all.
+
+    NOTE: callback is executed inside gobject main loop.
+    '''
+
+    def __init__(self, paths, callback):
+        self.paths = [os.path.abspath(p) for p in paths]
+        self.callback = callback
+        self.fd = None
+        self.source = None
+        self.wds = {}  # {watch descriptor: directory}
+
+    def start(self):
+        ''' Returns 0 on success, 1 if inotify is not available '''
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except AttributeError:
+            fd = -1
+        if fd < 0:
+            logger.warning(
+                "inotify not available, profile changes won't be applied "
+                "until next restart")
+            return 1
+        self.fd = fd
+        for directory in set([os.path.dirname(p) for p in self.paths]):
+            if not os.path.isdir(directory):
+                continue
+            wd = libc.inotify_add_watch(fd, directory, EVENT_MASK)
+            if wd < 0:
+                logger.warning(
+                    "Unable to watch %s: %s"
+                    % (directory, os.strerror(ctypes.get_errno())))
+                continue
+            self.wds[wd] = directory
+            logger.debug("Watching %s" % directory)
+        self.source = gobject.io_add_watch(fd, gobject.IO_IN, self.process)
+        return 0
+
+    def process(self, fd, condition):
+        try:
+            buf = os.read(fd, 4096)
+        except OSError as err:
+            if err.errno == errno.EAGAIN:
+                return True
+            raise
+        changed = []
+        idx = 0
+        while idx + EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, idx)
+            idx += EVENT_HEADER.size
+            name = buf[idx:idx + length].rstrip('\0')
+            idx += length
+            path = os.path.join(self.wds.get(wd, ''), name)
+            if path in self.paths and not changed.count(path):
+                changed.append(path)
+        for path in changed:
+            try:
+                self.callback(path)
+            except Exception as err:
+                logger.error("Error processing %s change: %s" % (path, err))
+        return True
+
+    def stop(self):
+        if self.source is not None:
+            gobject.source_remove(self.source)
+            self.source = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.wds = {}
@@ -23,6 +23,15 @@ from PyQt4 import QtGui, QtCore
 '''Dynamic and Interactive custom progress bar that fits backlight steps
 '''
 class BacklightWidget(QtGui.QWidget):
+    ''' Backlight bar meter
+
+    Static parts (border and scale) are rendered once per size, steps and
+    palette on a cached QPixmap; value changes (see setValues) only repaint
+    the regions that actually changed and are coalesced to at most one
+    repaint per refresh interval (about display refresh rate).
+    '''
+
+    refresh = 16 # msecs between repaints
 
     def __init__(self, pal):
         super(BacklightWidget, self).__init__()
@@ -37,10 +46,59 @@ class BacklightWidget(QtGui.QWidget):
         self.sps = None # number of backlight steps (int)
         self.MousePressed = False
         self.Paused = False
+        self.scale = None # cached static scale pixmap
+        self.scaleKey = None # (width, height, steps, palette) of self.scale
+        self.pending = None # (bar, cur, tgt) waiting for next repaint
 
     def initUI(self):
         self.setMinimumSize(1, 30)
         self.setCursor(QtGui.QCursor(QtCore.Qt.CursorShape(2)))
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.refresh)
+        self.timer.timeout.connect(self.applyValues)
+
+    # stores new values, actual repaint is delayed to the next refresh
+    # interval (bursts of changes get a single repaint)
+    def setValues(self, bar, cur, tgt, steps=None):
+        if steps is not None and steps != self.sps:
+            self.sps = steps
+            self.setMinimumSize(10 * steps if steps < 21 else 1, 30)
+            self.update()
+        self.pending = (bar, cur, tgt)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    # repaints only the regions that changed since last repaint
+    def applyValues(self):
+        if self.pending is None:
+            return
+        bar, cur, tgt = self.pending
+        self.pending = None
+        h = self.height()
+        if bar != self.bar:
+            x0, x1 = sorted([self.barPos(self.bar), self.barPos(bar)])
+            if self.barColor(bar) != self.barColor(self.bar):
+                x0 = 0 # fill color changed, whole fill is dirty
+            self.update(x0 - 1, 0, x1 - x0 + 3, h)
+        for old, new in ((self.cur, cur), (self.tgt, tgt)):
+            if old != new and self.sps is not None:
+                for pos in (self.stepPos(old), self.stepPos(new)):
+                    self.update(pos - 1, 0, 3, h)
+        self.bar, self.cur, self.tgt = bar, cur, tgt
+
+    def barPos(self, bar, bs=105.0):
+        return int(round((self.width() / bs) * bar, 0))
+
+    def barColor(self, bar):
+        if bar > 60:
+            return (252,233,79)
+        elif bar > 40 and bar <= 60:
+            return (245,121,0)
+        return (114,159,207)
+
+    def stepPos(self, step):
+        return int(round(step * self.width() / (self.sps + .5), 0))
 
     # paint event override:
     # creates a QPainter object, draws and then terminates that object
@@ -50,7 +108,7 @@ class BacklightWidget(QtGui.QWidget):
         self.drawBacklightBar(qp,105.0)
         qp.end()
 
-    # draw bar function: fill, stepBars, baseScale
+    # draw bar function: fill, stepBars, (cached) baseScale
     def drawBacklightBar(self, qp, bs=100.0):
 
         size = self.size()
@@ -58,58 +116,66 @@ class BacklightWidget(QtGui.QWidget):
         h = size.height()
 
         # draw fill
-        till = int( round((w / bs) * self.bar, 0) )
+        till = self.barPos(self.bar, bs)
         qp.setOpacity(0.5)
         if self.Paused is True:
-            qp.setPen(self.palette.shadow().color())
-            qp.setBrush(self.palette.shadow().color())
-            qp.drawRect(0, 0, till, h)
-        elif self.bar > 60:
-            qp.setPen(QtGui.QColor(252,233,79))
-            qp.setBrush(QtGui.QColor(252,233,79))
-            qp.drawRect(0, 0, till, h)
-        elif self.bar > 40 and self.bar <= 60:
-            qp.setPen(QtGui.QColor(245,121,0))
-            qp.setBrush(QtGui.QColor(245,121,0))
-            qp.drawRect(0, 0, till, h)
+            color = self.palette.shadow().color()
         else:
-            qp.setPen(QtGui.QColor(114,159,207))
-            qp.setBrush(QtGui.QColor(114,159,207))
-            qp.drawRect(0, 0, till, h)
+            color = QtGui.QColor(*self.barColor(self.bar))
+        qp.setPen(color)
+        qp.setBrush(color)
+        qp.drawRect(0, 0, till, h)
         qp.setOpacity(1.0)
         pen = QtGui.QPen(
             self.palette.shadow().color(), 1, QtCore.Qt.SolidLine)
         qp.setPen(pen)
         qp.setBrush(QtCore.Qt.NoBrush)
-        qp.drawRect(0, 0, w-1, h-1)
 
-        if self.sps is None: return
+        if self.sps is not None:
+            self.pxs = w / (self.sps + .5)
+            # draw step bars
+            pos = self.stepPos(self.cur)
+            qp.drawLine(pos, 1, pos, h)
+            qp.setOpacity(0.33)
+            pos = self.stepPos(self.tgt)
+            qp.drawLine(pos, 1, pos, h)
+            qp.setOpacity(1.00)
+
+        # draw border and scale
+        qp.drawPixmap(0, 0, self.scalePixmap(w, h))
+
+    # border and scale pixmap, rendered again only if size, steps or palette
+    # changed
+    def scalePixmap(self, w, h):
+        key = (w, h, self.sps, self.palette.cacheKey())
+        if self.scale is not None and key == self.scaleKey:
+            return self.scale
+        px = QtGui.QPixmap(w, h)
+        px.fill(QtCore.Qt.transparent)
+        qp = QtGui.QPainter()
+        qp.begin(px)
+        qp.setPen(QtGui.QPen(
+            self.palette.shadow().color(), 1, QtCore.Qt.SolidLine))
+        qp.setBrush(QtCore.Qt.NoBrush)
+        qp.drawRect(0, 0, w-1, h-1)
         steps = self.sps
-        self.pxs = w / (steps + .5)
-
-        # draw step bars
-        pos = int(round(self.cur * self.pxs, 0))
-        qp.drawLine(pos, 1, pos, h)
-        qp.setOpacity(0.33)
-        pos = int(round(self.tgt * self.pxs, 0))
-        qp.drawLine(pos, 1, pos, h)
-        qp.setOpacity(1.00)
-
-        # draw scale
-        if int(round(steps, 0)) < 21:
-            pen = QtGui.QPen(
-                self.palette.buttonText().color(), 1, QtCore.Qt.SolidLine)
-            qp.setPen(pen)
-            pos = int(round(1 * self.pxs - self.pxs / 2.0, 0))
+        if steps is not None and int(round(steps, 0)) < 21:
+            pxs = w / (steps + .5)
+            qp.setPen(QtGui.QPen(
+                self.palette.buttonText().color(), 1, QtCore.Qt.SolidLine))
+            pos = int(round(1 * pxs - pxs / 2.0, 0))
             qp.drawLine(pos, 1, pos, 6)
             for i in range(1, steps):
-                pos = int(round(i * self.pxs, 0))
-                pon = int(round(i * self.pxs + self.pxs / 2, 0))
+                pos = int(round(i * pxs, 0))
+                pon = int(round(i * pxs + pxs / 2, 0))
                 qp.drawLine(pos, 1, pos, 10)
                 qp.drawLine(pon, 1, pon, 6)
-            pos = int(round((i + 1) * self.pxs, 0))
+            pos = int(round(steps * pxs, 0))
             qp.drawLine(pos, 1, pos, 10)
-            self.setMinimumSize(10 * steps, 30)
+        qp.end()
+        self.scale = px
+        self.scaleKey = key
+        return px
 
     # dummy mousePress override, initializes mouseEvent
     def mousePressEvent(self, event):
@@ -134,7 +200,9 @@ class BacklightWidget(QtGui.QWidget):
         QtCore.QObject.emit( self, QtCore.SIGNAL('bbwBarClicked(int)'), cur )
 
     def enPause(self,boolean):
-        self.Paused = boolean
+        if boolean != self.Paused:
+            self.Paused = boolean
+            self.update()
 
 
 class AvdancedInfo(QtGui.QWidget):
@@ -188,7 +256,7 @@ class AvdancedInfo(QtGui.QWidget):
         self.ltLabel = QtGui.QLabel()
         self.ltLabel.setAlignment(QtCore.Qt.AlignRight)
         self.sForm.addRow(
-            QtCore.QString.fromUtf8(_('Lock Expiry')), self.ltLabel )
+            QtCore.QString.fromUtf8(_('Smoothed')), self.ltLabel )
 
         # Group boxes
         self.fGroup = QtGui.QGroupBox(
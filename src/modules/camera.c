@@ -66,18 +66,25 @@ struct buffer {
     size_t length;
 };
 
-struct buffer * buffers       = NULL;
-static unsigned int n_buffers = 0;
-
 typedef struct PyDeviceObject {
     PyObject_HEAD
     char* dev_name;  // device path
     int fd;          // opened device
+    /* requested capture mode (0 means driver/module default) */
+    unsigned int fmt_pixfmt;
+    unsigned int fmt_width;
+    unsigned int fmt_height;
+    unsigned int fmt_num;    // frame interval numerator
+    unsigned int fmt_den;    // frame interval denominator
+    /* capture state (per device, so that several devices can capture at
+       the same time) */
+    struct buffer * buffers;
+    unsigned int n_buffers;
+    int width;
+    int height;
+    unsigned int pixfmt;
 } PyDeviceObject;
 
-int width = 160;
-int height = 120;
-
 
 
 
@@ -97,16 +104,23 @@ static PyObject* read_frame (PyDeviceObject *self);
 static PyObject* stop_capturing (PyDeviceObject *self);
 static PyObject* device_uninit (PyDeviceObject *self);
 static PyObject* device_close (PyDeviceObject *self);
+static PyObject* list_formats (PyDeviceObject *self);
+static PyObject* set_format (PyDeviceObject *self, PyObject *args);
+static PyObject* get_format (PyDeviceObject *self);
 /* memory clearing related objects */
 static PyObject* clear_buffers ();
 
 /* internal/other functions */
-static int init_read (unsigned int buffer_size);
+static int init_read (PyDeviceObject *self, unsigned int buffer_size);
 static int init_mmap (PyDeviceObject *self);
 static int init_userp (PyDeviceObject *self, unsigned int buffer_size);
-static int process_image(const void* p);
+static int process_image(PyDeviceObject *self, const void* p);
 static PyObject* format_error (int err_code, char* err_msg);
 static char* errno_msg (const char* s);
+static PyObject* fourcc_string (unsigned int fourcc);
+static void append_intervals (PyDeviceObject *self, PyObject *ret_list,
+                              unsigned int fourcc, unsigned int w,
+                              unsigned int h);
 
 
 
@@ -132,6 +146,21 @@ errno_msg (const char* s)
     return msg_out;
 }
 
+// v4l2 pixelformat code to 4 chars python string (eg. 'YUYV')
+static PyObject*
+fourcc_string (unsigned int fourcc)
+{
+    char code[5];
+
+    code[0] = fourcc & 0xFF;
+    code[1] = (fourcc >> 8) & 0xFF;
+    code[2] = (fourcc >> 16) & 0xFF;
+    code[3] = (fourcc >> 24) & 0xFF;
+    code[4] = '\0';
+
+    return PyString_FromString(code);
+}
+
 
 
 
@@ -301,7 +330,7 @@ set_control (PyDeviceObject *self, PyObject *args)
 
 
 // Convert YUV input image to rgb and compute its brightness
-static int process_image(const void* p)
+static int process_image(PyDeviceObject *self, const void* p)
 {
     int line, column;
     unsigned char *py, *pu, *pv;
@@ -326,8 +355,17 @@ static int process_image(const void* p)
 
     #define CLIP(x) ( (x)>=0xFF ? 0xFF : ( (x) <= 0x00 ? 0x00 : (x) ) )
 
-    for (line = 0; line < height; ++line) {
-        for (column = 0; column < width; ++column) {
+    /* Greyscale frames are luma only, one byte per pixel: brightness is
+       simply their average (no color conversion needed). */
+    if (self->pixfmt == V4L2_PIX_FMT_GREY) {
+        double luma = 0;
+        for (line = 0; line < self->width * self->height; ++line)
+            luma += py[line];
+        return luma / (self->width * self->height);
+    }
+
+    for (line = 0; line < self->height; ++line) {
+        for (column = 0; column < self->width; ++column) {
 
             r += CLIP((double)*py + 1.402*((double)*pv-128.0));
             g += CLIP((double)*py - 0.344*((double)*pu-128.0) - 0.714*((double)*pv-128.0));
@@ -355,7 +393,7 @@ static int process_image(const void* p)
         }
     }
 
-    area = (width)*(height);
+    area = (self->width)*(self->height);
     r = r/area;
     g = g/area;
     b = b/area;
@@ -379,17 +417,17 @@ static int process_image(const void* p)
    functions (unstable).
    Never had errors so far but if any, something can hung-up */
 static int
-init_read (unsigned int buffer_size)
+init_read (PyDeviceObject *self, unsigned int buffer_size)
 {
-    buffers = calloc (1, sizeof (*buffers));
+    self->buffers = calloc (1, sizeof (*self->buffers));
 
-    if (!buffers)
+    if (!self->buffers)
         return 1;
 
-    buffers[0].length = buffer_size;
-    buffers[0].start = malloc (buffer_size);
+    self->buffers[0].length = buffer_size;
+    self->buffers[0].start = malloc (buffer_size);
 
-    if (!buffers[0].start)
+    if (!self->buffers[0].start)
         return 2;
 }
 
@@ -414,32 +452,32 @@ init_mmap (PyDeviceObject *self)
     if (req.count < 1)
         return 3;
 
-    buffers = calloc (req.count, sizeof (*buffers));
+    self->buffers = calloc (req.count, sizeof (*self->buffers));
 
-    if (!buffers)
+    if (!self->buffers)
         return 11;
 
-    for (n_buffers = 0; n_buffers < req.count; ++n_buffers) {
+    for (self->n_buffers = 0; self->n_buffers < req.count; ++self->n_buffers) {
         struct v4l2_buffer buf;
 
         CLEAR (buf);
 
         buf.type        = V4L2_BUF_TYPE_VIDEO_CAPTURE;
         buf.memory      = V4L2_MEMORY_MMAP;
-        buf.index       = n_buffers;
+        buf.index       = self->n_buffers;
 
         if (-1 == xioctl (self->fd, VIDIOC_QUERYBUF, &buf))
             return 21;
 
-        buffers[n_buffers].length = buf.length;
-        buffers[n_buffers].start = mmap (
+        self->buffers[self->n_buffers].length = buf.length;
+        self->buffers[self->n_buffers].start = mmap (
                 NULL /* start anywhere */,
                 buf.length,
                 PROT_READ | PROT_WRITE /* required */,
                 MAP_SHARED /* recommended */,
                 self->fd, buf.m.offset);
 
-        if (MAP_FAILED == buffers[n_buffers].start)
+        if (MAP_FAILED == self->buffers[self->n_buffers].start)
             return 31;
     }
 }
@@ -466,16 +504,16 @@ init_userp (PyDeviceObject *self, unsigned int buffer_size)
             return 2;
     }
 
-    buffers = calloc (1, sizeof (*buffers));
+    self->buffers = calloc (1, sizeof (*self->buffers));
 
-    if (!buffers)
+    if (!self->buffers)
         return 11;
 
-    for (n_buffers = 0; n_buffers < 1; ++n_buffers) {
-        buffers[n_buffers].length = buffer_size;
-        buffers[n_buffers].start = memalign (/* boundary */ page_size, buffer_size);
+    for (self->n_buffers = 0; self->n_buffers < 1; ++self->n_buffers) {
+        self->buffers[self->n_buffers].length = buffer_size;
+        self->buffers[self->n_buffers].start = memalign (/* boundary */ page_size, buffer_size);
 
-        if (!buffers[n_buffers].start)
+        if (!self->buffers[self->n_buffers].start)
             return 21;
     }
 }
@@ -493,10 +531,14 @@ read_frame (PyDeviceObject *self)
     switch (io) {
 
         case IO_METHOD_READ:
-            if (-1 == read (self->fd, buffers[0].start, buffers[0].length))
+            if (-1 == read (self->fd, self->buffers[0].start, self->buffers[0].length))
                 return PyErr_SetFromErrno(CameraError);
 
-            bright = process_image (buffers[0].start);
+            /* frame processing doesn't touch python objects: let other threads
+               (eg. other cameras) run meanwhile */
+            Py_BEGIN_ALLOW_THREADS
+            bright = process_image (self, self->buffers[0].start);
+            Py_END_ALLOW_THREADS
 
             break;
 
@@ -509,9 +551,11 @@ read_frame (PyDeviceObject *self)
             if (-1 == xioctl (self->fd, VIDIOC_DQBUF, &buf))
                 return PyErr_SetFromErrno(CameraError);
 
-            assert (buf.index < n_buffers);
+            assert (buf.index < self->n_buffers);
 
-            bright = process_image (buffers[buf.index].start);
+            Py_BEGIN_ALLOW_THREADS
+            bright = process_image (self, self->buffers[buf.index].start);
+            Py_END_ALLOW_THREADS
 
             if (-1 == xioctl (self->fd, VIDIOC_QBUF, &buf))
                 return PyErr_SetFromErrno(CameraError);
@@ -527,14 +571,16 @@ read_frame (PyDeviceObject *self)
             if (-1 == xioctl (self->fd, VIDIOC_DQBUF, &buf))
                 return PyErr_SetFromErrno(CameraError);
 
-            for (i = 0; i < n_buffers; ++i)
-                if (buf.m.userptr == (unsigned long) buffers[i].start
-                    && buf.length == buffers[i].length)
+            for (i = 0; i < self->n_buffers; ++i)
+                if (buf.m.userptr == (unsigned long) self->buffers[i].start
+                    && buf.length == self->buffers[i].length)
                     break;
 
-            assert (i < n_buffers);
+            assert (i < self->n_buffers);
 
-            bright = process_image ((void *) buf.m.userptr);
+            Py_BEGIN_ALLOW_THREADS
+            bright = process_image (self, (void *) buf.m.userptr);
+            Py_END_ALLOW_THREADS
 
             if (-1 == xioctl (self->fd, VIDIOC_QBUF, &buf))
                 return PyErr_SetFromErrno(CameraError);
@@ -626,9 +672,9 @@ device_init (PyDeviceObject *self)
     }
     CLEAR (fmt);
     fmt.type                = V4L2_BUF_TYPE_VIDEO_CAPTURE;
-    fmt.fmt.pix.width       = 160;
-    fmt.fmt.pix.height      = 120;
-    fmt.fmt.pix.pixelformat = V4L2_PIX_FMT_YUYV;
+    fmt.fmt.pix.width       = self->fmt_width ? self->fmt_width : 160;
+    fmt.fmt.pix.height      = self->fmt_height ? self->fmt_height : 120;
+    fmt.fmt.pix.pixelformat = self->fmt_pixfmt ? self->fmt_pixfmt : V4L2_PIX_FMT_YUYV;
     fmt.fmt.pix.field       = V4L2_FIELD_INTERLACED;
 
     if (-1 == xioctl (self->fd, VIDIOC_S_FMT, &fmt)) {
@@ -637,6 +683,21 @@ device_init (PyDeviceObject *self)
     }
 
     /* Note VIDIOC_S_FMT may change width and height. */
+    self->width = fmt.fmt.pix.width;
+    self->height = fmt.fmt.pix.height;
+    self->pixfmt = fmt.fmt.pix.pixelformat;
+
+    /* Lowest frame rate, if requested (errors ignored: not every driver
+       supports frame interval setting). */
+    if (self->fmt_num && self->fmt_den) {
+        struct v4l2_streamparm parm;
+
+        CLEAR (parm);
+        parm.type = V4L2_BUF_TYPE_VIDEO_CAPTURE;
+        parm.parm.capture.timeperframe.numerator = self->fmt_num;
+        parm.parm.capture.timeperframe.denominator = self->fmt_den;
+        xioctl (self->fd, VIDIOC_S_PARM, &parm);
+    }
 
     /* Buggy driver paranoia. */
     min = fmt.fmt.pix.width * 2;
@@ -648,7 +709,7 @@ device_init (PyDeviceObject *self)
 
     switch (io) {
         case IO_METHOD_READ:
-            init_read (fmt.fmt.pix.sizeimage);
+            init_read (self, fmt.fmt.pix.sizeimage);
             break;
 
         case IO_METHOD_MMAP:
@@ -677,7 +738,7 @@ start_capturing (PyDeviceObject *self)
             break;
 
         case IO_METHOD_MMAP:
-            for (i = 0; i < n_buffers; ++i) {
+            for (i = 0; i < self->n_buffers; ++i) {
                 struct v4l2_buffer buf;
 
                 CLEAR (buf);
@@ -702,7 +763,7 @@ start_capturing (PyDeviceObject *self)
             break;
 
         case IO_METHOD_USERPTR:
-            for (i = 0; i < n_buffers; ++i) {
+            for (i = 0; i < self->n_buffers; ++i) {
                 struct v4l2_buffer buf;
 
                 CLEAR (buf);
@@ -710,8 +771,8 @@ start_capturing (PyDeviceObject *self)
                 buf.type        = V4L2_BUF_TYPE_VIDEO_CAPTURE;
                 buf.memory      = V4L2_MEMORY_USERPTR;
                 buf.index       = i;
-                buf.m.userptr   = (unsigned long) buffers[i].start;
-                buf.length      = buffers[i].length;
+                buf.m.userptr   = (unsigned long) self->buffers[i].start;
+                buf.length      = self->buffers[i].length;
 
                 if (-1 == xioctl (self->fd, VIDIOC_QBUF, &buf)) {
                     PyErr_SetObject(CameraError, format_error(errno, errno_msg("VIDIOC_QBUF")));
@@ -767,24 +828,26 @@ device_uninit (PyDeviceObject *self)
 
     switch (io) {
         case IO_METHOD_READ:
-            free (buffers[0].start);
+            free (self->buffers[0].start);
             break;
 
         case IO_METHOD_MMAP:
-            for (i = 0; i < n_buffers; ++i)
-                if (-1 == munmap (buffers[i].start, buffers[i].length)) {
+            for (i = 0; i < self->n_buffers; ++i)
+                if (-1 == munmap (self->buffers[i].start, self->buffers[i].length)) {
                     PyErr_SetObject(CameraError, format_error(errno, errno_msg("MUnmap")));
                     return NULL;
                 }
             break;
 
         case IO_METHOD_USERPTR:
-            for (i = 0; i < n_buffers; ++i)
-                free (buffers[i].start);
+            for (i = 0; i < self->n_buffers; ++i)
+                free (self->buffers[i].start);
             break;
     }
 
-    free (buffers);
+    free (self->buffers);
+    self->buffers = NULL;
+    self->n_buffers = 0;
 
     Py_RETURN_NONE;
 }
@@ -870,6 +933,142 @@ device_open (PyDeviceObject *self)
 
 
 
+// append every frame interval available for given format and size as
+// (fourcc, width, height, numerator, denominator) tuples
+static void
+append_intervals (PyDeviceObject *self, PyObject *ret_list,
+                  unsigned int fourcc, unsigned int w, unsigned int h)
+{
+    struct v4l2_frmivalenum frmival;
+    PyObject* item;
+
+    CLEAR (frmival);
+    frmival.pixel_format = fourcc;
+    frmival.width = w;
+    frmival.height = h;
+
+    while (0 == xioctl (self->fd, VIDIOC_ENUM_FRAMEINTERVALS, &frmival)) {
+        if (frmival.type == V4L2_FRMIVAL_TYPE_DISCRETE) {
+            item = Py_BuildValue("(NIIII)", fourcc_string(fourcc), w, h,
+                                 frmival.discrete.numerator,
+                                 frmival.discrete.denominator);
+        } else {
+            /* continuous/stepwise: the longest interval is the cheapest */
+            item = Py_BuildValue("(NIIII)", fourcc_string(fourcc), w, h,
+                                 frmival.stepwise.max.numerator,
+                                 frmival.stepwise.max.denominator);
+        }
+        PyList_Append(ret_list, item);
+        Py_DECREF(item);
+        if (frmival.type != V4L2_FRMIVAL_TYPE_DISCRETE)
+            return;
+        frmival.index++;
+    }
+
+    /* no interval enumeration available, frame rate left to the driver */
+    if (frmival.index == 0) {
+        item = Py_BuildValue("(NIIII)", fourcc_string(fourcc), w, h, 0, 0);
+        PyList_Append(ret_list, item);
+        Py_DECREF(item);
+    }
+}
+
+
+static PyObject*
+list_formats (PyDeviceObject *self)
+{
+/*
+    enumerate every capture mode supported by the (opened) device.
+
+    Returns a list of (fourcc, width, height, numerator, denominator) tuples,
+    where numerator/denominator is the frame interval in seconds (0/0 if the
+    driver doesn't enumerate intervals). Stepwise sizes are reported only with
+    their minimum size.
+
+*/
+    struct v4l2_fmtdesc fmtdesc;
+    struct v4l2_frmsizeenum frmsize;
+    PyObject* ret_list;
+
+    ret_list = PyList_New (0);
+    if (!ret_list)
+        return NULL;
+
+    CLEAR (fmtdesc);
+    fmtdesc.type = V4L2_BUF_TYPE_VIDEO_CAPTURE;
+
+    while (0 == xioctl (self->fd, VIDIOC_ENUM_FMT, &fmtdesc)) {
+        CLEAR (frmsize);
+        frmsize.pixel_format = fmtdesc.pixelformat;
+
+        while (0 == xioctl (self->fd, VIDIOC_ENUM_FRAMESIZES, &frmsize)) {
+            if (frmsize.type == V4L2_FRMSIZE_TYPE_DISCRETE) {
+                append_intervals (self, ret_list, fmtdesc.pixelformat,
+                                  frmsize.discrete.width,
+                                  frmsize.discrete.height);
+                frmsize.index++;
+            } else {
+                append_intervals (self, ret_list, fmtdesc.pixelformat,
+                                  frmsize.stepwise.min_width,
+                                  frmsize.stepwise.min_height);
+                break;
+            }
+        }
+        fmtdesc.index++;
+    }
+
+    if (errno != EINVAL) {
+        Py_DECREF(ret_list);
+        PyErr_SetObject(CameraError, format_error(errno, errno_msg("VIDIOC_ENUM_FMT")));
+        return NULL;
+    }
+
+    return Py_BuildValue("N", ret_list);
+}
+
+
+static PyObject*
+set_format (PyDeviceObject *self, PyObject *args)
+{
+/*
+    set capture mode to be used on next initialize().
+
+    Syntax: set_format(fourcc, width, height[, numerator, denominator])
+
+*/
+    char* code = NULL;
+    unsigned int w = 0, h = 0, num = 0, den = 0;
+
+    if (!PyArg_ParseTuple(args, "sII|II", &code, &w, &h, &num, &den))
+        /* raise PyErr (probably TypeError) */
+        return NULL;
+
+    if (strlen(code) != 4) {
+        PyErr_SetObject(CameraError, format_error(EINVAL, "Pixel format has to be a 4 chars code\n"));
+        return NULL;
+    }
+
+    self->fmt_pixfmt = v4l2_fourcc(code[0], code[1], code[2], code[3]);
+    self->fmt_width = w;
+    self->fmt_height = h;
+    self->fmt_num = num;
+    self->fmt_den = den;
+
+    Py_RETURN_NONE;
+}
+
+
+// get (fourcc, width, height) actually negotiated with the driver (zeros
+// before device initialization)
+static PyObject*
+get_format (PyDeviceObject *self)
+{
+    return Py_BuildValue("(Nii)", fourcc_string(self->pixfmt), self->width, self->height);
+}
+
+
+
+
 static PyMethodDef device_methods[] = {
     /* core-global */
     {"setName", (PyCFunction)device_set, METH_VARARGS,
@@ -896,6 +1095,12 @@ static PyMethodDef device_methods[] = {
      "Query given camera Device's control idx."},
     {"setCtrl", (PyCFunction)set_control, METH_VARARGS,
      "Set given camera Device's control idx."},
+    {"listFormats", (PyCFunction)list_formats, METH_NOARGS,
+     "List capture modes supported by given camera Device."},
+    {"setFormat", (PyCFunction)set_format, METH_VARARGS,
+     "Set capture mode to be used by given camera Device."},
+    {"getFormat", (PyCFunction)get_format, METH_NOARGS,
+     "Get capture mode currently used by camera module."},
     {NULL}
 };
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python2
+#
+#    usage - caliseControlBench.py [options] trace.csv [trace.csv] [...]
+#    descr - replays brightness percentages recorded by calise (the csv file
+#            written by the "record" option) through both the old
+#            average/lock step logic and the current step controller, then
+#            reports the number of backlight writes and the settling time
+#            after ambient step changes
+#
+#    Copyright (C)   2012   Nicolo' Barbon
+#
+#    This file is part of Calise.
+#
+#    Calise is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    Calise is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Calise.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from calise.system import controller
+from calise.backlight import stepFromPercentage
+
+
+def readTrace(path):
+    ''' (timestamp, percentage) list out of a calise csv record '''
+    trace = []
+    with open(path) as fp:
+        header = fp.readline().strip().split(',')
+        tix = header.index('Timestamp')
+        pix = header.index('Percentage')
+        for line in fp:
+            fields = line.strip().split(',')
+            if len(fields) == len(header):
+                trace.append((float(fields[tix]), float(fields[pix])))
+    trace.sort()
+    return trace
+
+
+def legacy(trace, args):
+    ''' Step sequence of the old logic: averaging window reset on jumps
+    greater than tol and 45 seconds lock after each write '''
+    percs = []
+    steps = []
+    cur = lock = None
+    for ts, pct in trace:
+        percs.append(pct)
+        if len(percs) > 1 and abs(percs[-1] - percs[-2]) > args.jump:
+            percs = percs[-1:]
+        stp = stepFromPercentage(
+            sum(percs) / len(percs), args.steps, args.bkofs, args.invert)
+        if lock is not None and ts - lock >= 45:
+            lock = None
+        if cur is None:
+            cur = stp
+        elif stp != cur and (
+            lock is None or len(percs) < 15 or abs(stp - cur) > 1):
+            cur = stp
+            lock = ts
+        steps.append(cur)
+        percs = percs[-args.avg:]
+    return steps
+
+
+def current(trace, args):
+    ''' Step sequence of the step controller '''
+    ctl = controller(
+        args.steps, args.bkofs, args.invert, args.band, args.tau, args.jump)
+    return [ctl.update(pct, ts) for ts, pct in trace]
+
+
+def evaluate(trace, steps, args):
+    ''' (writes, average settling time) of a step sequence
+
+    Settling time is measured from every ambient step change (jump greater
+    than args.jump with respect to the previous sample) to the first sample
+    whose step is within one step of the one of the average percentage over
+    the following args.window seconds.
+    '''
+    writes = sum(1 for idx in range(1, len(steps))
+                 if steps[idx] != steps[idx - 1])
+    settles = []
+    for idx in range(1, len(trace)):
+        if abs(trace[idx][1] - trace[idx - 1][1]) <= args.jump:
+            continue
+        ts = trace[idx][0]
+        window = [pct for t, pct in trace[idx:] if t - ts <= args.window]
+        ref = stepFromPercentage(
+            sum(window) / len(window), args.steps, args.bkofs, args.invert)
+        for jdx in range(idx, len(trace)):
+            if abs(steps[jdx] - ref) <= 1:
+                settles.append(trace[jdx][0] - ts)
+                break
+    if settles:
+        return writes, sum(settles) / len(settles), len(settles)
+    return writes, None, 0
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Compare backlight step logics on recorded traces")
+    ap.add_argument('traces', nargs='+', metavar='trace.csv')
+    ap.add_argument('--steps', type=int, default=10)
+    ap.add_argument('--bkofs', type=int, default=0)
+    ap.add_argument('--invert', action='store_true', default=False)
+    ap.add_argument('--avg', type=int, default=int(round((90 / 0.67), 0)))
+    ap.add_argument('--band', type=float, default=2.0)
+    ap.add_argument('--tau', type=float, default=30.0)
+    ap.add_argument('--jump', type=float, default=20.0)
+    ap.add_argument('--window', type=float, default=30.0)
+    args = ap.parse_args()
+    print '%-24s %8s %8s %10s' % (
+        'trace/logic', 'samples', 'writes', 'settle(s)')
+    for path in args.traces:
+        trace = readTrace(path)
+        if not trace:
+            sys.stderr.write("%s: no samples\n" % path)
+            continue
+        for name, func in (('legacy', legacy), ('controller', current)):
+            writes, settle, num = evaluate(trace, func(trace, args), args)
+            print '%-24s %8d %8d %10s' % (
+                '%s/%s' % (os.path.basename(path)[:13], name),
+                len(trace), writes,
+                '%.1f (%d)' % (settle, num) if settle is not None else '-')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())